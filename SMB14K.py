@@ -1,13 +1,13 @@
 import pygame
 import sys
+import time
 
-# Initialize Pygame
-pygame.init()
+from smb_display import Presenter, display_options
+from smb_timing import FrameScheduler
 
 # Constants
 WIDTH, HEIGHT = 256, 240  # NES resolution
-SCALE = 2  # Scale factor for modern displays
-SCREEN_WIDTH, SCREEN_HEIGHT = WIDTH * SCALE, HEIGHT * SCALE
+SCALE = 2  # Default window scale; override with --scale N and --filter scale2x
 FPS = 60
 
 # Colors
@@ -16,10 +16,17 @@ RED = (255, 0, 0)  # Mario
 BLUE = (0, 0, 255)  # Ground
 BROWN = (139, 69, 19)  # Goomba
 
-# Set up display
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Super Mario Bros. 1 - Pygame")
-clock = pygame.time.Clock()
+# The display is created in setup() so importing this module never opens a window.
+# Drawing happens at native resolution into screen; the presenter scales it to the window
+presenter = None
+screen = None
+
+def setup():
+    global presenter, screen
+    pygame.init()
+    scale, method = display_options(sys.argv[1:], SCALE)
+    presenter = Presenter(WIDTH, HEIGHT, scale, method, "Super Mario Bros. 1 - Pygame")
+    screen = presenter.frame
 
 # Mario properties
 mario_x = 50
@@ -52,7 +59,7 @@ class Goomba:
     def draw(self):
         screen_x = self.x - camera_x
         if 0 <= screen_x < WIDTH:
-            pygame.draw.rect(screen, BROWN, (screen_x * SCALE, self.y * SCALE, TILE_SIZE * SCALE, TILE_SIZE * SCALE))
+            pygame.draw.rect(screen, BROWN, (screen_x, self.y, TILE_SIZE, TILE_SIZE))
 
 # Initial enemies
 enemies = [Goomba(100, HEIGHT - 32)]
@@ -74,7 +81,7 @@ def handle_input():
 def draw_mario(x, y):
     screen_x = x - camera_x
     if 0 <= screen_x < WIDTH:
-        pygame.draw.rect(screen, RED, (screen_x * SCALE, y * SCALE, TILE_SIZE * SCALE, TILE_SIZE * SCALE))
+        pygame.draw.rect(screen, RED, (screen_x, y, TILE_SIZE, TILE_SIZE))
 
 def draw_level():
     for y, row in enumerate(level):
@@ -82,7 +89,7 @@ def draw_level():
             if tile == 1:
                 screen_x = x * TILE_SIZE - camera_x
                 if 0 <= screen_x < WIDTH:
-                    pygame.draw.rect(screen, BLUE, (screen_x * SCALE, y * TILE_SIZE * SCALE, TILE_SIZE * SCALE, TILE_SIZE * SCALE))
+                    pygame.draw.rect(screen, BLUE, (screen_x, y * TILE_SIZE, TILE_SIZE, TILE_SIZE))
 
 # Collision detection
 def check_collision(x, y):
@@ -98,57 +105,66 @@ def update_camera():
     if mario_x > WIDTH / 2:
         camera_x = mario_x - WIDTH / 2
 
-# Game loop
-def game_loop():
+# One fixed 1/FPS simulation step
+def update():
     global mario_x, mario_y, mario_vel_y, on_ground
+
+    # Handle input
+    handle_input()
+
+    # Update Mario's position
+    mario_x += mario_vel_x
+    mario_y += mario_vel_y
+    mario_vel_y += gravity
+
+    # Collision with ground
+    if mario_y + TILE_SIZE >= HEIGHT:
+        mario_y = HEIGHT - TILE_SIZE
+        mario_vel_y = 0
+        on_ground = True
+    elif check_collision(mario_x, mario_y + TILE_SIZE):
+        tile_y = int((mario_y + TILE_SIZE) // TILE_SIZE)
+        mario_y = tile_y * TILE_SIZE - TILE_SIZE
+        mario_vel_y = 0
+        on_ground = True
+    else:
+        on_ground = False
+
+    # Update enemies
+    for enemy in enemies:
+        enemy.update()
+
+    # Update camera
+    update_camera()
+    return True
+
+# Draw everything
+def render():
+    screen.fill(BLACK)
+    draw_level()
+    draw_mario(mario_x, mario_y)
+    for enemy in enemies:
+        enemy.draw()
+
+    # Scale and display
+    presenter.present()
+
+# Game loop: same fixed-timestep scheduler as the async ports
+def game_loop():
+    setup()
+    scheduler = FrameScheduler(update, render, FPS)
     running = True
     while running:
         # Event handling
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
-
-        # Handle input
-        handle_input()
-
-        # Update Mario's position
-        mario_x += mario_vel_x
-        mario_y += mario_vel_y
-        mario_vel_y += gravity
-
-        # Collision with ground
-        if mario_y + TILE_SIZE >= HEIGHT:
-            mario_y = HEIGHT - TILE_SIZE
-            mario_vel_y = 0
-            on_ground = True
-        elif check_collision(mario_x, mario_y + TILE_SIZE):
-            tile_y = int((mario_y + TILE_SIZE) // TILE_SIZE)
-            mario_y = tile_y * TILE_SIZE - TILE_SIZE
-            mario_vel_y = 0
-            on_ground = True
-        else:
-            on_ground = False
-
-        # Update enemies
-        for enemy in enemies:
-            enemy.update()
-
-        # Update camera
-        update_camera()
-
-        # Draw everything
-        screen.fill(BLACK)
-        draw_level()
-        draw_mario(mario_x, mario_y)
-        for enemy in enemies:
-            enemy.draw()
-
-        # Scale and display
-        scaled_screen = pygame.transform.scale(screen, (SCREEN_WIDTH, SCREEN_HEIGHT))
-        pygame.display.flip()
-
-        # Cap the frame rate
-        clock.tick(FPS)
+        if running:
+            running = scheduler.tick()
+        time.sleep(scheduler.idle_time())
+    timings = scheduler.report()
+    print(f"{timings['fps']:.1f} fps, frame {timings['frame_ms']:.2f} ms, "
+          f"update {timings['update_ms']:.2f} ms, render {timings['render_ms']:.2f} ms")
 
     pygame.quit()
     sys.exit()
@@ -1,296 +1,285 @@
 import asyncio
 import platform
+import sys
 import pygame
 
-# Initialize Pygame
-pygame.init()
+from smb_capture import WRITE_ERRORS, Capture, capture_option
+from smb_chr import (AREA_PALETTES, QUESTION_BLOCK_CYCLE, QUESTION_BLOCK_PERIOD, QUESTION_BLOCK_SLOT,
+                     ChrAtlas, area_palette, load_graphics)
+from smb_display import DirtyRects, Presenter, dirty_rects_option, display_options
+from smb_hud import Hud
+from smb_palette import (FADE_STEPS, GOOMBA_COLOR, MARIO_COLOR, SKY_COLOR, SLOT_PALETTE, TEXT_SLOT,
+                         TILE_PALETTE, PaletteRam)
+from smb_profile import ProfileOverlay, Profiler, profile_options
+from smb_render import LevelRenderer, TileAtlas, draw_sprites
+from smb_replay import Recording, record_option
+from smb_sim import Game, HEIGHT, INPUT_JUMP, INPUT_LEFT, INPUT_RIGHT, TILE_SIZE, WIDTH, to_pixels
+from smb_snapshot import Rewind
+from smb_timing import FrameScheduler
 
 # Constants
-WIDTH, HEIGHT = 256, 240  # NES resolution
-SCALE = 2
-SCREEN_WIDTH, SCREEN_HEIGHT = WIDTH * SCALE, HEIGHT * SCALE
+SCALE = 2  # Default window scale; override with --scale N and --filter scale2x
 FPS = 60
-TILE_SIZE = 16
-
-# Colors
-# NES Palette (NTSC, from ROM Detectives Wiki)
-# Each color is an (R, G, B) tuple
-NES_PALETTE = [
-    (124, 124, 124), (0, 0, 252), (0, 0, 188), (68, 40, 188), (148, 0, 132), (168, 0, 32), (168, 16, 0), (136, 20, 0),
-    (80, 48, 0), (0, 120, 0), (0, 104, 0), (0, 88, 0), (0, 64, 88), (0, 0, 0), (0, 0, 0), (0, 0, 0),
-    (188, 188, 188), (0, 120, 248), (0, 88, 248), (104, 68, 252), (216, 0, 204), (228, 0, 88), (248, 56, 0), (228, 92, 16),
-    (172, 124, 0), (0, 184, 0), (0, 168, 0), (0, 168, 68), (0, 136, 136), (0, 0, 0), (0, 0, 0), (0, 0, 0),
-    (248, 248, 248), (60, 188, 252), (104, 136, 252), (152, 120, 248), (248, 120, 248), (248, 88, 152), (248, 120, 88), (252, 160, 68),
-    (248, 184, 0), (184, 248, 24), (88, 216, 84), (88, 248, 152), (0, 232, 216), (120, 120, 120), (0, 0, 0), (0, 0, 0),
-    (252, 252, 252), (164, 228, 252), (184, 184, 248), (216, 184, 248), (248, 184, 248), (248, 164, 192), (240, 208, 176), (252, 224, 168),
-    (248, 216, 120), (216, 248, 120), (184, 248, 184), (184, 248, 216), (0, 252, 252), (248, 216, 248), (0, 0, 0), (0, 0, 0)
-]
-
-# Mapping game colors to NES palette indices (approximate choices)
-NES_BLACK = NES_PALETTE[0x0F] # True black
-NES_MARIO_RED = NES_PALETTE[0x16] # A good red for Mario
-NES_GROUND_BLUE = NES_PALETTE[0x12] # A dark blue for ground/bricks
-NES_GOOMBA_BROWN = NES_PALETTE[0x07] # Darker brown for Goomba
-NES_ITEM_YELLOW = NES_PALETTE[0x28] # Bright yellow for ? blocks and coins
-NES_PIPE_GREEN = NES_PALETTE[0x1A] # A green for pipes
-NES_EMPTY_BLOCK_GRAY = NES_PALETTE[0x00] # Dark gray for used blocks
-NES_SKY_BLUE = NES_PALETTE[0x31] # A light blue for sky (used as background)
-NES_WHITE = NES_PALETTE[0x30] # Brightest white
-
-BLACK = NES_BLACK
-RED = NES_MARIO_RED
-BLUE = NES_GROUND_BLUE
-BROWN = NES_GOOMBA_BROWN
-YELLOW = NES_ITEM_YELLOW
-GREEN = NES_PIPE_GREEN
-GRAY = NES_EMPTY_BLOCK_GRAY
-WHITE = NES_WHITE
-
-# Tile colors dictionary
-TILE_COLORS = {
-    0: BLACK,      # Empty
-    1: BLUE,       # Ground
-    2: GRAY,       # Empty block
-    3: YELLOW,     # Question block
-    4: GREEN,      # Pipe
-    5: YELLOW      # Coin
-}
-
-# Set up display
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Super Mario Bros. Expanded - Pygame")
-clock = pygame.time.Clock()
-font = pygame.font.Font(None, 36)
-
-# Game variables
-mario_x = 50
-mario_y = HEIGHT - TILE_SIZE
-mario_vel_x = 0
-mario_vel_y = 0
-gravity = 0.5
-jump_strength = -10
-on_ground = True
-camera_x = 0
-score = 0
-
-# Level design (100 tiles wide, 15 tiles high)
-level = [[0] * 100 for _ in range(15)]
-# Ground layer
-level[14] = [1] * 100
-# Platform at y=10, x=20-29
-for x in range(20, 30):
-    level[10][x] = 1
-# Question block and coin
-level[8][25] = 3    # Question block
-level[7][25] = 5    # Coin above it
-# Pit at x=40-49
-for x in range(40, 50):
-    level[14][x] = 0
-# Additional platform at y=8, x=60-70
-for x in range(60, 70):
-    level[8][x] = 1
-
-# Enemy class
-class Goomba:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.vel_x = -1
-        self.vel_y = 0
-        self.on_ground = False
-
-    def update(self):
-        # Apply gravity and movement
-        self.x += self.vel_x
-        self.y += self.vel_y
-        self.vel_y += gravity
-
-        # Vertical collision with solid tiles
-        potential_y = self.y + self.vel_y
-        enemy_rect = pygame.Rect(self.x, potential_y, TILE_SIZE, TILE_SIZE)
-        colliding_tiles = [tile for tile in get_overlapping_tiles(self.x, potential_y) if level[tile[1]][tile[0]] in [1, 2, 3, 4]]
-        if colliding_tiles and self.vel_y > 0:
-            topmost_tile_y = min(tile[1] for tile in colliding_tiles)
-            self.y = topmost_tile_y * TILE_SIZE - TILE_SIZE
-            self.vel_y = 0
-            self.on_ground = True
-        else:
-            self.y = potential_y
-            self.on_ground = False
-
-        # Turn around at edges
-        if self.on_ground:
-            tile_x_left = int((self.x - 1) // TILE_SIZE)
-            tile_x_right = int((self.x + TILE_SIZE) // TILE_SIZE)
-            tile_y_below = int((self.y + TILE_SIZE) // TILE_SIZE) + 1
-            if tile_y_below < len(level):
-                if self.vel_x < 0 and tile_x_left >= 0 and level[tile_y_below][tile_x_left] == 0:
-                    self.vel_x = 1
-                elif self.vel_x > 0 and tile_x_right < len(level[0]) and level[tile_y_below][tile_x_right] == 0:
-                    self.vel_x = -1
-
-    def draw(self):
-        screen_x = self.x - camera_x
-        if 0 <= screen_x < WIDTH:
-            pygame.draw.rect(screen, BROWN, (screen_x * SCALE, self.y * SCALE, TILE_SIZE * SCALE, TILE_SIZE * SCALE))
-
-# Initial enemies
-enemies = [Goomba(100, HEIGHT - TILE_SIZE), Goomba(150, HEIGHT - TILE_SIZE), Goomba(200, HEIGHT - TILE_SIZE)]
-
-# Helper functions
-def get_overlapping_tiles(x, y):
-    tiles = []
-    min_tile_x = int(x // TILE_SIZE)
-    max_tile_x = int((x + TILE_SIZE - 1) // TILE_SIZE)
-    min_tile_y = int(y // TILE_SIZE)
-    max_tile_y = int((y + TILE_SIZE - 1) // TILE_SIZE)
-    for ty in range(min_tile_y, max_tile_y + 1):
-        for tx in range(min_tile_x, max_tile_x + 1):
-            if 0 <= tx < len(level[0]) and 0 <= ty < len(level):
-                tiles.append((tx, ty))
-    return tiles
+# Push only changed regions to the window instead of flipping every frame;
+# on by default for the web build, override with --dirty-rects / --no-dirty-rects
+DIRTY_RECTS = platform.system() == "Emscripten"
+
+# Colors: NES palette indices. Everything is drawn in palette slots and
+# palette_ram turns the slots into these colours when the frame is presented,
+# so area palettes, the question block flash and fades never redraw anything
+BACKDROP = SKY_COLOR  # NES sky blue behind the flat-colour tiles
+AREA = "ground"  # ROM area palette at start; Tab steps through the others
+# Frames per fade step when the level ends
+FADE_FRAMES = 8
+
+# Flat-colour slots when there is no ROM dump: slot n is tile type n (the
+# empty tile is the backdrop, slot 0), then Mario and the Goomba
+MARIO_SLOT = len(TILE_PALETTE)
+GOOMBA_SLOT = MARIO_SLOT + 1
+FLAT_SLOTS = [BACKDROP] + [TILE_PALETTE[tile] for tile in range(1, MARIO_SLOT)] + [MARIO_COLOR, GOOMBA_COLOR]
+
+# Display and font are created in setup() so importing this module
+# (or running the simulation headless) never opens a window.
+# Everything is drawn at native NES resolution into screen and the presenter
+# scales it to the window in one step
+presenter = None
+screen = None
+font = None
+tile_atlas = None
+level_renderer = None
+mario_sprite = None
+goomba_sprite = None
+dirty = None  # DirtyRects when dirty-rectangle presentation is on
+hud = None
+graphics = None
+palette_ram = None
+area = AREA
+fade_frame = None  # frames since the end-of-level fade started
+# With --record PATH every step's input goes into recording, saved to PATH on exit
+record_path = None
+recording = None
+# The last few seconds of play; hold Backspace to rewind through them
+rewind = None
+# Timing zones around each stage of the frame; F3 toggles them and their
+# overlay, and with --trace PATH they are saved as a Chrome trace on exit
+profiler = None
+profile_overlay = None
+trace_path = None
+# With --capture PATH every presented frame is written to PATH by a background thread
+capture = None
+
+# Game state lives in the headless simulation; this module only draws it
+game = Game()
 
 def handle_input():
-    global mario_vel_x, mario_vel_y, on_ground
     keys = pygame.key.get_pressed()
-    mario_vel_x = 0
+    buttons = 0
     if keys[pygame.K_LEFT]:
-        mario_vel_x = -2
+        buttons |= INPUT_LEFT
     if keys[pygame.K_RIGHT]:
-        mario_vel_x = 2
-    if keys[pygame.K_SPACE] and on_ground:
-        mario_vel_y = jump_strength
-        on_ground = False
-
-def update_camera():
-    global camera_x
-    camera_x = max(0, min(mario_x - WIDTH / 2, len(level[0]) * TILE_SIZE - WIDTH))
+        buttons |= INPUT_RIGHT
+    if keys[pygame.K_SPACE]:
+        buttons |= INPUT_JUMP
+    return buttons
 
 def draw_level():
-    start_x = int(camera_x // TILE_SIZE)
-    end_x = min(start_x + int(WIDTH / TILE_SIZE) + 1, len(level[0]))
-    for y in range(len(level)):
-        for x in range(start_x, end_x):
-            tile = level[y][x]
-            if tile in TILE_COLORS:
-                screen_x = (x * TILE_SIZE - camera_x) * SCALE
-                pygame.draw.rect(screen, TILE_COLORS[tile], (screen_x, y * TILE_SIZE * SCALE, TILE_SIZE * SCALE, TILE_SIZE * SCALE))
+    changed = level_renderer.sync(game.tile_changes)
+    level_renderer.draw(screen, game.camera_x)
+    if dirty is not None:
+        if changed is None:
+            dirty.invalidate()
+        else:
+            for tile_x, tile_y in changed:
+                dirty.add((tile_x * TILE_SIZE - game.camera_x, tile_y * TILE_SIZE, TILE_SIZE, TILE_SIZE))
 
 def draw_mario():
-    screen_x = mario_x - camera_x
+    screen_x = to_pixels(game.mario_x) - game.camera_x
     if 0 <= screen_x < WIDTH:
-        pygame.draw.rect(screen, RED, (screen_x * SCALE, mario_y * SCALE, TILE_SIZE * SCALE, TILE_SIZE * SCALE))
-
-def mario_die():
-    global mario_x, mario_y, mario_vel_x, mario_vel_y, on_ground
-    mario_x = 50
-    mario_y = HEIGHT - TILE_SIZE
-    mario_vel_x = 0
-    mario_vel_y = 0
-    on_ground = True
+        rect = screen.blit(mario_sprite, (screen_x, to_pixels(game.mario_y)))
+        if dirty is not None:
+            dirty.add_sprite(rect)
+
+def draw_goombas():
+    enemies = game.enemies
+    n = enemies.count
+    rects = draw_sprites(screen, goomba_sprite, to_pixels(enemies.x[:n]), to_pixels(enemies.y[:n]),
+                         game.camera_x, doreturn=dirty is not None)
+    if dirty is not None:
+        for rect in rects:
+            dirty.add_sprite(rect)
+
+def draw_hud():
+    hud.set("score", game.score)
+    hud.set("coins", game.coins)
+    hud.set("world", *game.world)
+    hud.set("time", game.time_left())
+    changed = hud.draw(screen)
+    if dirty is not None:
+        for rect in changed:
+            dirty.add(rect)
 
 # Setup function
 def setup():
-    pass  # All initialization is done above for simplicity
-
-# Update loop
-def update_loop():
-    global mario_x, mario_y, mario_vel_y, on_ground, score
-
-    # Handle input
-    handle_input()
-
-    # Horizontal movement and collision
-    potential_x = mario_x + mario_vel_x
-    mario_rect = pygame.Rect(potential_x, mario_y, TILE_SIZE, TILE_SIZE)
-    colliding_tiles = [tile for tile in get_overlapping_tiles(potential_x, mario_y) if level[tile[1]][tile[0]] in [1, 2, 3, 4]]
-    if colliding_tiles:
-        if mario_vel_x > 0:
-            mario_x = min(tile[0] for tile in colliding_tiles) * TILE_SIZE - TILE_SIZE
-        elif mario_vel_x < 0:
-            mario_x = (max(tile[0] for tile in colliding_tiles) + 1) * TILE_SIZE
+    global presenter, screen, font, tile_atlas, level_renderer, mario_sprite, goomba_sprite, dirty, hud
+    global graphics, palette_ram, record_path, recording, rewind, profiler, profile_overlay, trace_path
+    global capture
+    pygame.init()
+    scale, method = display_options(sys.argv[1:], SCALE)
+    presenter = Presenter(WIDTH, HEIGHT, scale, method, "Super Mario Bros. Expanded - Pygame", indexed=True)
+    screen = presenter.frame
+    if dirty_rects_option(sys.argv[1:], DIRTY_RECTS):
+        dirty = DirtyRects(WIDTH, HEIGHT)
+    record_path = record_option(sys.argv[1:])
+    if record_path is not None:
+        recording = Recording(game)
+    rewind = Rewind(game)
+    capture_path = capture_option(sys.argv[1:])
+    if capture_path is not None:
+        capture = Capture(capture_path, WIDTH, HEIGHT)
+    font = pygame.font.Font(None, 18)
+    # Status bar glyphs and labels are rendered once here, never per frame
+    hud = Hud(font, TEXT_SLOT, palette=SLOT_PALETTE)
+    # Pre-rendered tiles and cached level chunks: the ROM's graphics when the
+    # dump is there, flat colours otherwise
+    try:
+        graphics = load_graphics()
+    except (OSError, ValueError):
+        graphics = None
+    if graphics is not None:
+        tile_atlas = ChrAtlas(graphics)
+        mario_sprite = tile_atlas.sprites["mario"]
+        goomba_sprite = tile_atlas.sprites["goomba"]
+        palette_ram = PaletteRam(area_palette(graphics, area))
+        palette_ram.cycle(QUESTION_BLOCK_SLOT, QUESTION_BLOCK_CYCLE, QUESTION_BLOCK_PERIOD)
     else:
-        mario_x = potential_x
-
-    # Vertical movement and collision
-    potential_y = mario_y + mario_vel_y
-    mario_rect = pygame.Rect(mario_x, potential_y, TILE_SIZE, TILE_SIZE)
-    colliding_tiles = [tile for tile in get_overlapping_tiles(mario_x, potential_y) if level[tile[1]][tile[0]] in [1, 2, 3, 4]]
-    if colliding_tiles:
-        if mario_vel_y > 0:
-            topmost_tile_y = min(tile[1] for tile in colliding_tiles)
-            mario_y = topmost_tile_y * TILE_SIZE - TILE_SIZE
-            mario_vel_y = 0
-            on_ground = True
-        elif mario_vel_y < 0:
-            bottommost_tile_y = max(tile[1] for tile in colliding_tiles)
-            mario_y = (bottommost_tile_y + 1) * TILE_SIZE
-            mario_vel_y = 0
-            # Check for question block activation
-            for tx, ty in colliding_tiles:
-                if level[ty][tx] == 3:
-                    level[ty][tx] = 2  # Change to empty block
-                    score += 100
-    else:
-        mario_y = potential_y
-        on_ground = False
-
-    # Apply gravity
-    mario_vel_y += gravity
-
-    # Check for pit death
-    if mario_y > HEIGHT:
-        mario_die()
-
-    # Update enemies
-    for enemy in enemies[:]:
-        enemy.update()
-
-    # Enemy collision with Mario
-    mario_rect = pygame.Rect(mario_x, mario_y, TILE_SIZE, TILE_SIZE)
-    for enemy in enemies[:]:
-        enemy_rect = pygame.Rect(enemy.x, enemy.y, TILE_SIZE, TILE_SIZE)
-        if mario_rect.colliderect(enemy_rect):
-            if mario_vel_y > 0 and mario_rect.bottom <= enemy_rect.top + 5:
-                enemies.remove(enemy)
-                score += 100
-                mario_vel_y = jump_strength / 2
-            else:
-                mario_die()
-
-    # Check for level completion
-    if mario_x >= (len(level[0]) - 1) * TILE_SIZE:
+        tile_atlas = TileAtlas({tile: tile for tile in TILE_PALETTE}, TILE_SIZE, palette=SLOT_PALETTE)
+        mario_sprite = tile_atlas.make_surface((TILE_SIZE, TILE_SIZE))
+        mario_sprite.fill(MARIO_SLOT)
+        goomba_sprite = tile_atlas.make_surface((TILE_SIZE, TILE_SIZE))
+        goomba_sprite.fill(GOOMBA_SLOT)
+        palette_ram = PaletteRam(FLAT_SLOTS)
+    level_renderer = LevelRenderer(game.level, tile_atlas, ChrAtlas.BACKDROP)
+    profiler = Profiler()
+    namespace = globals()
+    profiler.instrument(namespace, "handle_input", "input")
+    profiler.instrument(game, "step", "physics")
+    profiler.instrument(game.enemies, "update", "enemies")
+    profiler.instrument(game.grid, "solid_extent", "collision")
+    profiler.instrument(game.grid, "solid_extents", "collision")
+    profiler.instrument(rewind, "push", "rewind")
+    profiler.instrument(namespace, "draw_level")
+    profiler.instrument(namespace, "draw_mario", "draw_sprites")
+    profiler.instrument(namespace, "draw_goombas", "draw_sprites")
+    profiler.instrument(namespace, "draw_hud")
+    profiler.instrument(presenter, "present")
+    if capture is not None:
+        profiler.instrument(capture, "grab", "capture")
+    profile_overlay = ProfileOverlay(profiler, pygame.font.Font(None, 12), TEXT_SLOT, ChrAtlas.BACKDROP, SLOT_PALETTE)
+    profiling, trace_path = profile_options(sys.argv[1:])
+    if profiling:
+        profiler.enable()
+
+def next_area():
+    # Swap in the next ROM area palette: one palette load, nothing is redrawn
+    global area
+    if graphics is None:
+        return
+    areas = list(AREA_PALETTES)
+    area = areas[(areas.index(area) + 1) % len(areas)]
+    palette_ram.load(area_palette(graphics, area))
+
+def toggle_profiler():
+    profiler.toggle()
+    if dirty is not None:
+        # The overlay appears or goes away over whatever was drawn under it
+        dirty.invalidate()
+
+# Update loop: one fixed 1/FPS simulation step with this step's keys
+def update_loop():
+    global fade_frame
+    if fade_frame is not None:
+        # Fade to black, then end the game
+        fade_frame += 1
+        palette_ram.set_fade(fade_frame // FADE_FRAMES)
+        return fade_frame < FADE_STEPS * FADE_FRAMES
+    if recording is None and pygame.key.get_pressed()[pygame.K_BACKSPACE]:
+        # A recording holds inputs only, so rewinding is off while recording
+        rewind.back()
+        palette_ram.tick()
+        return True
+    buttons = handle_input()
+    if not (game.step(buttons) if recording is None else recording.step(game, buttons)):
         print("Level Complete")
-        return False  # End the game
-
-    # Update camera
-    update_camera()
+        fade_frame = 0
+    rewind.push()
+    palette_ram.tick()
+    return True
 
-    # Draw everything
-    screen.fill(NES_SKY_BLUE) # Changed from BLACK to a sky blue color
+# Render the current game state
+def render():
+    # The whole frame is redrawn at native resolution; only presentation is incremental
+    if dirty is not None:
+        dirty.scroll(game.camera_x)
+    presenter.clear(ChrAtlas.BACKDROP)
     draw_level()
     draw_mario()
-    for enemy in enemies:
-        enemy.draw()
-
-    # Draw score
-    score_text = font.render(f"Score: {score}", True, WHITE)
-    screen.blit(score_text, (10, 10))
-
-    # Scale and display
-    pygame.display.flip()
-    return True
+    draw_goombas()
+    draw_hud()
+    if profiler.enabled:
+        rect = profile_overlay.draw(screen)
+        if dirty is not None:
+            dirty.add(rect)
+
+    # Scale and display; a changed palette repaints the whole window
+    presenter.set_palette(palette_ram.colors())
+    presenter.present(None if dirty is None else dirty.take())
+    if capture is not None:
+        grab_frame()
+
+# Hand the presented frame to the capture writer; if writing has failed the
+# game says so and carries on without capturing
+def grab_frame():
+    global capture
+    try:
+        capture.grab(presenter.pixels, presenter.colors)
+    except WRITE_ERRORS as error:
+        print(f"capture stopped after {capture.written} frames: {error}")
+        capture = None
 
 # Main async game loop
 async def main():
     setup()
+    scheduler = FrameScheduler(update_loop, render, FPS)
+    profiler.instrument(scheduler, "update", "update_loop")
+    profiler.instrument(scheduler, "render")
     running = True
     while running:
+        profiler.frame()
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
-        running = update_loop()
-        await asyncio.sleep(1.0 / FPS)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_TAB:
+                next_area()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                toggle_profiler()
+        if running:
+            running = scheduler.tick()
+        # Sleep until the next step is due; on Emscripten this also yields to the browser
+        await asyncio.sleep(scheduler.idle_time())
+    if recording is not None:
+        recording.finish(game)
+        recording.save(record_path)
+    if trace_path is not None:
+        profiler.save_trace(trace_path)
+    if capture is not None:
+        try:
+            capture.close()
+            print(f"captured {capture.captured} frames, dropped {capture.dropped}")
+        except WRITE_ERRORS as error:
+            print(f"capture stopped after {capture.written} frames: {error}")
+    timings = scheduler.report()
+    print(f"{timings['fps']:.1f} fps, frame {timings['frame_ms']:.2f} ms, "
+          f"update {timings['update_ms']:.2f} ms, render {timings['render_ms']:.2f} ms")
 
 # Run the game
 if platform.system() == "Emscripten":
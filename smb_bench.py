@@ -0,0 +1,242 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from smb_fixed import SUBPIXEL_BITS
+from smb_sim import HEIGHT, INPUT_JUMP, INPUT_RIGHT, TILE_SIZE, WIDTH, Game, build_level
+
+# Benchmark harness: scripted scenarios run for a fixed number of frames while
+# the time spent in each stage is recorded per frame, reported as frames per
+# second and p50/p99 frame times, and saved as JSON so runs on two commits can
+# be compared with --compare. Stages nest: "step" is the whole Game.step() and
+# includes "enemies" (EnemyManager.update) and "collision" (the grid's tile
+# queries, Mario's and the enemies'). The render scenario runs the game script
+# itself, so it needs pygame but no display: SDL_VIDEODRIVER defaults to dummy.
+#
+#   python smb_bench.py [scenario ...] [--frames N] [--output FILE] [--compare FILE]
+
+FRAMES = 600
+GAME_SCRIPT = "SMB14KX.X.X.py"
+# Goomba counts for the goombas_N scenarios
+GOOMBA_COUNTS = (10, 100, 1000)
+# Mario one tile above the ground row; MARIO_START overlaps it
+STANDING_Y = (HEIGHT - 2 * TILE_SIZE) << SUBPIXEL_BITS
+
+
+class StageTimer:
+    """Time spent per frame in named stages.
+
+    wrap(stage, function) returns function with its time added to the stage;
+    end_frame() files this frame's totals as one sample per stage.
+    """
+
+    def __init__(self, stages):
+        self.totals = dict.fromkeys(stages, 0.0)
+        self.samples = {stage: [] for stage in stages}
+
+    def wrap(self, stage, function):
+        totals = self.totals
+        clock = time.perf_counter
+
+        def timed(*args):
+            start = clock()
+            result = function(*args)
+            totals[stage] += clock() - start
+            return result
+        return timed
+
+    def end_frame(self):
+        totals = self.totals
+        for stage, total in totals.items():
+            self.samples[stage].append(total)
+            totals[stage] = 0.0
+
+    def summary(self):
+        results = {}
+        for stage, samples in self.samples.items():
+            times = np.sort(np.array(samples))
+            mean = times.mean()
+            results[stage] = {
+                "fps": round(1.0 / mean, 1) if mean else None,
+                "mean_ms": round(mean * 1000, 4),
+                "p50_ms": round(np.percentile(times, 50) * 1000, 4),
+                "p99_ms": round(np.percentile(times, 99) * 1000, 4),
+            }
+        return results
+
+
+def bridged_level():
+    # The built-in level with its pit filled: the pit is wider than a jump
+    # carries Mario, and the right-run has to reach the end
+    level = build_level()
+    level[14][40:50] = [1] * 10
+    return level
+
+
+def crowd_spawns(count):
+    # count Goombas spread over the first screen, on the ground
+    return [(16 + i * (WIDTH - 32) // count, HEIGHT - 2 * TILE_SIZE) for i in range(count)]
+
+
+def refill(game, count):
+    # Goombas walk off the level and get stomped; top the crowd back up to count
+    enemies = game.enemies
+    spawns = crowd_spawns(count)
+    while enemies.count < count:
+        x, y = spawns[enemies.next_id % count]
+        enemies.add(x << SUBPIXEL_BITS, y << SUBPIXEL_BITS)
+
+
+def instrument(game, timer):
+    # Route the game's enemy update and tile queries into their stages
+    game.enemies.update = timer.wrap("enemies", game.enemies.update)
+    grid = game.grid
+    grid.solid_extent = timer.wrap("collision", grid.solid_extent)
+    grid.solid_extents = timer.wrap("collision", grid.solid_extents)
+    return timer.wrap("step", game.step)
+
+
+def run_headless(frames, new_game, buttons, crowd=0):
+    # Step instrumented games with buttons(frame), starting a new one whenever
+    # the level ends, with crowd Goombas alive at the start of every frame
+    timer = StageTimer(("step", "enemies", "collision"))
+    step = None
+    for frame in range(frames):
+        if step is None:
+            game = new_game()
+            step = instrument(game, timer)
+        if crowd:
+            refill(game, crowd)
+        if not step(buttons(frame)):
+            step = None
+        timer.end_frame()
+    return timer.summary()
+
+
+def idle(frames):
+    return run_headless(frames, Game, lambda frame: 0)
+
+
+def right_run(frames):
+    # Run and jump right through the whole level, over and over
+    def new_game():
+        game = Game(bridged_level())
+        game.mario_y = STANDING_Y
+        return game
+    return run_headless(frames, new_game, lambda frame: INPUT_RIGHT | INPUT_JUMP)
+
+
+def goombas(count):
+    def scenario(frames):
+        return run_headless(frames, lambda: Game(spawns=[]), lambda frame: 0, count)
+    return scenario
+
+
+def load_game_script():
+    # The game script's module, set up with a window on the dummy driver
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    spec = importlib.util.spec_from_file_location("smb_game", os.path.join(os.path.dirname(__file__), GAME_SCRIPT))
+    module = importlib.util.module_from_spec(spec)
+    argv = sys.argv
+    sys.argv = [spec.origin]
+    try:
+        spec.loader.exec_module(module)
+        module.setup()
+    finally:
+        sys.argv = argv
+    return module
+
+
+def render(frames):
+    # The game script's update_loop() and render(), on the right-run
+    import pygame
+
+    script = load_game_script()
+    timer = StageTimer(("update_loop", "render", "draw_level", "draw_sprites", "draw_hud", "present"))
+    script.handle_input = lambda: INPUT_RIGHT | INPUT_JUMP
+    script.draw_level = timer.wrap("draw_level", script.draw_level)
+    script.draw_mario = timer.wrap("draw_sprites", script.draw_mario)
+    script.draw_goombas = timer.wrap("draw_sprites", script.draw_goombas)
+    script.draw_hud = timer.wrap("draw_hud", script.draw_hud)
+    script.presenter.present = timer.wrap("present", script.presenter.present)
+    update_loop = timer.wrap("update_loop", script.update_loop)
+    draw = timer.wrap("render", script.render)
+    for frame in range(frames):
+        if script.fade_frame is not None or frame == 0:
+            # Level over (or first frame): start the right-run again
+            script.game = Game(bridged_level())
+            script.game.mario_y = STANDING_Y
+            script.level_renderer = script.LevelRenderer(script.game.level, script.tile_atlas,
+                                                         script.ChrAtlas.BACKDROP)
+            script.rewind = script.Rewind(script.game)
+            script.fade_frame = None
+            script.palette_ram.set_fade(0)
+        pygame.event.pump()
+        update_loop()
+        draw()
+        timer.end_frame()
+    pygame.quit()
+    return timer.summary()
+
+
+SCENARIOS = {"idle": idle, "right_run": right_run}
+SCENARIOS.update((f"goombas_{count}", goombas(count)) for count in GOOMBA_COUNTS)
+SCENARIOS["render"] = render
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    # p50 of every stage both runs have, old -> new
+    for name, stages in new["scenarios"].items():
+        for stage, result in stages.items():
+            before = old.get("scenarios", {}).get(name, {}).get(stage)
+            if before is not None and before["p50_ms"]:
+                print(f"{name:>13} {stage:>12}: p50 {before['p50_ms']:.4f} -> {result['p50_ms']:.4f} ms "
+                      f"({result['p50_ms'] / before['p50_ms']:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run benchmark scenarios and report per-stage frame times.")
+    parser.add_argument("scenarios", nargs="*",
+                        help=f"scenarios to run, from {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--frames", type=int, default=FRAMES)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    options = parser.parse_args()
+    for name in options.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name!r}")
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "frames": options.frames,
+        "scenarios": {},
+    }
+    for name in options.scenarios or SCENARIOS:
+        results["scenarios"][name] = stages = SCENARIOS[name](options.frames)
+        for stage, result in stages.items():
+            print(f"{name:>13} {stage:>12}: {result['fps'] or 0:10.0f} fps, p50 {result['p50_ms']:.4f} ms, "
+                  f"p99 {result['p99_ms']:.4f} ms")
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,49 @@
+# Broad-phase spatial hash for one-tile entities. Entity ids are bucketed by the
+# tile column of their left edge; two boxes one tile wide can only overlap when
+# their columns differ by at most one, so a query touches three buckets and the
+# cost follows local density rather than the total entity count.
+
+
+class ColumnHash:
+    def __init__(self, tile_size):
+        self.tile_size = tile_size
+        self.buckets = {}
+        self.column_of = {}
+
+    def __len__(self):
+        return len(self.column_of)
+
+    def column(self, x):
+        return int(x // self.tile_size)
+
+    def insert(self, entity_id, column):
+        self.column_of[entity_id] = column
+        bucket = self.buckets.get(column)
+        if bucket is None:
+            self.buckets[column] = bucket = set()
+        bucket.add(entity_id)
+
+    def remove(self, entity_id):
+        column = self.column_of.pop(entity_id)
+        bucket = self.buckets[column]
+        bucket.discard(entity_id)
+        if not bucket:
+            del self.buckets[column]
+
+    def move(self, entity_id, column):
+        if self.column_of[entity_id] != column:
+            self.remove(entity_id)
+            self.insert(entity_id, column)
+
+    def clear(self):
+        self.buckets.clear()
+        self.column_of.clear()
+
+    def near(self, x):
+        # Ids of every entity that could overlap a one-tile box at x
+        column = self.column(x)
+        buckets = self.buckets
+        for c in (column - 1, column, column + 1):
+            bucket = buckets.get(c)
+            if bucket:
+                yield from bucket
@@ -0,0 +1,245 @@
+import argparse
+import os
+import queue
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+# Gameplay capture that never holds up the frame. grab() copies the native
+# 8-bit frame (palette slots, see Presenter) into one buffer of a
+# preallocated ring and queues it with the palette it was shown with; a
+# writer thread XORs each frame with the one before, compresses the result
+# with zlib and appends it to the capture file. The XOR leaves zeros wherever
+# the picture did not change, which is most of a scrolling NES frame, and
+# both NumPy and zlib release the GIL on the whole buffer, so the writer runs
+# beside the game rather than between its frames. When every buffer is still
+# waiting for the writer the frame is dropped and counted instead: grab()
+# never waits. The frame numbers in the file show where frames are missing.
+# If writing fails (a full disk, an I/O error) the writer stops and keeps the
+# exception, and the next grab() or close() raises it in the game's thread.
+#
+#   python smb_capture.py CAPTURE [--png DIR]   decode a capture, optionally to PNGs
+
+MAGIC = b"SMBC"
+VERSION = 1
+# magic, version, width, height
+HEADER = struct.Struct("<4sHHH")
+# Frame number, flags, compressed length; then the palette (PALETTE flag) and the frame
+RECORD = struct.Struct("<IBI")
+KEY = 1
+PALETTE = 2
+# A key frame (compressed as is, not as a delta, and with its palette) this
+# often, so a capture can be read from any key frame
+KEY_INTERVAL = 300
+# Frames that can wait for the writer: about an eighth of a second at 60 fps
+RING_FRAMES = 8
+# zlib level: the fastest one still takes an unchanged frame down to a few bytes
+COMPRESS_LEVEL = 1
+# What a failed write raises, for callers that carry on without capturing
+WRITE_ERRORS = (OSError, zlib.error)
+
+
+def capture_option(argv):
+    # --capture PATH from the command line, or None
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--capture", default=None)
+    options, _ = parser.parse_known_args(argv)
+    return options.capture
+
+
+class Capture:
+    """Frames written to a capture file by a background thread.
+
+    grab(pixels, colors) once per presented frame, with the frame's slot
+    bytes and its 256-colour palette; close() writes out what is queued.
+    captured and dropped count the frames that were grabbed and skipped.
+    Both raise the writer's exception once it has failed; the file is then
+    closed, with the frames written before the failure.
+    """
+
+    def __init__(self, path, width, height, ring_frames=RING_FRAMES):
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self.buffers = [bytearray(self.size) for _ in range(ring_frames)]
+        # Ring slot numbers the main thread may fill, and filled slots for the
+        # writer as (slot, frame number, palette); None tells it to stop
+        self.free = queue.SimpleQueue()
+        for slot in range(ring_frames):
+            self.free.put(slot)
+        self.filled = queue.SimpleQueue()
+        self.frame = 0
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0
+        self.error = None
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, width, height))
+        self.thread = threading.Thread(target=self._write, name="capture", daemon=True)
+        self.thread.start()
+
+    def grab(self, pixels, colors):
+        # colors is kept, not copied: PaletteRam.colors() hands out a new list
+        # whenever the palette changes and never changes one it handed out
+        if self.error is not None:
+            raise self.error
+        frame = self.frame
+        self.frame += 1
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        self.buffers[slot][:] = pixels
+        self.filled.put((slot, frame, colors))
+        self.captured += 1
+        return True
+
+    def _write(self):
+        # Closing flushes the file, so it can fail too
+        try:
+            try:
+                self._write_frames()
+            finally:
+                self.file.close()
+        except Exception as error:
+            self.error = error
+
+    def _write_frames(self):
+        previous = np.zeros(self.size, dtype=np.uint8)
+        delta = np.empty_like(previous)
+        shown = None
+        last_key = None
+        while True:
+            item = self.filled.get()
+            if item is None:
+                break
+            slot, frame, colors = item
+            pixels = np.frombuffer(self.buffers[slot], dtype=np.uint8)
+            flags = 0
+            if last_key is None or frame - last_key >= KEY_INTERVAL:
+                flags |= KEY
+                last_key = frame
+                data = zlib.compress(pixels, COMPRESS_LEVEL)
+            else:
+                np.bitwise_xor(pixels, previous, out=delta)
+                data = zlib.compress(delta, COMPRESS_LEVEL)
+            previous[:] = pixels
+            self.free.put(slot)
+            palette = b""
+            if colors is not shown or flags & KEY:
+                shown = colors
+                flags |= PALETTE
+                palette = bytes(channel for color in colors for channel in color[:3])
+            self.file.write(RECORD.pack(frame, flags, len(data)))
+            self.file.write(palette)
+            self.file.write(data)
+            self.written += 1
+
+    def close(self):
+        # Waits for the writer to finish the frames already queued
+        if self.thread.is_alive():
+            self.filled.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def read_capture(path, start=0):
+    # (frame number, 256 RGB tuples, width x height uint8 slot array) for each
+    # frame in a capture, from the first key frame at or after frame start
+    with open(path, "rb") as f:
+        magic, version, width, height = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} capture")
+        pixels = np.zeros((height, width), dtype=np.uint8)
+        colors = None
+        while True:
+            record = f.read(RECORD.size)
+            if len(record) < RECORD.size:
+                return
+            frame, flags, length = RECORD.unpack(record)
+            if colors is None and not (flags & KEY and frame >= start):
+                # Before the first frame wanted: skipped without decoding
+                f.seek(length + (256 * 3 if flags & PALETTE else 0), os.SEEK_CUR)
+                continue
+            if flags & PALETTE:
+                channels = f.read(256 * 3)
+                colors = [tuple(channels[i:i + 3]) for i in range(0, len(channels), 3)]
+            data = np.frombuffer(zlib.decompress(f.read(length)), dtype=np.uint8).reshape(height, width)
+            if flags & KEY:
+                pixels = data.copy()
+            else:
+                pixels ^= data
+            yield frame, colors, pixels
+
+
+def save_png(path, colors, pixels):
+    import pygame
+
+    surface = pygame.image.frombuffer(np.ascontiguousarray(pixels).tobytes(), pixels.shape[::-1], "P")
+    surface.set_palette(colors)
+    pygame.image.save(surface, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode a capture file, or time capturing a scrolling level.")
+    parser.add_argument("capture", nargs="?", help="capture file to decode (default: benchmark)")
+    parser.add_argument("--png", help="write each frame to this directory as a PNG")
+    parser.add_argument("--frames", type=int, default=1200)
+    options = parser.parse_args()
+
+    if options.capture is not None:
+        frames = 0
+        last = -1
+        missing = 0
+        for frame, colors, pixels in read_capture(options.capture):
+            missing += frame - last - 1
+            last = frame
+            frames += 1
+            if options.png:
+                os.makedirs(options.png, exist_ok=True)
+                save_png(os.path.join(options.png, f"{frame:06d}.png"), colors, pixels)
+        print(f"{frames} frames, {missing} dropped")
+        sys.exit()
+
+    # Benchmark: the level scrolling by two pixels a frame, drawn in flat
+    # tile slots, grabbed at 60 fps and then as fast as grab() takes them
+    from smb_palette import NES_PALETTE
+    from smb_sim import HEIGHT, TILE_SIZE, WIDTH, build_level
+
+    level = np.kron(np.array(build_level(), dtype=np.uint8), np.ones((TILE_SIZE, TILE_SIZE), dtype=np.uint8))
+    scroll = level.shape[1] - WIDTH
+    colors = list(NES_PALETTE[:64]) + [(0, 0, 0)] * 192
+    source = [np.ascontiguousarray(level[:, x % scroll:x % scroll + WIDTH]).tobytes()
+              for x in range(0, options.frames * 2, 2)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "capture.smbc")
+        for label, interval in (("60 fps", 1 / 60), ("unpaced", 0)):
+            capture = Capture(path, WIDTH, HEIGHT)
+            grab_time = 0.0
+            next_frame = time.perf_counter()
+            for pixels in source:
+                start = time.perf_counter()
+                capture.grab(pixels, colors)
+                grab_time += time.perf_counter() - start
+                next_frame += interval
+                time.sleep(max(0.0, next_frame - time.perf_counter()))
+            capture.close()
+            size = os.path.getsize(path)
+            print(f"{label}: grab {grab_time / len(source) * 1e6:.1f} us/frame, {capture.captured} captured, "
+                  f"{capture.dropped} dropped, {size // 1024} KB ({size / max(1, capture.captured):.0f} bytes/frame, "
+                  f"raw {WIDTH * HEIGHT})")
+        # The last capture decodes back to the frames that were grabbed, also
+        # when read from a later key frame
+        for start in (0, KEY_INTERVAL + 1):
+            decoded = 0
+            for frame, frame_colors, pixels in read_capture(path, start):
+                assert pixels.tobytes() == source[frame] and frame_colors == colors, frame
+                decoded += 1
+            print(f"decoded {decoded} frames from frame {start}: match")
@@ -0,0 +1,194 @@
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+import pygame
+
+from smb_palette import PALETTE_SLOTS, SLOT_PALETTE, SPRITE_SLOTS, TRANSPARENT
+from smb_render import TileAtlas
+from smb_rom import ROM_DUMP, Rom, build_cache
+
+# Graphics from the ROM. CHR-ROM stores each 8x8 tile as two bitplanes;
+# decode_chr() unpacks all 512 tiles into 2-bit pixels in one NumPy pass, and
+# the game's 16x16 metatiles and sprites are assembled from them using the
+# ROM's own metatile and palette tables. Assembled pixels are PPU palette slots
+# (4 * palette + colour, sprites from 16), so colours are applied by the
+# palette (smb_palette.PaletteRam) and recolouring never touches pixel data.
+# The assembled arrays are cached on disk next to the ROM image.
+
+# PRG-ROM tables (CPU addresses)
+METATILE_POINTERS = 0x8B08  # MetatileGraphics_Low, followed by MetatileGraphics_High
+# Water, Ground, Underground and CastlePaletteData, past each one's PPU address
+# and length bytes
+AREA_PALETTES = {"water": 0x8CA7, "ground": 0x8CCB, "underground": 0x8CEF, "castle": 0x8D13}
+# The backdrop colour the game sets per area instead of the palette's own slot 0
+AREA_BACKDROPS = {"water": 0x22, "ground": 0x22, "underground": 0x0F, "castle": 0x0F}
+
+# The question block flash: background palette 3, colour 1, stepped every 8 frames
+QUESTION_BLOCK_SLOT = 13
+QUESTION_BLOCK_CYCLE = (0x27, 0x27, 0x27, 0x17, 0x07, 0x17)
+QUESTION_BLOCK_PERIOD = 8
+
+# Background patterns are the second CHR pattern table
+BACKGROUND_TILES = 0x100
+METATILE_SIZE = 16
+
+# SMB1 metatile per tile type: ground, used block, question block, pipe shaft, coin
+TILE_METATILES = {1: 0x54, 2: 0xC4, 3: 0xC0, 4: 0x14, 5: 0xC2}
+# Sprite tiles (top-left, top-right, bottom-left, bottom-right) and sprite palette
+SPRITES = {
+    "mario": ((0x32, 0x33, 0x34, 0x35), 0),
+    "goomba": ((0x70, 0x71, 0x72, 0x73), 3),
+}
+
+# Atlas cache: ROM image stamp and format version, then the arrays of
+# build_graphics() back to back in CACHE_LAYOUT order
+CACHE_VERSION = 2
+CACHE_HEADER = struct.Struct("<QI")
+CACHE_LAYOUT = (
+    ("metatiles", (len(TILE_METATILES), METATILE_SIZE, METATILE_SIZE)),
+    ("sprites", (len(SPRITES), METATILE_SIZE, METATILE_SIZE)),
+    ("palettes", (len(AREA_PALETTES), PALETTE_SLOTS)),
+)
+
+
+def decode_chr(data):
+    # (tiles, 8, 8) array of 2-bit pixels from CHR data: each tile is 8 bytes
+    # of low bitplane then 8 bytes of high bitplane, one byte per row
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(-1, 2, 8)
+    bits = np.unpackbits(planes[:, :, :, np.newaxis], axis=3)
+    return bits[:, 0] | (bits[:, 1] << 1)
+
+
+def _assemble(patterns, tiles, column_major):
+    # (n, 16, 16) blocks from an (n, 4) array of tile numbers
+    blocks = patterns[tiles].reshape(-1, 2, 2, 8, 8)
+    if column_major:
+        blocks = blocks.transpose(0, 2, 1, 3, 4)
+    return blocks.transpose(0, 1, 3, 2, 4).reshape(-1, METATILE_SIZE, METATILE_SIZE)
+
+
+def build_graphics(rom):
+    # Metatile and sprite pixel arrays plus the palette of every area (in
+    # AREA_PALETTES order) from a Rom
+    patterns = decode_chr(rom.chr)
+    pointers = bytes(rom.prg_slice(METATILE_POINTERS, 8))
+    tiles = []
+    palettes = []
+    for metatile in TILE_METATILES.values():
+        palette = metatile >> 6
+        table = pointers[palette] | (pointers[palette + 4] << 8)
+        # Stored top-left, bottom-left, top-right, bottom-right
+        tiles.append(bytes(rom.prg_slice(table + (metatile & 0x3F) * 4, 4)))
+        palettes.append(palette)
+    tiles = np.frombuffer(b"".join(tiles), dtype=np.uint8).reshape(-1, 4).astype(np.intp) + BACKGROUND_TILES
+    pixels = _assemble(patterns, tiles, column_major=True)
+    # Background colour 0 is the shared backdrop, slot 0
+    metatiles = np.where(pixels == 0, 0, pixels + 4 * np.array(palettes, dtype=np.uint8)[:, None, None])
+
+    tiles = np.array([sprite_tiles for sprite_tiles, _ in SPRITES.values()], dtype=np.intp)
+    palettes = np.array([SPRITE_SLOTS + 4 * palette for _, palette in SPRITES.values()], dtype=np.uint8)
+    pixels = _assemble(patterns, tiles, column_major=False)
+    sprites = np.where(pixels == 0, TRANSPARENT, pixels + palettes[:, None, None])
+
+    palettes = b"".join(bytes(rom.prg_slice(address, PALETTE_SLOTS)) for address in AREA_PALETTES.values())
+    return {
+        "metatiles": metatiles.astype(np.uint8),
+        "sprites": sprites.astype(np.uint8),
+        "palettes": np.frombuffer(palettes, dtype=np.uint8).reshape(len(AREA_PALETTES), PALETTE_SLOTS),
+    }
+
+
+def _read_cache(path, stamp):
+    # The cached arrays, or None when the file is missing or out of date
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < CACHE_HEADER.size or CACHE_HEADER.unpack_from(data) != (stamp, CACHE_VERSION):
+        return None
+    graphics = {}
+    offset = CACHE_HEADER.size
+    for name, shape in CACHE_LAYOUT:
+        size = int(np.prod(shape))
+        if len(data) < offset + size:
+            return None
+        graphics[name] = np.frombuffer(data, dtype=np.uint8, count=size, offset=offset).reshape(shape)
+        offset += size
+    return graphics
+
+
+def load_graphics(dump=ROM_DUMP):
+    # build_graphics() output for the dump, from the on-disk cache when it is
+    # current for the ROM image
+    rom_path = build_cache(dump)
+    cache = os.path.splitext(rom_path)[0] + ".chr"
+    stamp = os.stat(rom_path).st_mtime_ns
+    graphics = _read_cache(cache, stamp)
+    if graphics is not None:
+        return graphics
+    with Rom(rom_path) as rom:
+        graphics = build_graphics(rom)
+    # Write then rename, so an interrupted build never leaves a truncated cache
+    partial = cache + ".tmp"
+    with open(partial, "wb") as f:
+        f.write(CACHE_HEADER.pack(stamp, CACHE_VERSION))
+        for name, _ in CACHE_LAYOUT:
+            f.write(graphics[name].tobytes())
+    os.replace(partial, cache)
+    return graphics
+
+
+def area_palette(graphics, area):
+    # Palette slots of an area with the game's backdrop colour for it
+    slots = [int(index) for index in graphics["palettes"][list(AREA_PALETTES).index(area)]]
+    slots[0] = AREA_BACKDROPS[area]
+    return slots
+
+
+class ChrAtlas(TileAtlas):
+    """TileAtlas of ROM metatiles, plus the sprite surfaces in sprites.
+
+    Every surface is 8-bit with pixels in palette slots and SLOT_PALETTE as
+    its palette, so tiles, level chunks (filled with BACKDROP) and sprites
+    all reach a slot-indexed frame as byte copies, and the colours are
+    chosen only when the frame is presented.
+    """
+
+    BACKDROP = 0
+
+    def __init__(self, graphics, scale=1):
+        super().__init__({}, METATILE_SIZE, scale, SLOT_PALETTE)
+        self.surfaces = {tile: self.image(pixels) for tile, pixels in zip(TILE_METATILES, graphics["metatiles"])}
+        self.sprites = {name: self.image(pixels, TRANSPARENT) for name, pixels in zip(SPRITES, graphics["sprites"])}
+
+    def image(self, pixels, colorkey=None):
+        height, width = pixels.shape
+        surface = self.make_surface((width, height))
+        pygame.surfarray.blit_array(surface, pixels.T)
+        if self.scale != 1:
+            surface = pygame.transform.scale(surface, (width * self.scale, height * self.scale))
+        if colorkey is not None:
+            surface.set_colorkey(colorkey, pygame.RLEACCEL)
+        return surface
+
+
+if __name__ == "__main__":
+    # Decode and cache timings: python smb_chr.py [dump]
+    dump = sys.argv[1] if len(sys.argv) > 1 else ROM_DUMP
+    with Rom(build_cache(dump)) as rom:
+        start = time.perf_counter()
+        patterns = decode_chr(rom.chr)
+        decoded = time.perf_counter() - start
+        start = time.perf_counter()
+        build_graphics(rom)
+        built = time.perf_counter() - start
+    load_graphics(dump)
+    start = time.perf_counter()
+    load_graphics(dump)
+    cached = time.perf_counter() - start
+    print(f"decode {len(patterns)} tiles {decoded * 1000:.3f} ms, build atlases {built * 1000:.3f} ms, "
+          f"load cached atlases {cached * 1000:.3f} ms")
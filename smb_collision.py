@@ -0,0 +1,110 @@
+import numpy as np
+
+from smb_fixed import SUBPIXEL_BITS
+
+# Tile collision backed by a uint8 tile grid and a precomputed solidity mask.
+# Every entity is one tile in size, so its box overlaps at most 2x2 tiles and a
+# query is four lookups into the mask instead of building and filtering a list.
+# Positions are fixed-point (see smb_fixed), so tile lookups are shifts.
+
+TILE_SIZE = 16
+# Tiles Mario and enemies cannot pass through
+SOLID_TILES = frozenset((1, 2, 3, 4))
+
+
+class CollisionGrid:
+    def __init__(self, level, solid_tiles=SOLID_TILES, tile_size=TILE_SIZE):
+        self.tile_size = tile_size
+        # Fixed-point position -> tile index is a right shift (tile_size is a power of two)
+        self.tile_shift = tile_size.bit_length() - 1 + SUBPIXEL_BITS
+        # From a box's edge to the first subpixel of its last pixel
+        self.reach = (tile_size - 1) << SUBPIXEL_BITS
+        self.tiles = np.array(level, dtype=np.uint8)
+        self.height, self.width = self.tiles.shape
+        self.solid_lut = np.zeros(256, dtype=bool)
+        self.solid_lut[list(solid_tiles)] = True
+        # The mask covers level columns first_column..last_column: the whole
+        # level plus a one-tile non-solid border. Out-of-range lookups are
+        # clamped onto the border, so queries never need bounds checks
+        self.first_column = -1
+        self.last_column = self.width
+        self.solid = np.zeros((self.height + 2, self.width + 2), dtype=bool)
+        self.solid[1:-1, 1:-1] = self.solid_lut[self.tiles]
+        # Zero-copy view of the mask whose scalar reads return plain ints
+        self.solid_view = memoryview(self.solid.view(np.uint8))
+
+    def set_tile(self, tx, ty, tile):
+        self.tiles[ty, tx] = tile
+        if self.first_column <= tx <= self.last_column:
+            self.solid[ty + 1, tx - self.first_column] = self.solid_lut[tile]
+
+    def refresh(self, start, stop):
+        # Rebuild the mask for level columns start..stop after tiles were written directly
+        first = self.first_column
+        start, stop = max(start, first, 0), min(stop, self.last_column + 1, self.width)
+        if start < stop:
+            self.solid[1:-1, start - first:stop - first] = self.solid_lut[self.tiles[:, start:stop]]
+
+    def stream(self, camera_x):
+        # The whole level is resident; see smb_level.StreamingGrid
+        pass
+
+    def is_solid(self, tx, ty):
+        first = self.first_column
+        return bool(self.solid_view[min(max(ty, -1), self.height) + 1, min(max(tx, first), self.last_column) - first])
+
+    def solid_extent(self, x, y):
+        # Column and row extent (min_tx, max_tx, min_ty, max_ty) of the solid
+        # tiles overlapped by the box at fixed-point (x, y), or None when nothing is hit
+        shift = self.tile_shift
+        min_tx = x >> shift
+        max_tx = (x + self.reach) >> shift
+        min_ty = y >> shift
+        max_ty = (y + self.reach) >> shift
+        first, last = self.first_column, self.last_column
+        if first <= min_tx and max_tx <= last and -1 <= min_ty and max_ty <= self.height:
+            c0, c1, r0, r1 = min_tx - first, max_tx - first, min_ty + 1, max_ty + 1
+        else:
+            c0 = min(max(min_tx, first), last) - first
+            c1 = min(max(max_tx, first), last) - first
+            r0 = min(max(min_ty, -1), self.height) + 1
+            r1 = min(max(max_ty, -1), self.height) + 1
+        solid = self.solid_view
+        top_left = solid[r0, c0]
+        top_right = solid[r0, c1]
+        bottom_left = solid[r1, c0]
+        bottom_right = solid[r1, c1]
+        if not (top_left or top_right or bottom_left or bottom_right):
+            return None
+        return (min_tx if top_left or bottom_left else max_tx,
+                max_tx if top_right or bottom_right else min_tx,
+                min_ty if top_left or top_right else max_ty,
+                max_ty if bottom_left or bottom_right else min_ty)
+
+    def solid_extents(self, xs, ys):
+        # Batched solid_extent for integer arrays of box positions. Returns
+        # (hit, min_tx, max_tx, min_ty, max_ty) arrays; extents are only
+        # meaningful where hit is True
+        shift = self.tile_shift
+        min_tx = xs >> shift
+        max_tx = (xs + self.reach) >> shift
+        min_ty = ys >> shift
+        max_ty = (ys + self.reach) >> shift
+        # np.minimum/np.maximum rather than np.clip, whose Python-level wrapper
+        # dominates the cost for small batches
+        first, last = self.first_column, self.last_column
+        c0 = np.minimum(np.maximum(min_tx, first), last) - first
+        c1 = np.minimum(np.maximum(max_tx, first), last) - first
+        r0 = np.minimum(np.maximum(min_ty, -1), self.height) + 1
+        r1 = np.minimum(np.maximum(max_ty, -1), self.height) + 1
+        solid = self.solid
+        top_left = solid[r0, c0]
+        top_right = solid[r0, c1]
+        bottom_left = solid[r1, c0]
+        bottom_right = solid[r1, c1]
+        hit = top_left | top_right | bottom_left | bottom_right
+        return (hit,
+                np.where(top_left | bottom_left, min_tx, max_tx),
+                np.where(top_right | bottom_right, max_tx, min_tx),
+                np.where(top_left | top_right, min_ty, max_ty),
+                np.where(bottom_left | bottom_right, max_ty, min_ty))
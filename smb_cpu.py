@@ -0,0 +1,541 @@
+import sys
+import time
+
+# 6502 interpreter for the NES CPU (no decimal mode), running the ROM's own
+# program. Instructions are not dispatched one opcode at a time: the first
+# time execution reaches an address, the straight-line code from there is
+# decoded once and compiled into a Python function (a block) with the
+# operands, addressing and cycle counts already resolved, and every later
+# visit is a dict lookup and one call. A block runs on to the next jump,
+# subroutine call or return; a conditional branch becomes an early exit, so
+# loops stay inside one block as far as possible.
+#
+# Registers live in local variables inside a block and on the Cpu between
+# blocks. Flags are kept unpacked: c, v, i and d are 0 or 1, z is zero when
+# the Z flag is set and n holds a value whose bit 7 is the N flag, so most
+# instructions set both with a single "n = z = result".
+
+NMI_VECTOR = 0xFFFA
+RESET_VECTOR = 0xFFFC
+IRQ_VECTOR = 0xFFFE
+INTERRUPT_CYCLES = 7
+
+# Instructions compiled into one block at most
+MAX_BLOCK_INSTRUCTIONS = 48
+
+# Operand bytes per addressing mode
+OPERAND_SIZES = {
+    "imp": 0, "acc": 0, "imm": 1, "zp": 1, "zpx": 1, "zpy": 1, "rel": 1,
+    "izx": 1, "izy": 1, "abs": 2, "abx": 2, "aby": 2, "ind": 2,
+}
+
+# opcode: (mnemonic, addressing mode, base cycles), official opcodes only
+OPCODES = {}
+# ORA, AND, EOR, ADC, STA, LDA, CMP and SBC share one opcode layout
+for _base, _name in enumerate(("ORA", "AND", "EOR", "ADC", "STA", "LDA", "CMP", "SBC")):
+    for _offset, _mode, _cycles in ((0x09, "imm", 2), (0x05, "zp", 3), (0x15, "zpx", 4), (0x0D, "abs", 4),
+                                    (0x1D, "abx", 4), (0x19, "aby", 4), (0x01, "izx", 6), (0x11, "izy", 5)):
+        if _name == "STA":
+            if _mode == "imm":
+                continue
+            _cycles = {"abx": 5, "aby": 5, "izy": 6}.get(_mode, _cycles)
+        OPCODES[_base * 0x20 + _offset] = (_name, _mode, _cycles)
+# ASL, ROL, LSR and ROR likewise, and INC and DEC on memory
+for _base, _name in ((0x00, "ASL"), (0x20, "ROL"), (0x40, "LSR"), (0x60, "ROR"), (0xC0, "DEC"), (0xE0, "INC")):
+    if _name not in ("DEC", "INC"):
+        OPCODES[_base + 0x0A] = (_name, "acc", 2)
+    for _offset, _mode, _cycles in ((0x06, "zp", 5), (0x16, "zpx", 6), (0x0E, "abs", 6), (0x1E, "abx", 7)):
+        OPCODES[_base + _offset] = (_name, _mode, _cycles)
+OPCODES.update({
+    0x24: ("BIT", "zp", 3), 0x2C: ("BIT", "abs", 4),
+    0x10: ("BPL", "rel", 2), 0x30: ("BMI", "rel", 2), 0x50: ("BVC", "rel", 2), 0x70: ("BVS", "rel", 2),
+    0x90: ("BCC", "rel", 2), 0xB0: ("BCS", "rel", 2), 0xD0: ("BNE", "rel", 2), 0xF0: ("BEQ", "rel", 2),
+    0x00: ("BRK", "imp", 7), 0x20: ("JSR", "abs", 6), 0x40: ("RTI", "imp", 6), 0x60: ("RTS", "imp", 6),
+    0x4C: ("JMP", "abs", 3), 0x6C: ("JMP", "ind", 5),
+    0x18: ("CLC", "imp", 2), 0x38: ("SEC", "imp", 2), 0x58: ("CLI", "imp", 2), 0x78: ("SEI", "imp", 2),
+    0xB8: ("CLV", "imp", 2), 0xD8: ("CLD", "imp", 2), 0xF8: ("SED", "imp", 2),
+    0xE0: ("CPX", "imm", 2), 0xE4: ("CPX", "zp", 3), 0xEC: ("CPX", "abs", 4),
+    0xC0: ("CPY", "imm", 2), 0xC4: ("CPY", "zp", 3), 0xCC: ("CPY", "abs", 4),
+    0xA2: ("LDX", "imm", 2), 0xA6: ("LDX", "zp", 3), 0xB6: ("LDX", "zpy", 4), 0xAE: ("LDX", "abs", 4),
+    0xBE: ("LDX", "aby", 4),
+    0xA0: ("LDY", "imm", 2), 0xA4: ("LDY", "zp", 3), 0xB4: ("LDY", "zpx", 4), 0xAC: ("LDY", "abs", 4),
+    0xBC: ("LDY", "abx", 4),
+    0x86: ("STX", "zp", 3), 0x96: ("STX", "zpy", 4), 0x8E: ("STX", "abs", 4),
+    0x84: ("STY", "zp", 3), 0x94: ("STY", "zpx", 4), 0x8C: ("STY", "abs", 4),
+    0xCA: ("DEX", "imp", 2), 0x88: ("DEY", "imp", 2), 0xE8: ("INX", "imp", 2), 0xC8: ("INY", "imp", 2),
+    0xAA: ("TAX", "imp", 2), 0xA8: ("TAY", "imp", 2), 0xBA: ("TSX", "imp", 2), 0x8A: ("TXA", "imp", 2),
+    0x9A: ("TXS", "imp", 2), 0x98: ("TYA", "imp", 2),
+    0x48: ("PHA", "imp", 3), 0x08: ("PHP", "imp", 3), 0x68: ("PLA", "imp", 4), 0x28: ("PLP", "imp", 4),
+    0xEA: ("NOP", "imp", 2),
+})
+
+# Reads that take a cycle longer when indexing crosses a page
+PAGE_PENALTY = {"ORA", "AND", "EOR", "ADC", "LDA", "CMP", "SBC", "LDX", "LDY"}
+# Branch condition on the unpacked flags
+BRANCHES = {
+    "BPL": "not n & 0x80", "BMI": "n & 0x80", "BVC": "not v", "BVS": "v",
+    "BCC": "not c", "BCS": "c", "BNE": "z", "BEQ": "not z",
+}
+# Register locals a block may load from and store back to the Cpu
+REGISTERS = ("a", "x", "y", "s", "c", "v", "n", "z", "i", "d")
+
+# Status register packing: bit 5 always reads as set, B (0x10) only in pushed copies
+PACK_STATUS = "(n & 0x80 | v << 6 | 0x20 | d << 3 | i << 2 | (not z) << 1 | c)"
+UNPACK_STATUS = ["n = t", "v = t >> 6 & 1", "d = t >> 3 & 1", "i = t >> 2 & 1", "z = ~t & 2", "c = t & 1"]
+
+# Memory reached through a runtime address
+GENERIC_READ = "(ram[t & 0x7FF] if t < 0x2000 else read(t))"
+GENERIC_STORE = ["if t < 0x2000:", "    ram[t & 0x7FF] = {0}", "else:", "    write(t, {0})"]
+
+
+class Operand:
+    """How one instruction reaches its memory operand.
+
+    setup computes the address (into t) when it is only known at run time,
+    read is an expression for the value and store a list of statement
+    templates writing {0}. io is set when the access may reach an I/O
+    register, so the block brings cpu.cycles up to date first.
+    """
+
+    def __init__(self, setup, read, store, io=False):
+        self.setup = setup
+        self.read = read
+        self.store = store
+        self.io = io
+
+
+class Cpu:
+    """The NES CPU: 2 KB of RAM, 8 KB of cartridge RAM and an NROM PRG-ROM.
+
+    Everything from $2000 to $5FFF goes to io_read(address) and
+    io_write(address, value), which see cpu.cycles up to date. run(until)
+    executes whole blocks until cycles reaches until, so it may run a few
+    cycles over; nmi() and set_irq() take effect between blocks.
+    """
+
+    __slots__ = REGISTERS + (
+        "pc", "cycles", "until", "ram", "sram", "prg", "io_read", "io_write", "blocks", "ram_blocks",
+        "nmi_pending", "irq_line", "interrupt", "compiled", "idle_cycles",
+    )
+
+    def __init__(self, prg, io_read=None, io_write=None):
+        prg = bytes(prg)
+        if len(prg) not in (0x4000, 0x8000):
+            raise ValueError(f"PRG-ROM of {len(prg)} bytes; only 16 or 32 KB NROM images are supported")
+        # A 16 KB PRG-ROM appears at both $8000 and $C000
+        self.prg = prg * (0x8000 // len(prg))
+        self.ram = bytearray(0x800)
+        self.sram = bytearray(0x2000)
+        self.io_read = io_read or (lambda address: 0)
+        self.io_write = io_write or (lambda address, value: None)
+        # Compiled blocks by start address; blocks in RAM are kept with the
+        # code bytes they were compiled from and recompiled when those change
+        self.blocks = {}
+        self.ram_blocks = {}
+        self.compiled = 0
+        self.a = self.x = self.y = 0
+        self.c = self.v = self.d = 0
+        self.n = 0
+        self.z = 1
+        self.i = 1
+        self.s = 0  # reset() leaves it at $FD, as on power-up
+        self.pc = 0
+        self.cycles = 0
+        self.until = 0
+        # Cycles passed over by idle loops rather than executed
+        self.idle_cycles = 0
+        self.nmi_pending = False
+        self.irq_line = False
+        self.interrupt = False
+        self.reset()
+
+    def reset(self):
+        self.s = (self.s - 3) & 0xFF
+        self.i = 1
+        self.pc = self.read_word(RESET_VECTOR)
+        self.cycles += INTERRUPT_CYCLES
+
+    # Bus
+
+    def read(self, address):
+        if address < 0x2000:
+            return self.ram[address & 0x7FF]
+        if address >= 0x8000:
+            return self.prg[address - 0x8000]
+        if address >= 0x6000:
+            return self.sram[address - 0x6000]
+        return self.io_read(address)
+
+    def write(self, address, value):
+        if address < 0x2000:
+            self.ram[address & 0x7FF] = value
+        elif address >= 0x8000:
+            pass  # NROM has no registers; writes to ROM are ignored
+        elif address >= 0x6000:
+            self.sram[address - 0x6000] = value
+        else:
+            self.io_write(address, value)
+
+    def peek(self, address):
+        # Memory without I/O side effects, for the decoder
+        if 0x2000 <= address < 0x6000:
+            raise ValueError(f"cannot execute from I/O space at ${address:04X}")
+        return self.read(address)
+
+    def read_word(self, address):
+        return self.peek(address) | self.peek((address + 1) & 0xFFFF) << 8
+
+    @property
+    def status(self):
+        return self.n & 0x80 | self.v << 6 | 0x20 | self.d << 3 | self.i << 2 | (not self.z) << 1 | self.c
+
+    @status.setter
+    def status(self, t):
+        self.n, self.v, self.d, self.i, self.z, self.c = t, t >> 6 & 1, t >> 3 & 1, t >> 2 & 1, ~t & 2, t & 1
+
+    # Interrupts
+
+    def nmi(self):
+        self.nmi_pending = True
+        self.interrupt = True
+
+    def set_irq(self, level):
+        self.irq_line = level
+        self.interrupt = level or self.nmi_pending
+
+    def _service_interrupt(self, pc):
+        # Take a pending NMI, or the IRQ when it is not masked; returns the new pc
+        if self.nmi_pending:
+            self.nmi_pending = False
+            vector = NMI_VECTOR
+        elif self.irq_line and not self.i:
+            vector = IRQ_VECTOR
+        else:
+            return pc
+        self.interrupt = self.irq_line
+        ram = self.ram
+        s = self.s
+        ram[0x100 + s] = pc >> 8
+        ram[0x100 + (s - 1 & 0xFF)] = pc & 0xFF
+        ram[0x100 + (s - 2 & 0xFF)] = self.status
+        self.s = s - 3 & 0xFF
+        self.i = 1
+        self.cycles += INTERRUPT_CYCLES
+        return self.read_word(vector)
+
+    # Execution
+
+    def run(self, until):
+        # Execute blocks until cycles reaches until
+        self.until = until
+        blocks = self.blocks
+        pc = self.pc
+        while self.cycles < until:
+            if self.interrupt:
+                pc = self._service_interrupt(pc)
+            block = blocks.get(pc)
+            if block is None:
+                block = self._block(pc)
+            pc = block()
+        self.pc = pc
+
+    def _block(self, pc):
+        if pc >= 0x8000:
+            block = self.blocks[pc] = self._compile(pc)
+            return block
+        # Code in RAM may have been rewritten since it was compiled, even by
+        # the instruction before, so it is compiled an instruction at a time
+        entry = self.ram_blocks.get(pc)
+        if entry is not None:
+            block, code = entry
+            if bytes(self.peek(pc + k) for k in range(len(code))) == code:
+                return block
+        block = self._compile(pc, 1)
+        self.ram_blocks[pc] = (block, block.code)
+        return block
+
+    def _compile(self, start, limit=MAX_BLOCK_INSTRUCTIONS):
+        source, code = compile_block(self, start, limit)
+        namespace = {}
+        exec(source, namespace)
+        block = namespace["make"](self, self.ram, self.sram, self.prg, self.read, self.write)
+        block.code = code
+        block.source = source
+        self.compiled += 1
+        return block
+
+
+def _constant_operand(cpu, address):
+    # Operand at an address known when compiling; ROM contents are folded in
+    if address < 0x2000:
+        return Operand([], f"ram[{address & 0x7FF}]", [f"ram[{address & 0x7FF}] = {{0}}"])
+    if address >= 0x8000:
+        return Operand([], str(cpu.prg[address - 0x8000]), [])
+    if address >= 0x6000:
+        return Operand([], f"sram[{address - 0x6000}]", [f"sram[{address - 0x6000}] = {{0}}"])
+    return Operand([], f"read({address})", [f"write({address}, {{0}})"], io=True)
+
+
+def _indexed_operand(base, index):
+    # Operand at base + index register, by the memory region base..base + 255 lies in
+    last = base + 0xFF
+    if last < 0x2000:
+        return Operand([f"t = ({base} + {index}) & 0x7FF"], "ram[t]", ["ram[t] = {0}"])
+    if base >= 0x8000 and last <= 0xFFFF:
+        return Operand([f"t = {base - 0x8000} + {index}"], "prg[t]", [])
+    if base >= 0x6000 and last < 0x8000:
+        return Operand([f"t = {base - 0x6000} + {index}"], "sram[t]", ["sram[t] = {0}"])
+    return Operand([f"t = ({base} + {index}) & 0xFFFF"], GENERIC_READ, GENERIC_STORE, io=True)
+
+
+def _operand(cpu, name, mode, value):
+    # Operand of an instruction with operand bytes value; page-crossing reads add a cycle
+    penalty = name in PAGE_PENALTY
+    if mode == "imm":
+        return Operand([], str(value), [])
+    if mode == "zp":
+        return Operand([], f"ram[{value}]", [f"ram[{value}] = {{0}}"])
+    if mode in ("zpx", "zpy"):
+        return Operand([f"t = ({value} + {mode[2]}) & 0xFF"], "ram[t]", ["ram[t] = {0}"])
+    if mode == "abs":
+        return _constant_operand(cpu, value)
+    if mode in ("abx", "aby"):
+        index = mode[2]
+        operand = _indexed_operand(value, index)
+        if penalty and value & 0xFF:
+            operand.setup.insert(0, f"if {index} > {0xFF - (value & 0xFF)}: cpu.cycles += 1")
+        return operand
+    if mode == "izx":
+        setup = [f"t = ({value} + x) & 0xFF", "t = ram[t] | ram[(t + 1) & 0xFF] << 8"]
+    else:
+        setup = [f"t = ram[{value}] | ram[{(value + 1) & 0xFF}] << 8"]
+        if penalty:
+            setup.append("if (t & 0xFF) + y > 0xFF: cpu.cycles += 1")
+        setup.append("t = (t + y) & 0xFFFF")
+    return Operand(setup, GENERIC_READ, GENERIC_STORE, io=True)
+
+
+def _push(value):
+    return [f"ram[0x100 + s] = {value}", "s = (s - 1) & 0xFF"]
+
+
+def _pull(target):
+    return ["s = (s + 1) & 0xFF", f"{target} = ram[0x100 + s]"]
+
+
+def _semantics(name, operand):
+    # Statements for an instruction and the registers they assign
+    m = operand.read if operand is not None else None
+    if name in ("LDA", "LDX", "LDY"):
+        r = name[2].lower()
+        return [f"{r} = n = z = {m}"], r + "nz"
+    if name in ("STA", "STX", "STY"):
+        return [line.format(name[2].lower()) for line in operand.store], ""
+    if name in ("AND", "ORA", "EOR"):
+        op = {"AND": "&", "ORA": "|", "EOR": "^"}[name]
+        return [f"a = n = z = a {op} {m}"], "anz"
+    if name in ("ADC", "SBC"):
+        invert = " ^ 0xFF" if name == "SBC" else ""
+        return [f"m = {m}{invert}", "t = a + m + c", "v = (~(a ^ m) & (a ^ t)) >> 7 & 1", "c = t >> 8",
+                "a = n = z = t & 0xFF"], "avcnz"
+    if name in ("CMP", "CPX", "CPY"):
+        r = {"CMP": "a", "CPX": "x", "CPY": "y"}[name]
+        return [f"t = {r} - {m} + 0x100", "c = t >> 8", "n = z = t & 0xFF"], "cnz"
+    if name == "BIT":
+        return [f"m = {m}", "z = a & m", "n = m", "v = m >> 6 & 1"], "znv"
+    if name in ("ASL", "LSR", "ROL", "ROR"):
+        shift = {
+            "ASL": ["c = m >> 7", "m = (m << 1) & 0xFF"],
+            "LSR": ["c = m & 1", "m >>= 1"],
+            "ROL": ["m = m << 1 | c", "c = m >> 8", "m &= 0xFF"],
+            "ROR": ["m |= c << 8", "c = m & 1", "m >>= 1"],
+        }[name]
+        if operand is None:
+            return ["m = a"] + shift + ["a = n = z = m"], "acnz"
+        return [f"m = {m}"] + shift + ["n = z = m"] + [line.format("m") for line in operand.store], "cnz"
+    if name in ("INC", "DEC"):
+        step = "+ 1" if name == "INC" else "- 1"
+        return [f"m = n = z = ({m} {step}) & 0xFF"] + [line.format("m") for line in operand.store], "nz"
+    if name in ("INX", "INY", "DEX", "DEY"):
+        r = name[2].lower()
+        step = "+ 1" if name[0] == "I" else "- 1"
+        return [f"{r} = n = z = ({r} {step}) & 0xFF"], r + "nz"
+    if name in ("TAX", "TAY", "TXA", "TYA", "TSX"):
+        source, target = name[1].lower(), name[2].lower()
+        return [f"{target} = n = z = {source}"], target + "nz"
+    if name == "TXS":
+        return ["s = x"], "s"
+    if name in ("CLC", "SEC", "CLI", "SEI", "CLV", "CLD", "SED"):
+        return [f"{name[2].lower()} = {int(name[0] == 'S')}"], name[2].lower()
+    if name == "PHA":
+        return _push("a"), "s"
+    if name == "PHP":
+        return _push(PACK_STATUS + " | 0x10"), "s"
+    if name == "PLA":
+        return _pull("a") + ["n = z = a"], "asnz"
+    if name == "PLP":
+        return _pull("t") + UNPACK_STATUS, "snvdizc"
+    if name == "NOP":
+        return [], ""
+    raise ValueError(f"no semantics for {name}")
+
+
+class _BlockSource:
+    # Python source of a block as it is built, with cycle and register bookkeeping
+
+    def __init__(self):
+        self.lines = []
+        self.cycles = 0  # cycles since cpu.cycles was last brought up to date
+        self.written = set()
+
+    def emit(self, lines, indent=1):
+        self.lines.extend("    " * indent + line for line in lines)
+
+    def flush(self):
+        if self.cycles:
+            self.emit([f"cpu.cycles += {self.cycles}"])
+            self.cycles = 0
+
+    def exit(self, target, cycles, indent=1):
+        # Store the registers written so far, count the cycles and return the next pc
+        stores = [f"cpu.{r} = {r}" for r in REGISTERS if r in self.written]
+        total = self.cycles + cycles
+        self.emit(stores + ([f"cpu.cycles += {total}"] if total else []) + [f"return {target}"], indent)
+
+
+def compile_block(cpu, start, limit=MAX_BLOCK_INSTRUCTIONS):
+    # (source, code bytes) of the block of at most limit instructions starting
+    # at start. The source defines make(cpu, ram, sram, prg, read, write),
+    # which returns the block function
+    block = _BlockSource()
+    pc = start
+    ended = False
+    for count in range(limit):
+        opcode = cpu.peek(pc)
+        if opcode not in OPCODES:
+            if pc == start:
+                raise ValueError(f"unsupported opcode ${opcode:02X} at ${pc:04X}")
+            # Only reached if execution really gets here; the block that starts
+            # at this address reports it
+            break
+        name, mode, cycles = OPCODES[opcode]
+        size = OPERAND_SIZES[mode]
+        value = 0
+        for k in range(size):
+            value |= cpu.peek((pc + 1 + k) & 0xFFFF) << 8 * k
+        next_pc = (pc + 1 + size) & 0xFFFF
+
+        if name == "JMP" and mode == "abs":
+            if value == pc and count == 0:
+                # Idle loop (JMP to itself): nothing changes until an
+                # interrupt, and those only arrive between run() calls, so
+                # skip straight to the end of this run in whole iterations
+                block.emit(["t = cpu.until - cpu.cycles", "t = 3 if t <= 3 else t + (-t) % 3",
+                            "cpu.cycles += t", "cpu.idle_cycles += t - 3", f"return {pc}"])
+            else:
+                block.exit(value, cycles)
+            ended = True
+        elif name == "JMP":
+            # The pointer's high byte is fetched without carrying into its page
+            high = (value & 0xFF00) | ((value + 1) & 0xFF)
+            low_read = _constant_operand(cpu, value)
+            high_read = _constant_operand(cpu, high)
+            block.exit(f"{low_read.read} | {high_read.read} << 8", cycles)
+            ended = True
+        elif name == "JSR":
+            ret = (pc + 2) & 0xFFFF
+            block.emit(_push(ret >> 8) + _push(ret & 0xFF))
+            block.written.add("s")
+            block.exit(value, cycles)
+            ended = True
+        elif name == "RTS":
+            block.emit(_pull("t") + _pull("m"))
+            block.written.add("s")
+            block.exit("(t | m << 8) + 1 & 0xFFFF", cycles)
+            ended = True
+        elif name == "RTI":
+            block.emit(_pull("t") + UNPACK_STATUS + _pull("m") + _pull("t"))
+            block.written.update("snvdizc")
+            block.exit("m | t << 8", cycles)
+            ended = True
+        elif name == "BRK":
+            ret = (pc + 2) & 0xFFFF
+            block.emit(_push(ret >> 8) + _push(ret & 0xFF) + _push(PACK_STATUS + " | 0x10") + ["i = 1"])
+            block.written.update("si")
+            block.exit(cpu.read_word(IRQ_VECTOR), cycles)
+            ended = True
+        elif mode == "rel":
+            target = (next_pc + (value - 0x100 if value & 0x80 else value)) & 0xFFFF
+            taken = cycles + 1 + ((target & 0xFF00) != (next_pc & 0xFF00))
+            block.emit([f"if {BRANCHES[name]}:"])
+            block.exit(target, taken, indent=2)
+            block.cycles += cycles
+        else:
+            operand = None if mode in ("imp", "acc") else _operand(cpu, name, mode, value)
+            if operand is not None:
+                if operand.io:
+                    block.cycles += cycles
+                    block.flush()
+                    cycles = 0
+                block.emit(operand.setup)
+            lines, written = _semantics(name, operand)
+            block.emit(lines)
+            block.written.update(written)
+            block.cycles += cycles
+        pc = next_pc
+        if ended:
+            break
+    if not ended:
+        block.exit(pc, 0)
+
+    body = block.lines
+    used = [r for r in REGISTERS if any(_mentions(line, r) for line in body)]
+    source = "\n".join(
+        ["def make(cpu, ram, sram, prg, read, write):", "  def block():"]
+        + [f"      {r} = cpu.{r}" for r in used]
+        + ["  " + line for line in body]
+        + ["  return block"])
+    length = (pc - start) & 0xFFFF
+    code = bytes(cpu.peek((start + k) & 0xFFFF) for k in range(length))
+    return source, code
+
+
+def _mentions(line, name):
+    # Whether line uses local name as a whole word (not cpu.name)
+    start = 0
+    while True:
+        k = line.find(name, start)
+        if k < 0:
+            return False
+        before = line[k - 1] if k else " "
+        after = line[k + len(name)] if k + len(name) < len(line) else " "
+        if not (before.isalnum() or before in "_.") and not (after.isalnum() or after == "_"):
+            return True
+        start = k + 1
+
+
+if __name__ == "__main__":
+    # Speed check against the NES clock: python smb_cpu.py [frames]
+    from smb_nes import BUTTON_A, BUTTON_B, BUTTON_RIGHT, BUTTON_START, CPU_HZ, Console
+
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 1200
+    console = Console()
+    cpu = console.cpu
+    start = time.perf_counter()
+    for frame in range(frames):
+        # Title screen, Start, then run right jumping every second
+        if frame < 60:
+            buttons = 0
+        elif frame < 70:
+            buttons = BUTTON_START
+        else:
+            buttons = BUTTON_RIGHT | BUTTON_B | (BUTTON_A if frame % 60 < 20 else 0)
+        console.set_buttons(buttons)
+        console.run_frame()
+    elapsed = time.perf_counter() - start
+    executed = cpu.cycles - cpu.idle_cycles
+    print(f"{frames} frames in {elapsed:.3f}s ({frames / elapsed:.0f} frames/s, NES runs 60), "
+          f"{cpu.compiled} blocks compiled")
+    print(f"{cpu.cycles / elapsed / 1e6:.2f} MHz emulated ({cpu.cycles / elapsed / CPU_HZ:.1f}x NES speed); "
+          f"{executed} cycles executed, the rest idle-skipped: {executed / elapsed / 1e6:.2f} MHz executed")
+    print(f"Mario at x {cpu.ram[0x6D] * 256 + cpu.ram[0x86]}, y {cpu.ram[0xCE]}")
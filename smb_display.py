@@ -0,0 +1,229 @@
+import argparse
+
+import pygame
+
+from smb_palette import SLOT_PALETTE
+
+# Presentation of the native-resolution frame. The game draws once into a
+# WIDTH x HEIGHT surface and present() scales it to the window in a single
+# step, straight into the display surface or into buffers allocated once, so
+# nothing is reallocated per frame and draw code never deals with the scale.
+# With dirty rectangles only the regions that changed since the last frame are
+# scaled and pushed to the window; a scroll or a rescale falls back to a flip.
+# An indexed presenter's frame is 8-bit, one palette slot per pixel; the slot
+# colours are applied once per present, so recolouring the whole screen is
+# a 256-entry palette change. SDL only scales between surfaces of one format,
+# so the frame is converted to the window's format a band of STRIP_ROWS rows
+# at a time and each band scaled from there: the frame costs its 60 KB plus a
+# 32 KB strip rather than a full 240 KB window-format copy. scale2x reads
+# the rows either side of each pixel and keeps a whole converted frame.
+
+SCALE_METHODS = ("nearest", "scale2x")
+# More changed regions than this in one frame are pushed as a full flip instead
+MAX_DIRTY_RECTS = 32
+# Rows of an indexed frame converted to the window's format at a time
+STRIP_ROWS = 32
+
+
+def display_options(argv, default_scale=2, default_method="nearest"):
+    # --scale N and --filter {nearest,scale2x} from the command line
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--scale", type=int, default=default_scale)
+    parser.add_argument("--filter", choices=SCALE_METHODS, default=default_method)
+    options, _ = parser.parse_known_args(argv)
+    return max(1, options.scale), options.filter
+
+
+def dirty_rects_option(argv, default=False):
+    # --dirty-rects / --no-dirty-rects from the command line
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--dirty-rects", action=argparse.BooleanOptionalAction, default=default)
+    options, _ = parser.parse_known_args(argv)
+    return options.dirty_rects
+
+
+class DirtyRects:
+    """Native-resolution regions of the frame that changed since the last present.
+
+    Sprites are added every frame with add_sprite() and their rects are kept
+    for one more frame, so the spot a sprite moved away from is pushed too.
+    Anything else that changed (tiles, HUD) goes through add(). take() returns
+    the rects to present, or None when the whole frame must be pushed.
+    """
+
+    def __init__(self, width, height):
+        self.bounds = pygame.Rect(0, 0, width, height)
+        self.rects = []
+        self.sprites = []
+        self.previous_sprites = []
+        self.camera_x = None
+        self.full = True
+
+    def invalidate(self):
+        self.full = True
+
+    def scroll(self, camera_x):
+        # A moved camera changes every pixel
+        if camera_x != self.camera_x:
+            self.camera_x = camera_x
+            self.full = True
+
+    def add(self, rect):
+        self.rects.append(rect)
+
+    def add_sprite(self, rect):
+        self.sprites.append(rect)
+
+    def take(self):
+        rects = None
+        if not self.full:
+            rects = []
+            for rect in self.rects + self.previous_sprites + self.sprites:
+                rect = self.bounds.clip(rect)
+                if rect.w and rect.h:
+                    rects.append(rect)
+            if len(rects) > MAX_DIRTY_RECTS:
+                rects = None
+        self.previous_sprites = self.sprites
+        self.sprites = []
+        self.rects = []
+        self.full = False
+        return rects
+
+
+class Presenter:
+    """Owns the window and the native frame, and scales one onto the other.
+
+    With indexed=True the frame is 8-bit with SLOT_PALETTE and draw code
+    writes palette slots into it; set_palette() chooses the colours shown.
+    """
+
+    def __init__(self, width, height, scale=2, method="nearest", caption=None, indexed=False):
+        self.width = width
+        self.height = height
+        self.indexed = indexed
+        if caption is not None:
+            pygame.display.set_caption(caption)
+        self.window = None
+        self.frame = None
+        self.colors = None
+        self.blank = None
+        self.repaint = True
+        self.set_scale(scale, method)
+
+    def set_scale(self, scale, method=None):
+        # Resize the window at runtime
+        if method is not None:
+            if method not in SCALE_METHODS:
+                raise ValueError(f"unknown scale method {method!r}")
+            self.method = method
+        self.scale = max(1, scale)
+        self.window = pygame.display.set_mode((self.width * self.scale, self.height * self.scale))
+        # A new window has nothing on it yet, so the next present is a full one
+        self.repaint = True
+        if self.frame is None:
+            # Kept across rescales so draw code can hold on to it
+            if self.indexed:
+                # Two surfaces over one pixel buffer: frame keeps SLOT_PALETTE so
+                # slot-indexed blits into it stay byte copies, view carries the
+                # colours and is what gets converted for the window
+                self.pixels = bytearray(self.width * self.height)
+                self.frame = pygame.image.frombuffer(self.pixels, (self.width, self.height), "P")
+                self.frame.set_palette(SLOT_PALETTE)
+                self.view = pygame.image.frombuffer(self.pixels, (self.width, self.height), "P")
+                self.view.set_palette(self.colors or SLOT_PALETTE)
+                # A band of the frame in the window's format, the source for nearest scaling
+                self.strip = pygame.Surface((self.width, STRIP_ROWS)).convert()
+                self.native = None
+            else:
+                # Same pixel format as the window, which the transform destinations require
+                self.frame = self.native = pygame.Surface((self.width, self.height)).convert()
+        # scale2x doubles per pass, so it covers the power-of-two part of the
+        # scale; any remainder is finished with a nearest-neighbour pass
+        self.passes = []
+        if self.method == "scale2x":
+            factor = 2
+            while factor <= self.scale and self.scale % factor == 0:
+                size = (self.width * factor, self.height * factor)
+                self.passes.append(self.window if size == self.window.get_size() else pygame.Surface(size).convert())
+                factor *= 2
+        if self.indexed:
+            # The whole frame in the window's format, for scale2x only
+            self.native = pygame.Surface((self.width, self.height)).convert() if self.passes else None
+
+    def set_palette(self, colors):
+        # Colours of an indexed frame's slots; a changed palette repaints the whole window
+        if colors is not self.colors and colors != self.colors:
+            self.colors = colors
+            self.view.set_palette(colors)
+            self.repaint = True
+
+    def clear(self, color):
+        # Fill the frame; an indexed frame is filled through its buffer, as SDL
+        # fills 8-bit surfaces a byte at a time
+        if not self.indexed:
+            self.frame.fill(color)
+            return
+        if self.blank is None or self.blank[0] != color:
+            self.blank = bytes((color,)) * len(self.pixels)
+        self.pixels[:] = self.blank
+
+    def present(self, rects=None):
+        # rects: native-resolution regions that changed, or None to push the whole frame
+        if self.repaint:
+            rects = None
+            self.repaint = False
+        elif rects is not None and not rects:
+            return
+        if rects is None or self.passes:
+            self._scale_frame()
+        else:
+            for rect in rects:
+                self._scale_rect(rect)
+        if rects is None:
+            pygame.display.flip()
+            return
+        scale = self.scale
+        # scale2x output depends on neighbouring pixels, so grow each region by one
+        grow = 2 if self.passes else 0
+        bounds = self.window.get_rect()
+        pygame.display.update([
+            bounds.clip(pygame.Rect(rect.x * scale, rect.y * scale, rect.w * scale, rect.h * scale)
+                        .inflate(grow * scale, grow * scale))
+            for rect in rects])
+
+    def _scale_frame(self):
+        if self.indexed and not self.passes:
+            self._scale_rect(self.view.get_rect())
+            return
+        if self.indexed:
+            self.native.blit(self.view, (0, 0))
+        source = self.native
+        if self.scale == 1:
+            self.window.blit(source, (0, 0))
+        else:
+            for buffer in self.passes:
+                pygame.transform.scale2x(source, buffer)
+                source = buffer
+            if source is not self.window:
+                pygame.transform.scale(source, self.window.get_size(), self.window)
+
+    def _scale_rect(self, rect):
+        scale = self.scale
+        if self.indexed:
+            if scale == 1:
+                # Converted by the blit itself
+                self.window.blit(self.view, rect, rect)
+                return
+            strip = self.strip
+            for y in range(rect.top, rect.bottom, STRIP_ROWS):
+                band = pygame.Rect(rect.x, y, rect.w, min(STRIP_ROWS, rect.bottom - y))
+                strip.blit(self.view, (0, 0), band)
+                dest = pygame.Rect(band.x * scale, band.y * scale, band.w * scale, band.h * scale)
+                pygame.transform.scale(strip.subsurface((0, 0, band.w, band.h)), dest.size, self.window.subsurface(dest))
+            return
+        if scale == 1:
+            self.window.blit(self.native, rect, rect)
+            return
+        dest = pygame.Rect(rect.x * scale, rect.y * scale, rect.w * scale, rect.h * scale)
+        pygame.transform.scale(self.native.subsurface(rect), dest.size, self.window.subsurface(dest))
@@ -0,0 +1,330 @@
+import numpy as np
+
+from smb_broadphase import ColumnHash
+from smb_fixed import SUBPIXEL_BITS, SUBPIXELS
+
+# Structure-of-arrays Goomba storage. Positions, velocities and on-ground flags
+# live in contiguous arrays and every Goomba is advanced in one vectorized pass.
+# Live enemies are packed into the first `count` slots; removal swaps the last
+# live enemy into the freed slot, so adding and removing are both O(1).
+# Positions and velocities are fixed-point ints (see smb_fixed).
+# Each enemy's tile column is tracked alongside, both in the column array and
+# in a ColumnHash over the same ids, updated only when an enemy changes column.
+# Below SCALAR_LIMIT live enemies the same update runs as a plain loop over
+# Python ints instead: NumPy's fixed cost per call outweighs the work for the
+# handful of Goombas a stock level has on screen.
+
+GOOMBA_SPEED = 0x100  # 1 px/frame
+INITIAL_CAPACITY = 16
+# Live enemies from which update() runs vectorized
+SCALAR_LIMIT = 32
+# Pixels past the edges of the view: spawns are created up to SPAWN_MARGIN
+# ahead of it and live enemies are freed DESPAWN_MARGIN behind it
+SPAWN_MARGIN = 32
+DESPAWN_MARGIN = 64
+
+# Per-enemy arrays and their dtypes
+FIELDS = (
+    ("x", np.int64),
+    ("y", np.int64),
+    ("vel_x", np.int64),
+    ("vel_y", np.int64),
+    ("on_ground", bool),
+    ("ids", np.int64),
+    ("column", np.int64),
+)
+
+
+class EnemyManager:
+    def __init__(self, gravity, tile_size, capacity=INITIAL_CAPACITY):
+        self.gravity = gravity
+        self.tile_size = tile_size
+        # One tile in fixed-point units
+        self.size = tile_size << SUBPIXEL_BITS
+        self.count = 0
+        self.next_id = 0
+        # Stable id -> current slot, since slots move on removal
+        self.index_of = {}
+        self.hash = ColumnHash(self.size)
+        self.capacity = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        for name, dtype in FIELDS:
+            array = np.zeros(capacity, dtype=dtype)
+            if self.capacity:
+                array[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    def add(self, x, y, vel_x=-GOOMBA_SPEED):
+        # Returns the new enemy's stable id
+        if self.count == self.capacity:
+            self._allocate(self.capacity * 2)
+        i = self.count
+        enemy_id = self.next_id
+        self.next_id += 1
+        self.x[i] = x
+        self.y[i] = y
+        self.vel_x[i] = vel_x
+        self.vel_y[i] = 0
+        self.on_ground[i] = False
+        self.ids[i] = enemy_id
+        self.column[i] = self.hash.column(x)
+        self.index_of[enemy_id] = i
+        self.hash.insert(enemy_id, int(self.column[i]))
+        self.count += 1
+        return enemy_id
+
+    def remove(self, enemy_id):
+        i = self.index_of.pop(enemy_id)
+        self.hash.remove(enemy_id)
+        last = self.count - 1
+        if i != last:
+            for name, _ in FIELDS:
+                array = getattr(self, name)
+                array[i] = array[last]
+            self.index_of[int(self.ids[i])] = i
+        self.count = last
+
+    def clear(self):
+        self.count = 0
+        self.index_of.clear()
+        self.hash.clear()
+
+    def snapshot(self):
+        # The live slots of every array packed into one bytes object, for restore()
+        n = self.count
+        return self.next_id, n, b"".join(getattr(self, name)[:n].tobytes() for name, _ in FIELDS)
+
+    def restore(self, state):
+        next_id, n, data = state
+        if n > self.capacity:
+            self._allocate(max(n, self.capacity * 2))
+        offset = 0
+        for name, dtype in FIELDS:
+            getattr(self, name)[:n] = np.frombuffer(data, dtype=dtype, count=n, offset=offset)
+            offset += n * np.dtype(dtype).itemsize
+        self.count = n
+        self.next_id = next_id
+        ids = self.ids[:n].tolist()
+        self.index_of = {enemy_id: i for i, enemy_id in enumerate(ids)}
+        self.hash.clear()
+        for enemy_id, column in zip(ids, self.column[:n].tolist()):
+            self.hash.insert(enemy_id, column)
+
+    def near(self, x):
+        # Slots of enemies that could overlap a one-tile box at x, in slot order
+        index_of = self.index_of
+        return sorted(index_of[enemy_id] for enemy_id in self.hash.near(x))
+
+    def update(self, grid, hold_x=None):
+        # Enemies at or past fixed-point x hold_x stay where they are
+        n = self.count
+        if n == 0:
+            return
+        if n < SCALAR_LIMIT:
+            self._update_scalar(grid, hold_x)
+            return
+        moving = None
+        if hold_x is not None:
+            moving = np.flatnonzero(self.x[:n] < hold_x)
+            if len(moving) == n:
+                moving = None
+        if moving is None:
+            self._move(grid, self.x[:n], self.y[:n], self.vel_x[:n], self.vel_y[:n], self.on_ground[:n])
+        else:
+            # The moving ones are gathered, moved and written back
+            fields = [self.x[moving], self.y[moving], self.vel_x[moving], self.vel_y[moving], self.on_ground[moving]]
+            self._move(grid, *fields)
+            self.x[moving], self.y[moving], self.vel_x[moving], self.vel_y[moving], self.on_ground[moving] = fields
+
+        # Re-bucket only the enemies whose column changed this frame
+        column = self.x[:n] >> grid.tile_shift
+        ids = self.ids
+        for i in np.flatnonzero(column != self.column[:n]).tolist():
+            self.hash.move(int(ids[i]), int(column[i]))
+        self.column[:n] = column
+
+        self.bump()
+
+    def _move(self, grid, x, y, vel_x, vel_y, on_ground):
+        # Gravity, movement and tile collision for the enemies in these arrays, in place
+        size = self.size
+        shift = grid.tile_shift
+
+        # Apply gravity and movement
+        x += vel_x
+        y += vel_y
+        vel_y += self.gravity
+
+        # Vertical collision with solid tiles: snap onto the topmost solid row
+        potential_y = y + vel_y
+        hit, _, _, top, _ = grid.solid_extents(x, potential_y)
+        np.logical_and(hit, vel_y > 0, out=on_ground)
+        y[:] = np.where(on_ground, (top << shift) - size, potential_y)
+        vel_y[on_ground] = 0
+
+        # Turn around at edges: an empty tile one row below the floor row ahead
+        tile_x_left = (x - SUBPIXELS) >> shift
+        tile_x_right = (x + size) >> shift
+        tile_y_below = ((y + size) >> shift) + 1
+        check = on_ground & (tile_y_below < grid.height)
+        rows = np.minimum(np.maximum(tile_y_below, 0), grid.height - 1)
+        left_empty = grid.tiles[rows, np.minimum(np.maximum(tile_x_left, 0), grid.width - 1)] == 0
+        right_empty = grid.tiles[rows, np.minimum(np.maximum(tile_x_right, 0), grid.width - 1)] == 0
+        turn_right = check & (vel_x < 0) & (tile_x_left >= 0) & left_empty
+        turn_left = check & (vel_x > 0) & (tile_x_right < grid.width) & right_empty
+        vel_x[turn_right] = GOOMBA_SPEED
+        vel_x[turn_left] = -GOOMBA_SPEED
+
+    def _update_scalar(self, grid, hold_x):
+        # update() one enemy at a time, with the same results
+        n = self.count
+        size = self.size
+        shift = grid.tile_shift
+        gravity = self.gravity
+        height, width = grid.height, grid.width
+        tiles = grid.tiles
+        solid_extent = grid.solid_extent
+        xs, ys = self.x[:n].tolist(), self.y[:n].tolist()
+        vel_xs, vel_ys = self.vel_x[:n].tolist(), self.vel_y[:n].tolist()
+        on_grounds = self.on_ground[:n].tolist()
+        for i in range(n):
+            x, y, vel_x, vel_y = xs[i], ys[i], vel_xs[i], vel_ys[i]
+            if hold_x is not None and x >= hold_x:
+                continue
+            x += vel_x
+            y += vel_y
+            vel_y += gravity
+            potential_y = y + vel_y
+            extent = solid_extent(x, potential_y)
+            on_ground = extent is not None and vel_y > 0
+            if on_ground:
+                y = (extent[2] << shift) - size
+                vel_y = 0
+                # Turn around at edges: an empty tile one row below the floor row ahead
+                tile_y_below = ((y + size) >> shift) + 1
+                if tile_y_below < height:
+                    row = max(tile_y_below, 0)
+                    if vel_x < 0:
+                        tile_x_left = (x - SUBPIXELS) >> shift
+                        if tile_x_left >= 0 and tiles[row, min(tile_x_left, width - 1)] == 0:
+                            vel_x = GOOMBA_SPEED
+                    elif vel_x > 0:
+                        tile_x_right = (x + size) >> shift
+                        if tile_x_right < width and tiles[row, max(tile_x_right, 0)] == 0:
+                            vel_x = -GOOMBA_SPEED
+            else:
+                y = potential_y
+            xs[i], ys[i], vel_xs[i], vel_ys[i], on_grounds[i] = x, y, vel_x, vel_y, on_ground
+
+        columns = self.column[:n].tolist()
+        ids = self.ids[:n].tolist()
+        for i in range(n):
+            column = xs[i] >> shift
+            if column != columns[i]:
+                self.hash.move(ids[i], column)
+                columns[i] = column
+
+        # bump(), pair by pair in the same order
+        order = sorted(range(n), key=columns.__getitem__)
+        for k in range(1, n):
+            pairs = [(order[j], order[j + k]) for j in range(n - k) if columns[order[j + k]] - columns[order[j]] <= 1]
+            if not pairs:
+                break
+            lefts, rights = [], []
+            for first, second in pairs:
+                dx = xs[second] - xs[first]
+                if dx != 0 and abs(dx) < size and abs(ys[second] - ys[first]) < size:
+                    lefts.append(first if dx > 0 else second)
+                    rights.append(second if dx > 0 else first)
+            for i in lefts:
+                vel_xs[i] = -abs(vel_xs[i])
+            for i in rights:
+                vel_xs[i] = abs(vel_xs[i])
+
+        self.x[:n] = xs
+        self.y[:n] = ys
+        self.vel_x[:n] = vel_xs
+        self.vel_y[:n] = vel_ys
+        self.on_ground[:n] = on_grounds
+        self.column[:n] = columns
+
+    def bump(self):
+        # Enemy-enemy collisions: overlapping enemies turn away from each other.
+        # Enemies sorted by column are compared with the k-th next one for
+        # growing k until no pair is within a column, so the work follows local
+        # density and stays in NumPy
+        n = self.count
+        if n < 2:
+            return
+        size = self.size
+        order = np.argsort(self.column[:n], kind="stable")
+        column = self.column[order]
+        xs = self.x[order]
+        ys = self.y[order]
+        vel_x = self.vel_x
+        for k in range(1, n):
+            near = column[k:] - column[:-k] <= 1
+            if not near.any():
+                break
+            dx = xs[k:] - xs[:-k]
+            near &= (np.abs(dx) < size) & (np.abs(ys[k:] - ys[:-k]) < size) & (dx != 0)
+            first = order[:-k][near]
+            second = order[k:][near]
+            first_is_left = dx[near] > 0
+            left = np.where(first_is_left, first, second)
+            right = np.where(first_is_left, second, first)
+            vel_x[left] = -np.abs(vel_x[left])
+            vel_x[right] = np.abs(vel_x[right])
+
+
+class ActivationWindow:
+    """Spawns level-defined enemies as the camera nears them and frees them once left behind.
+
+    Like SMB1, only enemies within a window around the camera exist at all:
+    spawns are taken in order of x as the window's right edge passes them, and
+    live enemies are freed when they fall out of the level or are left behind
+    the window, so the active count stays bounded however long the level is.
+    Enemies ahead of the window are kept: spawns are consumed once, and the
+    camera moving back left (Mario dying) must not lose Goombas still to come.
+    They are held still until the window reaches them again; update()
+    returns the fixed-point x they are held from, for EnemyManager.update(),
+    so enemies only ever move within the margins of the view.
+    """
+
+    def __init__(self, enemies, spawns, view_width, level_height, spawn_margin=SPAWN_MARGIN,
+                 despawn_margin=DESPAWN_MARGIN):
+        self.enemies = enemies
+        # (x, y) pixel start positions sorted by x, consumed left to right
+        self.spawns = sorted(spawns)
+        self.next_spawn = 0
+        self.view_width = view_width
+        self.level_height = level_height
+        self.spawn_margin = spawn_margin
+        self.despawn_margin = despawn_margin
+
+    def update(self, camera_x):
+        enemies = self.enemies
+        spawns = self.spawns
+        left = camera_x - self.despawn_margin
+        right = camera_x + self.view_width + self.spawn_margin
+        while self.next_spawn < len(spawns) and spawns[self.next_spawn][0] < right:
+            x, y = spawns[self.next_spawn]
+            # Spawns the camera skipped past entirely are dropped, not created
+            if x >= left:
+                enemies.add(x << SUBPIXEL_BITS, y << SUBPIXEL_BITS)
+            self.next_spawn += 1
+
+        n = enemies.count
+        if n:
+            x = enemies.x[:n]
+            gone = (x < left << SUBPIXEL_BITS) | (enemies.y[:n] > self.level_height << SUBPIXEL_BITS)
+            if gone.any():
+                for enemy_id in enemies.ids[:n][gone].tolist():
+                    enemies.remove(enemy_id)
+        return right << SUBPIXEL_BITS
@@ -0,0 +1,17 @@
+# NES-style fixed-point arithmetic. Positions and velocities are plain ints in
+# 1/256 pixel units: the high bits are the pixel, the low byte the subpixel, the
+# same split the ROM keeps in separate pixel and subpixel bytes. Every value the
+# physics uses is an exact multiple of a subpixel, so integer simulation is
+# bit-exact on every machine.
+
+SUBPIXEL_BITS = 8
+SUBPIXELS = 1 << SUBPIXEL_BITS
+
+
+def to_fixed(pixels):
+    return int(round(pixels * SUBPIXELS))
+
+
+def to_pixels(value):
+    # Floor to whole pixels; works on ints and NumPy integer arrays alike
+    return value >> SUBPIXEL_BITS
@@ -0,0 +1,60 @@
+import numpy as np
+import pygame
+
+from smb_palette import GOOMBA_COLOR, MARIO_COLOR, NES_PALETTE, SKY_COLOR, SURFACE_PALETTE, TILE_PALETTE
+from smb_render import LevelRenderer, TileAtlas, draw_sprites
+from smb_sim import HEIGHT, TILE_SIZE, WIDTH, to_pixels
+
+# Frame export at native NES resolution. The render surface is created over
+# the exported buffer itself (pygame.image.frombuffer), so every draw call
+# writes straight into the caller's NumPy array or shared memory and reading a
+# frame never copies or rescales anything.
+
+
+class FrameExporter:
+    """Renders a Game into a 256x240 buffer readable as a NumPy array.
+
+    indexed=True stores one NES_PALETTE index per pixel (shape (240, 256));
+    indexed=False stores RGB (shape (240, 256, 3)). buffer may be any writable
+    buffer of the right size, such as a SharedMemory's buf, or None to
+    allocate one. Needs no display.
+    """
+
+    def __init__(self, game, indexed=True, buffer=None):
+        self.game = game
+        self.indexed = indexed
+        shape = (HEIGHT, WIDTH) if indexed else (HEIGHT, WIDTH, 3)
+        if buffer is None:
+            buffer = np.zeros(shape, dtype=np.uint8)
+        # The exported frame: row-major, so frame[y, x] is the pixel at (x, y)
+        self.frame = np.ndarray(shape, dtype=np.uint8, buffer=buffer)
+        self.surface = pygame.image.frombuffer(self.frame, (WIDTH, HEIGHT), "P" if indexed else "RGB")
+        if indexed:
+            self.surface.set_palette(SURFACE_PALETTE)
+            atlas = TileAtlas(TILE_PALETTE, TILE_SIZE, palette=SURFACE_PALETTE)
+            self.sky = SKY_COLOR
+            mario_color, goomba_color = MARIO_COLOR, GOOMBA_COLOR
+        else:
+            atlas = TileAtlas({tile: NES_PALETTE[index] for tile, index in TILE_PALETTE.items()}, TILE_SIZE)
+            self.sky = NES_PALETTE[SKY_COLOR]
+            mario_color, goomba_color = NES_PALETTE[MARIO_COLOR], NES_PALETTE[GOOMBA_COLOR]
+        self.level_renderer = LevelRenderer(game.level, atlas, self.sky)
+        self.mario_sprite = atlas.make_surface((TILE_SIZE, TILE_SIZE))
+        self.mario_sprite.fill(mario_color)
+        self.goomba_sprite = atlas.make_surface((TILE_SIZE, TILE_SIZE))
+        self.goomba_sprite.fill(goomba_color)
+
+    def render(self):
+        # Draw the current game state into the buffer and return the frame view
+        game = self.game
+        surface = self.surface
+        self.level_renderer.sync(game.tile_changes)
+        surface.fill(self.sky)
+        self.level_renderer.draw(surface, game.camera_x)
+        enemies = game.enemies
+        n = enemies.count
+        draw_sprites(surface, self.goomba_sprite, to_pixels(enemies.x[:n]), to_pixels(enemies.y[:n]), game.camera_x)
+        mario_x = to_pixels(game.mario_x) - game.camera_x
+        if 0 <= mario_x < WIDTH:
+            surface.blit(self.mario_sprite, (mario_x, to_pixels(game.mario_y)))
+        return self.frame
@@ -0,0 +1,107 @@
+import numpy as np
+import pygame
+
+from smb_palette import TRANSPARENT
+
+# Status bar drawn from pre-rendered glyphs. Every character the HUD can show
+# is rasterised once; a field rebuilds its list of glyph blits only when its
+# value changes, so a frame costs one blits() call and no font rendering, and
+# a ticking timer costs a few dict lookups each time it changes.
+
+HUD_CHARACTERS = "0123456789x-"
+
+# SMB1 layout: (field, label, value format, x); labels sit on the top row
+# and values on the row below
+SMB1_FIELDS = (
+    ("score", "MARIO", "{:06d}", 24),
+    ("coins", None, "x{:02d}", 96),
+    ("world", "WORLD", "{}-{}", 144),
+    ("time", "TIME", "{:03d}", 200),
+)
+
+
+def render_text(font, text, color, palette=None):
+    # font.render(text), or with a palette an 8-bit surface in that palette
+    # whose text pixels are palette index color, for slot-indexed frames
+    if palette is None:
+        return font.render(text, True, color)
+    # Without antialiasing font.render() gives an 8-bit surface whose
+    # background index is the colorkey
+    glyph = font.render(text, False, (255, 255, 255))
+    background = glyph.map_rgb(glyph.get_colorkey())
+    pixels = np.where(pygame.surfarray.array2d(glyph) == background, TRANSPARENT, color).astype(np.uint8)
+    surface = pygame.Surface(glyph.get_size(), depth=8)
+    surface.set_palette(palette)
+    pygame.surfarray.blit_array(surface, pixels)
+    surface.set_colorkey(TRANSPARENT, pygame.RLEACCEL)
+    return surface
+
+
+class GlyphAtlas:
+    """Each character of a fixed set rendered once, laid out on a fixed advance."""
+
+    def __init__(self, font, color, characters=HUD_CHARACTERS, palette=None):
+        self.glyphs = {character: render_text(font, character, color, palette) for character in characters}
+        # Fixed cell width so a number does not jitter sideways as its digits change
+        self.advance = max(glyph.get_width() for glyph in self.glyphs.values())
+        self.height = font.get_height()
+
+    def layout(self, text, position):
+        # (surface, position) pairs for text at position, ready for blits()
+        x, y = position
+        glyphs = self.glyphs
+        advance = self.advance
+        return [(glyphs[character], (x + i * advance, y)) for i, character in enumerate(text)]
+
+    def rect(self, text, position):
+        return pygame.Rect(position, (len(text) * self.advance, self.height))
+
+
+class Hud:
+    """The status bar: static labels plus glyph-built value fields.
+
+    set(field, *value) formats and lays out a field only when its value
+    differs from the last one; draw() blits the whole bar and returns the
+    rects of fields that changed since the previous draw. With a palette,
+    color is a palette index (see render_text()).
+    """
+
+    def __init__(self, font, color, fields=SMB1_FIELDS, top=6, palette=None):
+        self.atlas = GlyphAtlas(font, color, palette=palette)
+        value_y = top + font.get_height()
+        self.labels = []
+        self.formats = {}
+        self.positions = {}
+        self.values = {}
+        self.layouts = {}
+        self.rects = {}
+        for field, label, value_format, x in fields:
+            if label is not None:
+                # Labels never change, so they are rendered once here
+                self.labels.append((render_text(font, label, color, palette), (x, top)))
+            self.formats[field] = value_format
+            self.positions[field] = (x, value_y)
+            self.layouts[field] = []
+        self.changed = []
+        self.blit_list = None
+
+    def set(self, field, *value):
+        if self.values.get(field) == value:
+            return
+        self.values[field] = value
+        text = self.formats[field].format(*value)
+        old = self.rects.get(field)
+        rect = self.atlas.rect(text, self.positions[field])
+        # The old text may have been wider than the new one
+        self.changed.append(rect if old is None else rect.union(old))
+        self.rects[field] = rect
+        self.layouts[field] = self.atlas.layout(text, self.positions[field])
+        self.blit_list = None
+
+    def draw(self, target):
+        if self.blit_list is None:
+            self.blit_list = self.labels + [blit for layout in self.layouts.values() for blit in layout]
+        target.blits(self.blit_list, doreturn=False)
+        changed = self.changed
+        self.changed = []
+        return changed
@@ -0,0 +1,211 @@
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from smb_collision import SOLID_TILES, TILE_SIZE, CollisionGrid
+from smb_enemies import DESPAWN_MARGIN, SPAWN_MARGIN
+from smb_fixed import SUBPIXEL_BITS
+
+# On-disk levels: a small header followed by one byte per tile, stored column
+# by column, so the tiles of any column range are one contiguous slice of the
+# file. Levels are memory-mapped rather than read, and StreamingGrid builds
+# collision data only for a window of columns around the camera, so a level
+# tens of thousands of columns wide opens instantly and costs memory only for
+# the part being played.
+
+MAGIC = b"SMBL"
+VERSION = 1
+# magic, version, height in tiles, width in tiles
+HEADER = struct.Struct("<4sHHI")
+
+# Columns generate_level() builds and writes at a time
+GENERATE_CHUNK = 1024
+# Columns per feature section in generated levels, and flat columns at each end
+SECTION_COLUMNS = 16
+
+# Collision window: streamed in chunks of STREAM_CHUNK columns, WINDOW_CHUNKS resident
+STREAM_CHUNK = 16
+WINDOW_CHUNKS = 4
+
+
+class LevelFile:
+    """A level file's header, plus memory-mapped access to its tiles.
+
+    Holds only the path and dimensions, so it is cheap to pass to worker
+    processes; every map() call creates an independent mapping.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path}: truncated level header")
+        magic, version, self.height, self.width = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a level file")
+        if version != VERSION:
+            raise ValueError(f"{path}: unsupported level version {version}")
+        if os.path.getsize(path) < HEADER.size + self.width * self.height:
+            raise ValueError(f"{path}: truncated tile data")
+
+    def map(self, writable=False):
+        # uint8 tiles indexed [ty, tx]. A writable map is copy-on-write:
+        # edits stay private to it and never reach the file
+        columns = np.memmap(self.path, dtype=np.uint8, mode="c" if writable else "r",
+                            offset=HEADER.size, shape=(self.width, self.height))
+        return columns.T
+
+
+def save_level(path, level):
+    # Write a [ty, tx] tile grid (lists or array) as a level file
+    tiles = np.asarray(level, dtype=np.uint8)
+    height, width = tiles.shape
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, height, width))
+        f.write(tiles.T.tobytes())
+
+
+def _generate_section(columns, rng):
+    # Add one feature to a (SECTION_COLUMNS, height) block of a generated level
+    height = columns.shape[1]
+    ground = height - 1
+    feature = rng.integers(6)
+    start = int(rng.integers(2, SECTION_COLUMNS - 8))
+    if feature == 1:
+        # Pit, narrow enough to jump
+        columns[start:start + int(rng.integers(2, 4)), ground] = 0
+    elif feature == 2:
+        # Platform with a question block in it
+        length = int(rng.integers(3, 8))
+        row = ground - int(rng.integers(3, 6))
+        columns[start:start + length, row] = 1
+        columns[start + int(rng.integers(length)), row] = 3
+    elif feature == 3:
+        # Pipe two tiles wide
+        pipe_height = int(rng.integers(2, 4))
+        columns[start:start + 2, ground - pipe_height:ground] = 4
+    elif feature == 4:
+        # Lone question block with a coin above
+        columns[start, ground - 4] = 3
+        columns[start, ground - 5] = 5
+
+
+def generate_level(path, width, seed=0, height=15):
+    # Write a procedurally generated level of width columns, building and writing
+    # GENERATE_CHUNK columns at a time so the whole level never exists in memory
+    rng = np.random.default_rng(seed)
+    last_section = (width - SECTION_COLUMNS) // SECTION_COLUMNS
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, height, width))
+        for start in range(0, width, GENERATE_CHUNK):
+            count = min(GENERATE_CHUNK, width - start)
+            columns = np.zeros((count, height), dtype=np.uint8)
+            columns[:, height - 1] = 1
+            for offset in range(0, count - SECTION_COLUMNS + 1, SECTION_COLUMNS):
+                section = (start + offset) // SECTION_COLUMNS
+                # The start and end of the level stay flat
+                if 0 < section < last_section:
+                    _generate_section(columns[offset:offset + SECTION_COLUMNS], rng)
+            f.write(columns.tobytes())
+
+
+class StreamingGrid(CollisionGrid):
+    """CollisionGrid over a memory-mapped LevelFile.
+
+    tiles is a copy-on-write map of the file, so it is paged in on first
+    access and tile changes stay private to this grid. The solidity mask
+    covers only a window of columns around the camera and is rebuilt one
+    STREAM_CHUNK ahead of it as the camera scrolls (stream()).
+
+    The window spans the view plus margin pixels on either side, plus a
+    column for an entity's own box and the tile it looks at to turn around.
+    Entities have to stay inside it to collide as they would in memory: the
+    default margin is the activation window's, which frees enemies past
+    DESPAWN_MARGIN behind the view and holds them still past SPAWN_MARGIN
+    ahead of it.
+    """
+
+    def __init__(self, level_file, view_width, margin=max(SPAWN_MARGIN, DESPAWN_MARGIN), solid_tiles=SOLID_TILES,
+                 tile_size=TILE_SIZE, stream_chunk=STREAM_CHUNK, window_chunks=WINDOW_CHUNKS):
+        self.tile_size = tile_size
+        self.tile_shift = tile_size.bit_length() - 1 + SUBPIXEL_BITS
+        self.reach = (tile_size - 1) << SUBPIXEL_BITS
+        self.level_file = level_file
+        self.tiles = level_file.map(writable=True)
+        self.height, self.width = self.tiles.shape
+        self.solid_lut = np.zeros(256, dtype=bool)
+        self.solid_lut[list(solid_tiles)] = True
+        # Columns that must be in the window: the view plus margin on both sides
+        margin_columns = -(-margin // tile_size) + 1
+        self.behind = margin_columns
+        self.ahead = view_width // tile_size + 1 + margin_columns
+        self.stream_chunk = stream_chunk
+        self.window_columns = stream_chunk * window_chunks
+        if self.window_columns < self.behind + self.ahead + stream_chunk:
+            raise ValueError("collision window too small for the view and margin")
+        self.solid = np.zeros((self.height + 2, self.window_columns + 2), dtype=bool)
+        self.solid_view = memoryview(self.solid.view(np.uint8))
+        self.origin = None
+        self.loads = 0
+        self._load_window(0)
+
+    def _load_window(self, origin):
+        # Point the mask at columns origin..origin + window_columns, with the
+        # columns either side of it as the border
+        self.origin = origin
+        first = origin - 1
+        last = origin + self.window_columns
+        self.first_column, self.last_column = first, last
+        self.solid[:] = False
+        start, stop = max(first, 0), min(last + 1, self.width)
+        if start < stop:
+            self.solid[1:-1, start - first:stop - first] = self.solid_lut[self.tiles[:, start:stop]]
+        self.loads += 1
+
+    def stream(self, camera_x):
+        column = camera_x // self.tile_size
+        start, stop = column - self.behind, column + self.ahead
+        if start < self.origin or stop > self.origin + self.window_columns:
+            self._load_window(start // self.stream_chunk * self.stream_chunk)
+
+
+if __name__ == "__main__":
+    # Long-level check: python smb_level.py [columns] [frames]
+    # resource is Unix-only, so it stays out of the module that smb_sim imports
+    import resource
+
+    from smb_sim import INPUT_JUMP, INPUT_RIGHT, Game
+
+    columns = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "generated.lvl")
+        start = time.perf_counter()
+        generate_level(path, columns)
+        generated = time.perf_counter() - start
+        start = time.perf_counter()
+        game = Game(path)
+        opened = time.perf_counter() - start
+        # Hold right+jump, idling for two frames at every (re)spawn: Mario
+        # starts overlapping the ground row and running straight away drops
+        # him through it
+        furthest = 0
+        deaths = -1
+        start = time.perf_counter()
+        for frame in range(frames):
+            if game.deaths != deaths:
+                deaths, settle = game.deaths, 2
+            settle -= 1
+            if not game.step(INPUT_RIGHT | INPUT_JUMP if settle < 0 else 0):
+                break
+            furthest = max(furthest, game.camera_x)
+        elapsed = time.perf_counter() - start
+        print(f"{columns} columns: generated in {generated:.3f}s, opened in {opened * 1000:.2f} ms")
+        print(f"{game.frame} frames in {elapsed:.3f}s ({game.frame / elapsed:.0f} frames/s), reached column "
+              f"{furthest // TILE_SIZE}, {game.deaths} deaths, {game.grid.loads} window loads, "
+              f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB")
@@ -0,0 +1,152 @@
+import sys
+import time
+
+from smb_cpu import Cpu
+from smb_ppu import DOTS_PER_CYCLE, DOTS_PER_LINE, FRAME_DOTS, HEIGHT, VBLANK_LINE, WIDTH, Ppu
+from smb_rom import load_rom
+
+# The console around the CPU: frame timing, the PPU (smb_ppu), OAM DMA and
+# controller 1, enough for the ROM's program to run frame by frame. A frame
+# runs the CPU up to the start of vertical blank, raises the NMI the game does
+# all its work in, then runs to the end of the frame. Headless consoles skip
+# drawing; with video=True the PPU renders each frame as vertical blank starts.
+
+CPU_HZ = 1789773
+
+# Controller 1 buttons, in the order the shift register reports them
+BUTTON_A = 0x01
+BUTTON_B = 0x02
+BUTTON_SELECT = 0x04
+BUTTON_START = 0x08
+BUTTON_UP = 0x10
+BUTTON_DOWN = 0x20
+BUTTON_LEFT = 0x40
+BUTTON_RIGHT = 0x80
+
+# CPU cycles an OAM DMA holds the CPU for, plus one when it starts on an odd cycle
+DMA_CYCLES = 513
+
+
+class Console:
+    """An NROM cartridge on the CPU, with controller 1 and the PPU.
+
+    set_buttons() holds down BUTTON_* bits for the frames that follow;
+    run_frame() advances one video frame, after which ppu.slots and
+    ppu.pixels hold it when video is on.
+    """
+
+    def __init__(self, rom=None, video=False):
+        if rom is None:
+            with load_rom() as rom:
+                self._load(rom)
+        else:
+            self._load(rom)
+        self.video = video
+        self.frame = 0
+        self.frame_start = 0
+        self.buttons = 0
+        self.shift = 0
+        self.strobe = False
+
+    def _load(self, rom):
+        if rom.mapper != 0:
+            raise ValueError(f"mapper {rom.mapper} is not supported, only NROM (0)")
+        self.cpu = Cpu(rom.prg, self.io_read, self.io_write)
+        self.ppu = Ppu(rom.chr, rom.mirroring, self.dot, self.cpu.nmi)
+
+    def dot(self):
+        # PPU dot within the current frame
+        return (self.cpu.cycles - self.frame_start) * DOTS_PER_CYCLE
+
+    def set_buttons(self, buttons):
+        self.buttons = buttons
+
+    def io_read(self, address):
+        if address < 0x4000:
+            return self.ppu.read(address & 7)
+        if address == 0x4016:
+            if self.strobe:
+                return 0x40 | self.buttons & 1
+            bit = self.shift & 1
+            # Once all eight buttons are out the register reads 1s
+            self.shift = self.shift >> 1 | 0x80
+            return 0x40 | bit
+        if address == 0x4017:
+            return 0x40
+        return 0
+
+    def io_write(self, address, value):
+        if address < 0x4000:
+            self.ppu.write(address & 7, value)
+        elif address == 0x4014:
+            ram = self.cpu.ram
+            if value < 0x20:
+                start = (value << 8) & 0x7FF
+                data = ram[start:start + 256]
+            else:
+                data = bytes(self.cpu.read((value << 8) + k) for k in range(256))
+            self.ppu.dma(data)
+            self.cpu.cycles += DMA_CYCLES + (self.cpu.cycles & 1)
+        elif address == 0x4016:
+            self.strobe = bool(value & 1)
+            if self.strobe:
+                self.shift = self.buttons
+        # The APU ($4000-$4013, $4015, $4017) is not emulated; its writes are dropped
+
+    def run_frame(self):
+        cpu = self.cpu
+        # Frame lengths alternate so the average is exactly FRAME_DOTS / 3 cycles
+        end = ((self.frame + 1) * FRAME_DOTS) // DOTS_PER_CYCLE
+        self.ppu.start_frame()
+        cpu.run(self.frame_start + VBLANK_LINE * DOTS_PER_LINE // DOTS_PER_CYCLE)
+        if self.video:
+            self.ppu.render()
+        self.ppu.start_vblank()
+        cpu.run(end)
+        self.frame += 1
+        self.frame_start = end
+
+
+if __name__ == "__main__":
+    # Play the ROM: python smb_nes.py [--scale N] [--filter scale2x]
+    # Arrows move, Z is B, X is A, Enter is Start and right Shift is Select
+    import numpy as np
+    import pygame
+
+    from smb_display import Presenter, display_options
+    from smb_timing import FrameScheduler
+
+    KEYS = {
+        pygame.K_x: BUTTON_A, pygame.K_z: BUTTON_B, pygame.K_RSHIFT: BUTTON_SELECT, pygame.K_RETURN: BUTTON_START,
+        pygame.K_UP: BUTTON_UP, pygame.K_DOWN: BUTTON_DOWN, pygame.K_LEFT: BUTTON_LEFT, pygame.K_RIGHT: BUTTON_RIGHT,
+    }
+    pygame.init()
+    scale, method = display_options(sys.argv[1:])
+    presenter = Presenter(WIDTH, HEIGHT, scale, method, "Super Mario Bros. - ROM", indexed=True)
+    frame = np.frombuffer(presenter.pixels, dtype=np.uint8).reshape(HEIGHT, WIDTH)
+    console = Console(video=True)
+
+    def update():
+        keys = pygame.key.get_pressed()
+        console.set_buttons(sum(button for key, button in KEYS.items() if keys[key]))
+        console.run_frame()
+        return True
+
+    def render():
+        # The PPU draws in palette slots, which is what the indexed frame holds
+        frame[:] = console.ppu.slots
+        presenter.set_palette(console.ppu.colors())
+        presenter.present()
+
+    scheduler = FrameScheduler(update, render, 60)
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+        if running:
+            running = scheduler.tick()
+        time.sleep(scheduler.idle_time())
+    timings = scheduler.report()
+    print(f"{timings['fps']:.1f} fps, frame {timings['frame_ms']:.2f} ms, "
+          f"update {timings['update_ms']:.2f} ms, render {timings['render_ms']:.2f} ms")
@@ -0,0 +1,115 @@
+# NES palette and the palette indices the game draws with, shared by every
+# renderer that works in palette indices rather than RGB
+
+# NES Palette (NTSC, from ROM Detectives Wiki)
+# Each color is an (R, G, B) tuple
+NES_PALETTE = [
+    (124, 124, 124), (0, 0, 252), (0, 0, 188), (68, 40, 188), (148, 0, 132), (168, 0, 32), (168, 16, 0), (136, 20, 0),
+    (80, 48, 0), (0, 120, 0), (0, 104, 0), (0, 88, 0), (0, 64, 88), (0, 0, 0), (0, 0, 0), (0, 0, 0),
+    (188, 188, 188), (0, 120, 248), (0, 88, 248), (104, 68, 252), (216, 0, 204), (228, 0, 88), (248, 56, 0), (228, 92, 16),
+    (172, 124, 0), (0, 184, 0), (0, 168, 0), (0, 168, 68), (0, 136, 136), (0, 0, 0), (0, 0, 0), (0, 0, 0),
+    (248, 248, 248), (60, 188, 252), (104, 136, 252), (152, 120, 248), (248, 120, 248), (248, 88, 152), (248, 120, 88), (252, 160, 68),
+    (248, 184, 0), (184, 248, 24), (88, 216, 84), (88, 248, 152), (0, 232, 216), (120, 120, 120), (0, 0, 0), (0, 0, 0),
+    (252, 252, 252), (164, 228, 252), (184, 184, 248), (216, 184, 248), (248, 184, 248), (248, 164, 192), (240, 208, 176), (252, 224, 168),
+    (248, 216, 120), (216, 248, 120), (184, 248, 184), (184, 248, 216), (0, 252, 252), (248, 216, 248), (0, 0, 0), (0, 0, 0)
+]
+
+# Palette index per tile type (matches the colours smb1pyport.py picks)
+TILE_PALETTE = {
+    0: 0x0F,  # Empty: black
+    1: 0x12,  # Ground: blue
+    2: 0x00,  # Empty block: gray
+    3: 0x28,  # Question block: yellow
+    4: 0x1A,  # Pipe: green
+    5: 0x28   # Coin: yellow
+}
+SKY_COLOR = 0x31
+MARIO_COLOR = 0x16
+GOOMBA_COLOR = 0x07
+TEXT_COLOR = 0x30
+
+# NES_PALETTE padded to the 256 entries of an 8-bit surface. SDL only blits
+# between 8-bit surfaces as a byte copy when their whole palettes match, so
+# every palette-indexed surface gets this exact list
+SURFACE_PALETTE = NES_PALETTE + [(0, 0, 0)] * (256 - len(NES_PALETTE))
+
+# Palette slots: the PPU's palette RAM holds 4 background then 4 sprite
+# palettes of 4 colours, and slot-indexed surfaces store a slot per pixel.
+# Slots past the palette RAM are fixed colours the ROM does not set
+PALETTE_SLOTS = 32
+SPRITE_SLOTS = 16
+TRANSPARENT = 32  # see-through sprite and text pixels; never shown
+TEXT_SLOT = 33
+# Drawing palette for every slot-indexed surface. Its entries only have to be
+# distinct and identical across surfaces, which keeps 8-bit blits plain byte
+# copies; the colours on screen come from PaletteRam.colors() at present time
+SLOT_PALETTE = [(i, i, i) for i in range(256)]
+
+# Colour index darkening per fade step: each step drops one brightness row
+FADE_STEPS = 4
+
+
+def fade_index(index, level):
+    # NES palette index after level fade steps toward black
+    index -= 0x10 * level
+    return index if index >= 0 else 0x0F
+
+
+class PaletteRam:
+    """NES palette index per palette slot, with cycling and fades applied on top.
+
+    load() swaps in a whole area palette (overworld, underground, castle)
+    and cycle() animates one slot, like the flashing question block. Both
+    only change the 256 colours colors() returns, so an effect costs the
+    same however much of the screen it covers.
+    """
+
+    def __init__(self, slots, fixed=None):
+        self.slots = [0x0F] * PALETTE_SLOTS
+        self.load(slots)
+        # Colours for slots past the palette RAM, such as TEXT_SLOT
+        self.fixed = {TEXT_SLOT: TEXT_COLOR}
+        if fixed:
+            self.fixed.update(fixed)
+        self.cycles = {}
+        self.fade = 0
+        self.frame = 0
+        self.shown = None
+        self.shown_colors = None
+
+    def load(self, slots, backdrop=None):
+        self.slots[:len(slots)] = [int(index) for index in slots]
+        if backdrop is not None:
+            self.slots[0] = backdrop
+
+    def cycle(self, slot, sequence, period):
+        # Show sequence in slot, period frames per entry; an empty sequence stops it
+        if sequence:
+            self.cycles[slot] = (tuple(sequence), period)
+        else:
+            self.cycles.pop(slot, None)
+
+    def set_fade(self, level):
+        self.fade = min(max(level, 0), FADE_STEPS)
+
+    def tick(self):
+        self.frame += 1
+
+    def indices(self):
+        # NES palette index per slot (palette RAM, then fixed slots in order) after effects
+        indices = list(self.slots)
+        for slot, (sequence, period) in self.cycles.items():
+            indices[slot] = sequence[self.frame // period % len(sequence)]
+        indices += [self.fixed.get(slot, 0x0F) for slot in range(PALETTE_SLOTS, max(self.fixed, default=0) + 1)]
+        if self.fade:
+            indices = [fade_index(index, self.fade) for index in indices]
+        return indices
+
+    def colors(self):
+        # 256-entry surface palette; the same list object while nothing changes
+        indices = self.indices()
+        if indices != self.shown:
+            self.shown = indices
+            colors = [NES_PALETTE[index & 0x3F] for index in indices]
+            self.shown_colors = colors + [(0, 0, 0)] * (256 - len(colors))
+        return self.shown_colors
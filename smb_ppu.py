@@ -0,0 +1,421 @@
+import sys
+import time
+
+import numpy as np
+
+from smb_chr import decode_chr
+from smb_palette import NES_PALETTE
+
+# The PPU: VRAM, palette RAM, OAM and the registers the CPU drives them
+# through, plus a renderer that turns them into a 256x240 frame with NumPy.
+# Nothing is drawn dot by dot. The four nametables are kept rendered as one
+# 512x480 plane of palette slots, updated a tile at a time as VRAM changes,
+# and a frame is cut out of that plane in bands of scanlines that share a
+# scroll position. Scroll writes during the visible part of the frame (the
+# status bar split) start a new band at the next scanline; sprites are
+# composited once per frame.
+#
+# Pixels are palette slots, as in smb_palette: 4 * palette + colour for the
+# background, 16 + 4 * palette + colour for sprites, 0 for the backdrop. The
+# palette RAM maps them to NES_PALETTE indices.
+
+# PPU dots: 3 per CPU cycle, 341 per scanline, 262 scanlines per frame
+DOTS_PER_CYCLE = 3
+DOTS_PER_LINE = 341
+LINES_PER_FRAME = 262
+VISIBLE_LINES = 240
+VBLANK_LINE = 241
+PRERENDER_LINE = 261
+FRAME_DOTS = DOTS_PER_LINE * LINES_PER_FRAME
+# Dot at which the scroll's horizontal bits are reloaded for the next scanline
+HORIZONTAL_RELOAD_DOT = 257
+
+WIDTH = 256
+HEIGHT = 240
+PLANE_WIDTH = 2 * WIDTH
+PLANE_HEIGHT = 2 * HEIGHT
+
+# Logical nametable -> physical nametable per iNES mirroring
+MIRRORING = {"horizontal": (0, 0, 1, 1), "vertical": (0, 1, 0, 1), "four-screen": (0, 1, 2, 3)}
+
+
+class Ppu:
+    """The PPU as the CPU sees it, and the frames it produces.
+
+    dot() gives the current dot within the frame and nmi() raises the CPU's
+    NMI. render() draws the frame so far into slots (palette slots) and
+    pixels (NES_PALETTE indices); the console calls it at the start of
+    vertical blank.
+    """
+
+    def __init__(self, chr_data, mirroring, dot, nmi):
+        self.dot = dot
+        self.nmi = nmi
+        self.mirroring = MIRRORING[mirroring]
+        # No CHR-ROM means 8 KB of CHR-RAM the program fills in
+        self.chr_ram = not len(chr_data)
+        self.chr = bytearray(0x2000) if self.chr_ram else bytes(chr_data)
+        self.patterns = decode_chr(self.chr)
+        self.patterns_dirty = False
+        self.vram = bytearray(0x400 * (max(self.mirroring) + 1))
+        self.palette = bytearray(32)
+        self.oam = bytearray(256)
+        self.oam_address = 0
+        self.ctrl = 0
+        self.mask = 0
+        self.vblank = False
+        self.read_buffer = 0
+        # Loopy registers: current and temporary VRAM address, fine X, write toggle
+        self.v = 0
+        self.t = 0
+        self.fine_x = 0
+        self.w = 0
+        # Scroll bands of the frame being drawn: (first scanline, x, y at that scanline)
+        self.bands = []
+        self.sprite0_line = None
+        # Background plane: the four nametables as palette slots, and a copy
+        # extended by half its size right and down so any 256x240 window of
+        # it, wrapping included, is a plain slice
+        self.plane = np.zeros((PLANE_HEIGHT, PLANE_WIDTH), dtype=np.uint8)
+        self.wrapped = np.zeros((PLANE_HEIGHT + HEIGHT, PLANE_WIDTH + WIDTH), dtype=np.uint8)
+        self.dirty = np.ones((len(self.vram) // 0x400, 30, 32), dtype=bool)
+        self.plane_dirty = True
+        self.slots = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+        self.pixels = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+        self.sprite_slots = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+        self.sprite_behind = np.zeros((HEIGHT, WIDTH), dtype=bool)
+        self.shown = None
+        self.shown_colors = None
+        self.start_frame()
+
+    # Frame timing
+
+    def start_frame(self):
+        # Pre-render line: flags clear and, when rendering, the scroll reloads from t
+        self.vblank = False
+        self.sprite0_line = None
+        if self.rendering():
+            self.v = self.t
+        self.bands = [(0, self._scroll_x(), self._scroll_y())]
+
+    def start_vblank(self):
+        if self.sprite0_line is None:
+            self.sprite0_line = self._find_sprite0_hit()
+        self.vblank = True
+        if self.ctrl & 0x80:
+            self.nmi()
+
+    def rendering(self):
+        return self.mask & 0x18
+
+    def _scroll_x(self):
+        return (self.t >> 10 & 1) * WIDTH + (self.t & 0x1F) * 8 + self.fine_x
+
+    def _scroll_y(self):
+        v = self.v
+        return (v >> 11 & 1) * HEIGHT + (v >> 5 & 0x1F) * 8 + (v >> 12 & 7)
+
+    def _scroll_changed(self, reload_y=False):
+        # A scroll write in the visible frame takes effect from the next
+        # horizontal reload; a write to v (reload_y) moves the vertical
+        # position too. Later writes only set up the next frame, which
+        # start_frame() picks up from t.
+        dot = self.dot()
+        line = dot // DOTS_PER_LINE
+        if line >= VISIBLE_LINES:
+            return
+        line += 1 if dot % DOTS_PER_LINE < HORIZONTAL_RELOAD_DOT else 2
+        first, x, y = self.bands[-1]
+        y = self._scroll_y() if reload_y else y + line - first
+        if line == first:
+            self.bands[-1] = (line, self._scroll_x(), y)
+        else:
+            self.bands.append((line, self._scroll_x(), y))
+
+    # Registers
+
+    def read(self, register):
+        if register == 2:
+            status = self.vblank << 7 | self._sprite0_hit() << 6
+            self.vblank = False
+            self.w = 0
+            return status
+        if register == 4:
+            return self.oam[self.oam_address]
+        if register == 7:
+            address = self.v & 0x3FFF
+            if address >= 0x3F00:
+                # Palette reads are not buffered
+                value = self.palette[self._palette_index(address)]
+                self.read_buffer = self._read_vram(address - 0x1000)
+            else:
+                value = self.read_buffer
+                self.read_buffer = self._read_vram(address)
+            self._increment()
+            return value
+        return 0
+
+    def write(self, register, value):
+        if register == 0:
+            enable_nmi = value & 0x80 and not self.ctrl & 0x80
+            if (value ^ self.ctrl) & 0x10:
+                # Background pattern table switched: every tile changes
+                self.dirty[:] = True
+                self.plane_dirty = True
+            self.ctrl = value
+            self.t = (self.t & ~0xC00) | (value & 3) << 10
+            self._scroll_changed()
+            # Turning NMIs on during vertical blank raises one straight away
+            if enable_nmi and self.vblank:
+                self.nmi()
+        elif register == 1:
+            self.mask = value
+        elif register == 3:
+            self.oam_address = value
+        elif register == 4:
+            self.oam[self.oam_address] = value
+            self.oam_address = (self.oam_address + 1) & 0xFF
+        elif register == 5:
+            if not self.w:
+                self.t = (self.t & ~0x1F) | value >> 3
+                self.fine_x = value & 7
+                self._scroll_changed()
+            else:
+                self.t = (self.t & ~0x73E0) | (value & 7) << 12 | (value >> 3) << 5
+            self.w ^= 1
+        elif register == 6:
+            if not self.w:
+                self.t = (self.t & 0xFF) | (value & 0x3F) << 8
+            else:
+                self.t = (self.t & 0x7F00) | value
+                self.v = self.t
+                self._scroll_changed(reload_y=True)
+            self.w ^= 1
+        elif register == 7:
+            self._write_vram(self.v & 0x3FFF, value)
+            self._increment()
+
+    def dma(self, data):
+        # OAM DMA: 256 bytes starting at the OAM address
+        first = self.oam_address
+        self.oam[first:] = data[:256 - first]
+        self.oam[:first] = data[256 - first:]
+
+    def _increment(self):
+        self.v = (self.v + (32 if self.ctrl & 0x04 else 1)) & 0x7FFF
+
+    @staticmethod
+    def _palette_index(address):
+        index = address & 0x1F
+        # Sprite colour 0 entries mirror the background ones
+        return index & 0x0F if index & 0x13 == 0x10 else index
+
+    def _nametable_offset(self, address):
+        table = address >> 10 & 3
+        return self.mirroring[table] * 0x400 + (address & 0x3FF)
+
+    def _read_vram(self, address):
+        if address < 0x2000:
+            return self.chr[address]
+        if address < 0x3F00:
+            return self.vram[self._nametable_offset(address)]
+        return self.palette[self._palette_index(address)]
+
+    def _write_vram(self, address, value):
+        if address < 0x2000:
+            if self.chr_ram:
+                self.chr[address] = value
+                self.patterns_dirty = True
+        elif address < 0x3F00:
+            offset = self._nametable_offset(address)
+            if self.vram[offset] == value:
+                return
+            self.vram[offset] = value
+            table, cell = divmod(offset, 0x400)
+            if cell < 0x3C0:
+                self.dirty[table, cell >> 5, cell & 0x1F] = True
+            else:
+                # An attribute byte colours a 4x4 block of tiles
+                cell -= 0x3C0
+                row, column = (cell >> 3) * 4, (cell & 7) * 4
+                self.dirty[table, row:row + 4, column:column + 4] = True
+            self.plane_dirty = True
+        else:
+            self.palette[self._palette_index(address)] = value & 0x3F
+
+    # Rendering
+
+    def _update_plane(self):
+        # Redraw the tiles whose nametable or attribute bytes changed
+        if self.patterns_dirty:
+            self.patterns = decode_chr(self.chr)
+            self.patterns_dirty = False
+            self.dirty[:] = True
+        if not self.plane_dirty:
+            return
+        tiles = self.plane.reshape(PLANE_HEIGHT // 8, 8, PLANE_WIDTH // 8, 8)
+        base = 0x100 if self.ctrl & 0x10 else 0
+        vram = np.frombuffer(self.vram, dtype=np.uint8).reshape(-1, 0x400)
+        for table in range(4):
+            physical = self.mirroring[table]
+            rows, columns = np.nonzero(self.dirty[physical])
+            if not len(rows):
+                continue
+            names = vram[physical, rows * 32 + columns].astype(np.intp) + base
+            attributes = vram[physical, 0x3C0 + (rows >> 2) * 8 + (columns >> 2)]
+            palettes = attributes >> ((rows & 2) << 1 | (columns & 2)) & 3
+            pixels = self.patterns[names]
+            tiles[(table >> 1) * 30 + rows, :, (table & 1) * 32 + columns, :] = np.where(
+                pixels == 0, 0, pixels | (palettes << 2).astype(np.uint8)[:, None, None])
+        self.dirty[:] = False
+        self.plane_dirty = False
+        wrapped = self.wrapped
+        wrapped[:PLANE_HEIGHT, :PLANE_WIDTH] = self.plane
+        wrapped[:PLANE_HEIGHT, PLANE_WIDTH:] = self.plane[:, :WIDTH]
+        wrapped[PLANE_HEIGHT:] = wrapped[:HEIGHT]
+
+    def _sprite_pixels(self, index):
+        # (height, 8) 2-bit pixels of sprite index, flipped as its attributes say
+        tile = self.oam[index * 4 + 1]
+        attributes = self.oam[index * 4 + 2]
+        if self.ctrl & 0x20:
+            first = (tile & 1) * 0x100 + (tile & 0xFE)
+            pixels = self.patterns[first:first + 2].reshape(16, 8)
+        else:
+            pixels = self.patterns[(0x100 if self.ctrl & 0x08 else 0) + tile]
+        if attributes & 0x80:
+            pixels = pixels[::-1]
+        if attributes & 0x40:
+            pixels = pixels[:, ::-1]
+        return pixels
+
+    def _background(self, first, last):
+        # Background slots of scanlines first..last as laid out by the scroll bands
+        self._update_plane()
+        out = self.slots[first:last]
+        bands = self.bands
+        for k, (line, x, y) in enumerate(bands):
+            end = bands[k + 1][0] if k + 1 < len(bands) else VISIBLE_LINES
+            start, stop = max(line, first), min(end, last)
+            if start >= stop:
+                continue
+            y = (y + start - line) % PLANE_HEIGHT
+            x %= PLANE_WIDTH
+            out[start - first:stop - first] = self.wrapped[y:y + stop - start, x:x + WIDTH]
+        if not self.mask & 0x02:
+            out[:, :8] = 0
+        return out
+
+    def _find_sprite0_hit(self):
+        # First scanline where an opaque sprite 0 pixel meets an opaque
+        # background pixel, or -1 when they never do
+        if self.mask & 0x18 != 0x18:
+            return -1
+        top = self.oam[0] + 1
+        left = self.oam[3]
+        if top >= VISIBLE_LINES:
+            return -1
+        # Never at x = 255
+        pixels = self._sprite_pixels(0)[:VISIBLE_LINES - top, :WIDTH - 1 - left]
+        background = self._background(top, top + len(pixels))[:, left:left + pixels.shape[1]]
+        hits = (pixels != 0) & (background & 3 != 0)
+        if left < 8 and self.mask & 0x06 != 0x06:
+            hits[:, :8 - left] = False
+        rows = np.flatnonzero(hits.any(axis=1))
+        return top + int(rows[0]) if len(rows) else -1
+
+    def _sprite0_hit(self):
+        # Worked out once a frame, from the state at the first poll (or at
+        # vertical blank), and reported from the scanline after the hit
+        if self.sprite0_line is None:
+            self.sprite0_line = self._find_sprite0_hit()
+        return 0 <= self.sprite0_line < self.dot() // DOTS_PER_LINE
+
+    def render(self):
+        # Draw the frame into slots and pixels
+        slots = self.slots
+        if not self.rendering():
+            slots[:] = 0
+        else:
+            if self.mask & 0x08:
+                self._background(0, VISIBLE_LINES)
+            else:
+                slots[:] = 0
+            if self.mask & 0x10:
+                self._draw_sprites()
+        lookup = np.frombuffer(self.palette, dtype=np.uint8)
+        if self.mask & 0x01:
+            lookup = lookup & 0x30  # greyscale
+        np.take(lookup, slots, out=self.pixels)
+
+    def colors(self):
+        # 256-entry surface palette for slots, like smb_palette.PaletteRam.colors();
+        # the same list object while palette RAM is unchanged
+        palette = bytes(self.palette)
+        if palette != self.shown:
+            self.shown = palette
+            mask = 0x30 if self.mask & 0x01 else 0x3F
+            colors = [NES_PALETTE[index & mask] for index in palette]
+            self.shown_colors = colors + [(0, 0, 0)] * (256 - len(colors))
+        return self.shown_colors
+
+    def _draw_sprites(self):
+        # Lower OAM entries are drawn last so they win, as on the console;
+        # behind-background sprites still hide the ones they cover
+        sprite_slots = self.sprite_slots
+        behind = self.sprite_behind
+        sprite_slots[:] = 0
+        oam = self.oam
+        for index in range(63, -1, -1):
+            top = oam[index * 4] + 1
+            left = oam[index * 4 + 3]
+            if top >= VISIBLE_LINES:
+                continue
+            attributes = oam[index * 4 + 2]
+            pixels = self._sprite_pixels(index)[:VISIBLE_LINES - top, :WIDTH - left]
+            height, width = pixels.shape
+            opaque = pixels != 0
+            np.copyto(sprite_slots[top:top + height, left:left + width], pixels + (16 + (attributes & 3) * 4),
+                      where=opaque)
+            np.copyto(behind[top:top + height, left:left + width], bool(attributes & 0x20), where=opaque)
+        if not self.mask & 0x04:
+            sprite_slots[:, :8] = 0
+        slots = self.slots
+        shown = (sprite_slots != 0) & ~(behind & (slots & 3 != 0))
+        np.copyto(slots, sprite_slots, where=shown)
+
+
+if __name__ == "__main__":
+    # Render timing in ROM mode: python smb_ppu.py [frames]
+    from smb_nes import BUTTON_A, BUTTON_B, BUTTON_RIGHT, BUTTON_START, Console
+
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    console = Console(video=True)
+    ppu = console.ppu
+    render_time = 0.0
+    worst = 0.0
+    render = ppu.render
+
+    def timed_render():
+        global render_time, worst
+        start = time.perf_counter()
+        render()
+        elapsed = time.perf_counter() - start
+        render_time += elapsed
+        worst = max(worst, elapsed)
+
+    ppu.render = timed_render
+    start = time.perf_counter()
+    for frame in range(frames):
+        if frame < 60:
+            buttons = 0
+        elif frame < 70:
+            buttons = BUTTON_START
+        else:
+            buttons = BUTTON_RIGHT | BUTTON_B | (BUTTON_A if frame % 60 < 20 else 0)
+        console.set_buttons(buttons)
+        console.run_frame()
+    elapsed = time.perf_counter() - start
+    print(f"{frames} frames in {elapsed:.3f}s ({frames / elapsed:.0f} frames/s with video, NES runs 60)")
+    print(f"render {render_time / frames * 1000:.3f} ms/frame on average, {worst * 1000:.3f} ms worst "
+          f"(budget 16.6 ms)")
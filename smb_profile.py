@@ -0,0 +1,250 @@
+import argparse
+import json
+import sys
+import tempfile
+import time
+
+import pygame
+
+from smb_hud import render_text
+
+# In-game profiling: named timing zones around the stages of a frame, kept in
+# a fixed-size ring buffer. A zone is a function or method that instrument()
+# registered; while profiling is on it is swapped for a timing wrapper, and
+# while it is off the original is put back, so a disabled profiler adds no
+# work at all to the frame. The recorded zones can be shown in-game by
+# ProfileOverlay (frame-time graph plus a per-zone breakdown) and exported as
+# Chrome trace-event JSON for chrome://tracing or Perfetto.
+
+# Zone events kept: about ten seconds of a dozen zones a frame at 60 fps
+EVENT_CAPACITY = 8192
+# Frame starts kept, for the graph and the per-zone averages
+FRAME_CAPACITY = 600
+# Frames the overlay averages zones over, and how often it re-renders its text
+OVERLAY_FRAMES = 60
+OVERLAY_REFRESH = 30
+# Overlay graph: one column per frame, and the frame budget it marks
+GRAPH_FRAMES = 120
+GRAPH_HEIGHT = 40
+GRAPH_MS = 33.3
+BUDGET_MS = 1000 / 60
+
+
+def profile_options(argv):
+    # --profile (start with profiling on) and --trace PATH (export on exit) from the command line
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--trace", default=None)
+    options, _ = parser.parse_known_args(argv)
+    return options.profile or options.trace is not None, options.trace
+
+
+def _assign(owner, name, value):
+    if isinstance(owner, dict):
+        owner[name] = value
+    else:
+        setattr(owner, name, value)
+
+
+class Profiler:
+    """Timing zones recorded into a ring buffer.
+
+    instrument(owner, name, zone) makes owner.name a zone: an instance's
+    method or any other callable attribute, or with a dict such as a
+    module's globals(), the function owner[name]. frame()
+    marks the start of each frame. Nested zones (a method called from
+    another zone) are recorded as nested events.
+    """
+
+    def __init__(self, event_capacity=EVENT_CAPACITY, frame_capacity=FRAME_CAPACITY, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.enabled = False
+        self.zones = []
+        self.zone_index = {}
+        # (owner, attribute name, original, wrapper) for every instrumented callable
+        self.hooks = []
+        # Ring buffers, preallocated so recording never allocates: zone
+        # index, start and end in clock ns; events_written counts every event
+        # ever recorded, so events_written % capacity is the next slot
+        self.event_capacity = event_capacity
+        self.event_zones = [0] * event_capacity
+        self.event_starts = [0] * event_capacity
+        self.event_ends = [0] * event_capacity
+        self.events_written = 0
+        self.frame_capacity = frame_capacity
+        self.frame_starts = [0] * frame_capacity
+        self.frames_written = 0
+
+    def instrument(self, owner, name, zone=None):
+        zone = name if zone is None else zone
+        if zone not in self.zone_index:
+            self.zone_index[zone] = len(self.zones)
+            self.zones.append(zone)
+        original = owner[name] if isinstance(owner, dict) else getattr(owner, name)
+        hook = (owner, name, original, self._wrap(self.zone_index[zone], original))
+        self.hooks.append(hook)
+        if self.enabled:
+            _assign(owner, name, hook[3])
+
+    def _wrap(self, zone, function):
+        clock = self.clock
+        record = self._record
+
+        def timed(*args, **kwargs):
+            start = clock()
+            result = function(*args, **kwargs)
+            record(zone, start, clock())
+            return result
+        return timed
+
+    def _record(self, zone, start, end):
+        i = self.events_written % self.event_capacity
+        self.event_zones[i] = zone
+        self.event_starts[i] = start
+        self.event_ends[i] = end
+        self.events_written += 1
+
+    def enable(self):
+        if not self.enabled:
+            self.enabled = True
+            for owner, name, _, wrapper in self.hooks:
+                _assign(owner, name, wrapper)
+
+    def disable(self):
+        if self.enabled:
+            self.enabled = False
+            for owner, name, original, _ in self.hooks:
+                _assign(owner, name, original)
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def frame(self):
+        if self.enabled:
+            self.frame_starts[self.frames_written % self.frame_capacity] = self.clock()
+            self.frames_written += 1
+
+    def frames(self, count=None):
+        # Start times of the last count recorded frames (all of them by default), oldest first
+        available = min(self.frames_written, self.frame_capacity)
+        count = available if count is None else min(count, available)
+        return [self.frame_starts[i % self.frame_capacity] for i in range(self.frames_written - count,
+                                                                          self.frames_written)]
+
+    def events(self, since=0):
+        # (zone, start, end) of recorded events starting at or after since, oldest first
+        first = max(0, self.events_written - self.event_capacity)
+        zones, starts, ends = self.event_zones, self.event_starts, self.event_ends
+        capacity = self.event_capacity
+        return [(self.zones[zones[i % capacity]], starts[i % capacity], ends[i % capacity])
+                for i in range(first, self.events_written) if starts[i % capacity] >= since]
+
+    def frame_times(self, count=GRAPH_FRAMES):
+        # Durations of the last count complete frames, in milliseconds
+        starts = self.frames(count + 1)
+        return [(end - start) / 1e6 for start, end in zip(starts, starts[1:])]
+
+    def zone_times(self, count=OVERLAY_FRAMES):
+        # Mean milliseconds per frame spent in each zone over the last count complete frames
+        starts = self.frames(count + 1)
+        if len(starts) < 2:
+            return {}
+        totals = dict.fromkeys(self.zones, 0)
+        last = starts[-1]
+        for zone, start, end in self.events(starts[0]):
+            if start < last:
+                totals[zone] += end - start
+        return {zone: total / 1e6 / (len(starts) - 1) for zone, total in totals.items()}
+
+    def trace(self):
+        # Chrome trace-event JSON object: frames and zones as complete ("X") events, in microseconds
+        events = []
+        starts = self.frames()
+        for start, end in zip(starts, starts[1:]):
+            events.append({"name": "frame", "ph": "X", "ts": start / 1000, "dur": (end - start) / 1000,
+                           "pid": 1, "tid": 1})
+        for zone, start, end in self.events():
+            events.append({"name": zone, "ph": "X", "ts": start / 1000, "dur": (end - start) / 1000,
+                           "pid": 1, "tid": 1})
+        events.sort(key=lambda event: (event["ts"], -event["dur"]))
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.trace(), f)
+
+
+class ProfileOverlay:
+    """The profiler's frame-time graph and per-zone breakdown, drawn over the frame.
+
+    Colours are palette slots when palette is given (see render_text()),
+    which is what a slot-indexed frame needs. draw() returns the rect drawn.
+    """
+
+    def __init__(self, profiler, font, color, background, palette=None):
+        self.profiler = profiler
+        self.font = font
+        self.color = color
+        self.background = background
+        self.palette = palette
+        self.lines = []
+        self.drawn = 0
+
+    def draw(self, target):
+        profiler = self.profiler
+        if profiler.frames_written - self.drawn >= OVERLAY_REFRESH or not self.lines:
+            # Text is re-rendered a couple of times a second, not every frame
+            self.drawn = profiler.frames_written
+            times = profiler.zone_times()
+            self.lines = [render_text(self.font, f"{zone} {ms:.2f}", self.color, self.palette)
+                          for zone, ms in times.items()]
+        line_height = self.font.get_linesize()
+        width = target.get_width()
+        height = max(GRAPH_HEIGHT, len(self.lines) * line_height) + 4
+        rect = pygame.Rect(0, target.get_height() - height, width, height)
+        target.fill(self.background, rect)
+        # Frame-time graph on the left, newest frame on the right, with the budget marked
+        bottom = rect.bottom - 2
+        scale = GRAPH_HEIGHT / GRAPH_MS
+        for x, ms in enumerate(profiler.frame_times()[-GRAPH_FRAMES:]):
+            pygame.draw.line(target, self.color, (2 + x, bottom), (2 + x, bottom - min(GRAPH_HEIGHT, int(ms * scale))))
+        budget = bottom - int(BUDGET_MS * scale)
+        for x in range(2, 2 + GRAPH_FRAMES, 4):
+            target.set_at((x, budget), self.color)
+        # Per-zone milliseconds on the right
+        target.blits([(line, (GRAPH_FRAMES + 8, rect.top + 2 + i * line_height)) for i, line in enumerate(self.lines)],
+                     doreturn=False)
+        return rect
+
+
+if __name__ == "__main__":
+    # Profiler overhead on the headless game: python smb_profile.py [frames]
+    from smb_sim import INPUT_JUMP, INPUT_RIGHT, Game
+
+    frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    profiler = Profiler()
+    game = Game()
+    profiler.instrument(game, "step", "physics")
+    profiler.instrument(game.enemies, "update", "enemies")
+    profiler.instrument(game.grid, "solid_extent", "collision")
+    profiler.instrument(game.grid, "solid_extents", "collision")
+    results = {}
+    for enabled in (False, True, False):
+        if enabled:
+            profiler.enable()
+        else:
+            profiler.disable()
+        start = time.perf_counter()
+        for _ in range(frame_count):
+            profiler.frame()
+            game.step(INPUT_RIGHT | INPUT_JUMP)
+        results.setdefault(enabled, []).append((time.perf_counter() - start) / frame_count * 1e6)
+    print(f"disabled {min(results[False]):.2f} us/frame, enabled {results[True][0]:.2f} us/frame")
+    for zone, ms in profiler.zone_times().items():
+        print(f"{zone:>10}: {ms * 1000:.2f} us/frame")
+    with tempfile.NamedTemporaryFile(suffix=".json") as f:
+        profiler.save_trace(f.name)
+        print(f"trace: {len(profiler.trace()['traceEvents'])} events, {f.seek(0, 2)} bytes")
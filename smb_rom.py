@@ -0,0 +1,144 @@
+import mmap
+import os
+import sys
+import time
+
+# The SMB1 ROM image. 1.asm is a text hex dump ("OFFSET: XX XX ..." with 16
+# bytes per line); parsing it takes thousands of string operations, so it is
+# converted once into a binary iNES file next to it and every later load just
+# memory-maps that file. The header, PRG-ROM and CHR-ROM are exposed as
+# memoryview slices of the mapping, so reading them never copies the image.
+
+ROM_DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "1.asm")
+
+INES_MAGIC = b"NES\x1a"
+INES_HEADER_SIZE = 16
+TRAINER_SIZE = 512
+PRG_BANK_SIZE = 0x4000
+CHR_BANK_SIZE = 0x2000
+# CPU address of the first PRG-ROM byte (mapper 0)
+PRG_START = 0x8000
+
+
+def parse_dump(path):
+    # Bytes of a hex dump, checking that the line offsets run on without gaps
+    data = bytearray()
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            offset, sep, hex_bytes = line.partition(":")
+            try:
+                if not sep or int(offset, 16) != len(data):
+                    raise ValueError
+                data += bytes.fromhex(hex_bytes)
+            except ValueError:
+                raise ValueError(f"{path}:{line_number}: bad hex dump line {line!r}") from None
+    return bytes(data)
+
+
+def cache_path(dump):
+    return os.path.splitext(dump)[0] + ".nes"
+
+
+def build_cache(dump=ROM_DUMP, cache=None):
+    # Convert the dump into a binary image unless the cache is already current;
+    # returns the cache path. The cache carries the dump's modification time,
+    # so replacing the dump with any other version triggers a rebuild
+    if cache is None:
+        cache = cache_path(dump)
+    dump_stat = os.stat(dump)
+    try:
+        if os.stat(cache).st_mtime_ns == dump_stat.st_mtime_ns:
+            return cache
+    except FileNotFoundError:
+        pass
+    data = parse_dump(dump)
+    # Write then rename, so an interrupted build never leaves a truncated cache
+    partial = cache + ".tmp"
+    with open(partial, "wb") as f:
+        f.write(data)
+    os.utime(partial, ns=(dump_stat.st_atime_ns, dump_stat.st_mtime_ns))
+    os.replace(partial, cache)
+    return cache
+
+
+class Rom:
+    """A memory-mapped iNES image.
+
+    header, trainer, prg and chr are read-only memoryview slices of the
+    mapping; close() (or leaving a with block) releases them and the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = memoryview(self.mmap)
+        self.data = data
+        if len(data) < INES_HEADER_SIZE or data[:4] != INES_MAGIC:
+            self.close()
+            raise ValueError(f"{path}: not an iNES image")
+        self.header = data[:INES_HEADER_SIZE]
+        flags6, flags7 = data[6], data[7]
+        self.prg_banks = data[4]
+        self.chr_banks = data[5]
+        self.mapper = (flags7 & 0xF0) | (flags6 >> 4)
+        self.mirroring = "four-screen" if flags6 & 0x08 else "vertical" if flags6 & 0x01 else "horizontal"
+        self.battery = bool(flags6 & 0x02)
+        offset = INES_HEADER_SIZE
+        trainer_size = TRAINER_SIZE if flags6 & 0x04 else 0
+        self.trainer = data[offset:offset + trainer_size]
+        offset += trainer_size
+        prg_size = self.prg_banks * PRG_BANK_SIZE
+        chr_size = self.chr_banks * CHR_BANK_SIZE
+        if len(data) < offset + prg_size + chr_size:
+            self.close()
+            raise ValueError(f"{path}: image shorter than its header declares")
+        self.prg = data[offset:offset + prg_size]
+        offset += prg_size
+        self.chr = data[offset:offset + chr_size]
+
+    def prg_slice(self, address, length):
+        # View of length PRG-ROM bytes at a CPU address; a single 16 KB bank is
+        # mirrored into both halves of $8000-$FFFF
+        offset = (address - PRG_START) % len(self.prg)
+        return self.prg[offset:offset + length]
+
+    def close(self):
+        # Every exported view has to be released before the mapping can close
+        for name in ("header", "trainer", "prg", "chr", "data"):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+                setattr(self, name, None)
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_rom(dump=ROM_DUMP, cache=None):
+    # The ROM from the hex dump, via the binary cache
+    return Rom(build_cache(dump, cache))
+
+
+if __name__ == "__main__":
+    # Cold vs cached load: python smb_rom.py [dump]
+    dump = sys.argv[1] if len(sys.argv) > 1 else ROM_DUMP
+    start = time.perf_counter()
+    parse_dump(dump)
+    parsed = time.perf_counter() - start
+    build_cache(dump)
+    start = time.perf_counter()
+    with load_rom(dump) as rom:
+        loaded = time.perf_counter() - start
+        print(f"{rom.path}: mapper {rom.mapper}, {rom.mirroring} mirroring, "
+              f"PRG {len(rom.prg) // 1024} KB, CHR {len(rom.chr) // 1024} KB")
+    print(f"parse dump {parsed * 1000:.2f} ms, load cached image {loaded * 1000:.3f} ms")
@@ -0,0 +1,237 @@
+import os
+import sys
+import time
+
+from smb_collision import SOLID_TILES, CollisionGrid
+from smb_enemies import ActivationWindow, EnemyManager
+from smb_fixed import SUBPIXEL_BITS, to_pixels
+from smb_level import LevelFile, StreamingGrid
+
+# Headless game simulation: Mario, Goombas and the tile grid with no pygame
+# dependency, so it can be stepped without a window and as fast as the CPU allows.
+# Positions and velocities are fixed-point ints in 1/256 pixel units (smb_fixed);
+# the camera, level data and spawn positions stay in whole pixels.
+
+# Constants
+WIDTH, HEIGHT = 256, 240  # NES resolution
+TILE_SIZE = 16
+LEVEL_WIDTH, LEVEL_HEIGHT = 100, 15
+
+# One tile in fixed-point units
+TILE = TILE_SIZE << SUBPIXEL_BITS
+
+# Physics, in subpixels per frame (per frame squared for gravity)
+GRAVITY = 0x80          # 0.5 px
+JUMP_STRENGTH = -0xA00  # -10 px
+RUN_SPEED = 0x200       # 2 px
+MARIO_START = (50 << SUBPIXEL_BITS, (HEIGHT - TILE_SIZE) << SUBPIXEL_BITS)
+
+# Status bar values: the world shown, and the level timer, which starts at
+# TIME_LIMIT and counts down one unit every TIMER_FRAMES frames like SMB1's
+WORLD = (1, 1)
+TIME_LIMIT = 400
+TIMER_FRAMES = 24
+
+# Input bits, one per button, combined into a per-frame bitmask
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_JUMP = 4
+
+
+def build_level():
+    # Level design (100 tiles wide, 15 tiles high)
+    level = [[0] * LEVEL_WIDTH for _ in range(LEVEL_HEIGHT)]
+    # Ground layer
+    level[14] = [1] * LEVEL_WIDTH
+    # Platform at y=10, x=20-29
+    for x in range(20, 30):
+        level[10][x] = 1
+    # Question block and coin
+    level[8][25] = 3    # Question block
+    level[7][25] = 5    # Coin above it
+    # Pit at x=40-49
+    for x in range(40, 50):
+        level[14][x] = 0
+    # Additional platform at y=8, x=60-70
+    for x in range(60, 70):
+        level[8][x] = 1
+    return level
+
+
+def build_enemy_spawns():
+    # Goomba start positions; each is created when the camera comes within range
+    return [(100, HEIGHT - TILE_SIZE), (150, HEIGHT - TILE_SIZE), (200, HEIGHT - TILE_SIZE)]
+
+
+class Game:
+    """One game instance, advanced a frame at a time by step(buttons).
+
+    level is a [ty, tx] tile grid, a level file (path or LevelFile) to
+    stream from disk, or None for the built-in level.
+    """
+
+    def __init__(self, level=None, spawns=None):
+        if isinstance(level, (str, os.PathLike)):
+            level = LevelFile(level)
+        if isinstance(level, LevelFile):
+            self.grid = StreamingGrid(level, WIDTH, solid_tiles=SOLID_TILES, tile_size=TILE_SIZE)
+        else:
+            self.grid = CollisionGrid(level if level is not None else build_level(), SOLID_TILES, TILE_SIZE)
+        # uint8 tile grid indexed [ty, tx], shared with the collision mask
+        self.level = self.grid.tiles
+        self.enemies = EnemyManager(GRAVITY, TILE_SIZE)
+        self.activation = ActivationWindow(self.enemies, spawns if spawns is not None else build_enemy_spawns(),
+                                           WIDTH, self.grid.height * TILE_SIZE)
+        self.mario_x, self.mario_y = MARIO_START
+        self.mario_vel_x = 0
+        self.mario_vel_y = 0
+        self.on_ground = True
+        self.camera_x = 0
+        self.score = 0
+        self.coins = 0
+        self.world = WORLD
+        self.frame = 0
+        self.complete = False
+        self.deaths = 0
+        # Append-only log of (tx, ty) for every tile change; renderers keep
+        # their own read position in it, so changes made by several steps
+        # between two renders are never missed
+        self.tile_changes = []
+        # (tx, ty) -> tile as loaded, for every tile ever changed, so the
+        # level's state is known without reading the whole grid
+        self.changed_tiles = {}
+        self.grid.stream(self.camera_x)
+        self.activation.update(self.camera_x)
+
+    # Helper functions
+    def set_tile(self, tx, ty, tile):
+        if (tx, ty) not in self.changed_tiles:
+            self.changed_tiles[tx, ty] = int(self.grid.tiles[ty, tx])
+        self.grid.set_tile(tx, ty, tile)
+        self.tile_changes.append((tx, ty))
+
+    def apply_input(self, buttons):
+        self.mario_vel_x = 0
+        if buttons & INPUT_LEFT:
+            self.mario_vel_x = -RUN_SPEED
+        if buttons & INPUT_RIGHT:
+            self.mario_vel_x = RUN_SPEED
+        if buttons & INPUT_JUMP and self.on_ground:
+            self.mario_vel_y = JUMP_STRENGTH
+            self.on_ground = False
+
+    def update_camera(self):
+        self.camera_x = max(0, min(to_pixels(self.mario_x) - WIDTH // 2, self.grid.width * TILE_SIZE - WIDTH))
+
+    def time_left(self):
+        return max(0, TIME_LIMIT - self.frame // TIMER_FRAMES)
+
+    def mario_die(self):
+        self.deaths += 1
+        self.mario_x, self.mario_y = MARIO_START
+        self.mario_vel_x = 0
+        self.mario_vel_y = 0
+        self.on_ground = True
+
+    def step(self, buttons=0):
+        # Advance one frame; returns False once the level is complete
+        grid = self.grid
+        shift = grid.tile_shift
+        self.frame += 1
+
+        # Handle input
+        self.apply_input(buttons)
+
+        # Horizontal movement and collision
+        potential_x = self.mario_x + self.mario_vel_x
+        extent = grid.solid_extent(potential_x, self.mario_y)
+        if extent is not None:
+            if self.mario_vel_x > 0:
+                self.mario_x = (extent[0] << shift) - TILE
+            elif self.mario_vel_x < 0:
+                self.mario_x = (extent[1] + 1) << shift
+        else:
+            self.mario_x = potential_x
+
+        # Vertical movement and collision
+        potential_y = self.mario_y + self.mario_vel_y
+        extent = grid.solid_extent(self.mario_x, potential_y)
+        if extent is not None:
+            min_tx, max_tx, min_ty, max_ty = extent
+            if self.mario_vel_y > 0:
+                self.mario_y = (min_ty << shift) - TILE
+                self.mario_vel_y = 0
+                self.on_ground = True
+            elif self.mario_vel_y < 0:
+                self.mario_y = (max_ty + 1) << shift
+                self.mario_vel_y = 0
+                # Check for question block activation
+                for ty in range(min_ty, max_ty + 1):
+                    for tx in range(min_tx, max_tx + 1):
+                        if grid.tiles[ty, tx] == 3:
+                            self.set_tile(tx, ty, 2)  # Change to empty block
+                            self.score += 100
+        else:
+            self.mario_y = potential_y
+            self.on_ground = False
+
+        # Apply gravity
+        self.mario_vel_y += GRAVITY
+
+        # Check for pit death
+        if self.mario_y > HEIGHT << SUBPIXEL_BITS:
+            self.mario_die()
+
+        # Update enemies
+        enemies = self.enemies
+        enemies.update(grid, self.activation.update(self.camera_x))
+
+        # Enemy collision with Mario, on whole-pixel boxes like pygame.Rect;
+        # only enemies the column hash puts near Mario are tested
+        mario_left, mario_top = to_pixels(self.mario_x), to_pixels(self.mario_y)
+        stomped = []
+        for i in enemies.near(self.mario_x):
+            enemy_left, enemy_top = int(enemies.x[i]) >> SUBPIXEL_BITS, int(enemies.y[i]) >> SUBPIXEL_BITS
+            if abs(enemy_left - mario_left) >= TILE_SIZE or abs(enemy_top - mario_top) >= TILE_SIZE:
+                continue
+            if self.mario_vel_y > 0 and mario_top + TILE_SIZE <= enemy_top + 5:
+                stomped.append(int(enemies.ids[i]))
+                self.score += 100
+                self.mario_vel_y = JUMP_STRENGTH // 2
+            else:
+                self.mario_die()
+        for enemy_id in stomped:
+            enemies.remove(enemy_id)
+
+        # Check for level completion
+        if self.mario_x >= (grid.width - 1) * TILE:
+            self.complete = True
+            return False
+
+        # Update camera and keep the collision window ahead of it
+        self.update_camera()
+        grid.stream(self.camera_x)
+        return True
+
+
+def run(game, inputs, max_frames=None):
+    # Step through an iterable of input bitmasks with no frame cap; returns frames run
+    frames = 0
+    for buttons in inputs:
+        if max_frames is not None and frames >= max_frames:
+            break
+        frames += 1
+        if not game.step(buttons):
+            break
+    return frames
+
+
+if __name__ == "__main__":
+    # Uncapped headless run holding right+jump, reporting simulated frames per second
+    frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    total = 0
+    start = time.perf_counter()
+    while total < frame_count:
+        total += run(Game(), iter(lambda: INPUT_RIGHT | INPUT_JUMP, None), frame_count - total)
+    elapsed = time.perf_counter() - start
+    print(f"{total} frames in {elapsed:.3f}s ({total / elapsed:.0f} frames/s)")
@@ -0,0 +1,172 @@
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+from smb_sim import Game
+
+# Whole-game snapshots for rewind and branching search. Mario's variables and
+# the counters are a tuple of ints, the enemies are their live array slots
+# packed into one bytes object (see EnemyManager.snapshot()), and the tile
+# grid is split into chunks of CHUNK_COLUMNS columns shared copy-on-write: a
+# snapshot holds only the chunks that differ from the level as loaded, and a
+# chunk is copied only in the snapshot after a tile in it changes, so every
+# later snapshot shares it. A snapshot of a level nobody has changed holds no
+# tiles at all, and a snapshot costs a few microseconds at any level width.
+# For a level streamed from disk the level as loaded is the file itself,
+# mapped read-only, so snapshots never read the whole level into memory.
+
+CHUNK_COLUMNS = 16
+# Rewind history: ten seconds at 60 fps
+REWIND_FRAMES = 600
+
+GAME_FIELDS = ("mario_x", "mario_y", "mario_vel_x", "mario_vel_y", "on_ground", "camera_x",
+               "score", "coins", "frame", "complete", "deaths")
+
+
+class Snapshot:
+    __slots__ = ("fields", "enemies", "next_spawn", "chunks")
+
+    def __init__(self, fields, enemies, next_spawn, chunks):
+        self.fields = fields
+        self.enemies = enemies
+        self.next_spawn = next_spawn
+        # Chunk index -> read-only [ty, column] tile array, for changed chunks only
+        self.chunks = chunks
+
+
+class Snapshots:
+    """Takes and restores snapshots of one Game.
+
+    Like the renderers, it follows game.tile_changes to learn which chunks
+    changed since the last take(). restore() puts changed tiles back through
+    the grid and logs them in tile_changes, so renderers redraw them.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        grid = game.grid
+        # The level as loaded, which chunks missing from a snapshot match
+        level_file = getattr(grid, "level_file", None)
+        if level_file is not None:
+            self.base = level_file.map()
+        else:
+            self.base = np.array(grid.tiles)
+            self.base.flags.writeable = False
+        self.chunks = {}
+        self.seen = 0
+        # Chunks changed before now are copied, so they need not match the base
+        self.take()
+
+    def take(self):
+        game = self.game
+        changes = game.tile_changes
+        if len(changes) > self.seen:
+            tiles = game.grid.tiles
+            # A new dict, so snapshots already taken keep the chunks they had
+            chunks = dict(self.chunks)
+            for chunk in {tx // CHUNK_COLUMNS for tx, _ in changes[self.seen:]}:
+                copy = np.array(tiles[:, chunk * CHUNK_COLUMNS:(chunk + 1) * CHUNK_COLUMNS])
+                copy.flags.writeable = False
+                chunks[chunk] = copy
+            self.chunks = chunks
+            self.seen = len(changes)
+        return Snapshot(tuple([getattr(game, field) for field in GAME_FIELDS]), game.enemies.snapshot(),
+                        game.activation.next_spawn, self.chunks)
+
+    def restore(self, snapshot):
+        game = self.game
+        for field, value in zip(GAME_FIELDS, snapshot.fields):
+            setattr(game, field, value)
+        game.enemies.restore(snapshot.enemies)
+        game.activation.next_spawn = snapshot.next_spawn
+        self.take()  # chunks now reflects every change made since the last take()
+        if snapshot.chunks is not self.chunks:
+            grid = game.grid
+            for chunk in self.chunks.keys() | snapshot.chunks.keys():
+                start = chunk * CHUNK_COLUMNS
+                stop = start + CHUNK_COLUMNS
+                target = snapshot.chunks.get(chunk)
+                if target is None:
+                    target = self.base[:, start:stop]
+                rows, columns = np.nonzero(grid.tiles[:, start:stop] != target)
+                if len(rows):
+                    grid.tiles[:, start:stop] = target
+                    grid.refresh(start, stop)
+                    game.tile_changes.extend(zip((columns + start).tolist(), rows.tolist()))
+            self.chunks = snapshot.chunks
+            self.seen = len(game.tile_changes)
+        game.grid.stream(game.camera_x)
+
+
+class Rewind:
+    """A ring of the last `frames` snapshots of a game, newest last.
+
+    push() after every step; back() steps the game back through them.
+    """
+
+    def __init__(self, game, frames=REWIND_FRAMES):
+        self.snapshots = Snapshots(game)
+        self.history = deque(maxlen=frames)
+        self.push()
+
+    def __len__(self):
+        return len(self.history)
+
+    def push(self):
+        self.history.append(self.snapshots.take())
+
+    def back(self, frames=1):
+        # Returns how many frames the game went back; the oldest snapshot is never dropped
+        history = self.history
+        frames = min(frames, len(history) - 1)
+        for _ in range(frames):
+            history.pop()
+        if frames:
+            self.snapshots.restore(history[-1])
+        return frames
+
+
+if __name__ == "__main__":
+    # Snapshot cost and rewind memory over a scripted run:
+    # python smb_snapshot.py [frames]
+    from smb_replay import scripted_inputs, state_hash
+
+    frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    game = Game()
+    rewind = Rewind(game)
+    inputs = list(scripted_inputs(frame_count))
+    hashes = {0: state_hash(game)}
+    take_time = 0.0
+    for buttons in inputs:
+        game.step(buttons)
+        start = time.perf_counter()
+        rewind.push()
+        take_time += time.perf_counter() - start
+        hashes[game.frame] = state_hash(game)
+
+    # Memory held by the history, counting each shared chunk and array once
+    shared = {}
+    for snapshot in rewind.history:
+        for chunk in snapshot.chunks.values():
+            shared[id(chunk)] = chunk.nbytes
+    held = sum(sys.getsizeof(snapshot) + sys.getsizeof(snapshot.fields) + sys.getsizeof(snapshot.enemies[2])
+               for snapshot in rewind.history)
+    snapshot_count = len(rewind)
+
+    # Go back through the whole history, then run the same inputs forward
+    # again: every frame must hash as it did the first time
+    start = time.perf_counter()
+    stepped = rewind.back(len(rewind) - 1)
+    restore_time = time.perf_counter() - start
+    first = game.frame
+    assert state_hash(game) == hashes[first]
+    for buttons in inputs[first:]:
+        game.step(buttons)
+        assert state_hash(game) == hashes[game.frame], game.frame
+    print(f"take {take_time / frame_count * 1e6:.1f} us per frame, back {stepped} frames in "
+          f"{restore_time * 1e6:.0f} us")
+    print(f"{snapshot_count} snapshots: {held // 1024} KB, sharing {len(shared)} tile chunks "
+          f"({sum(shared.values())} bytes)")
+    print(f"replayed frames {first}-{game.frame} after rewinding: state matches")
@@ -0,0 +1,76 @@
+import time
+from collections import deque
+
+# Fixed-timestep frame scheduling: the simulation always advances in whole
+# 1/hz steps taken from an accumulator of real elapsed time, while rendering
+# happens once per loop iteration at whatever rate the display allows.
+
+# Longest real-time gap fed to the accumulator, so a stall (window drag,
+# breakpoint) does not turn into a burst of catch-up steps
+MAX_FRAME_TIME = 0.25
+# Frames of timing history kept for reporting
+HISTORY = 120
+
+
+class FrameScheduler:
+    def __init__(self, update, render, hz=60, max_substeps=5, clock=time.perf_counter):
+        # update() advances one fixed step and returns False to stop; render() draws
+        self.update = update
+        self.render = render
+        self.step_time = 1.0 / hz
+        self.max_substeps = max_substeps
+        self.clock = clock
+        self.accumulator = 0.0
+        self.last_time = None
+        self.steps = 0
+        self.dropped_time = 0.0
+        # Per-tick (frame, update, render) durations in seconds
+        self.history = deque(maxlen=HISTORY)
+
+    def tick(self):
+        # Run the fixed steps that are due, then render once; returns False when update() asks to stop
+        now = self.clock()
+        frame_time = 0.0 if self.last_time is None else min(now - self.last_time, MAX_FRAME_TIME)
+        self.last_time = now
+        self.accumulator += frame_time
+
+        running = True
+        substeps = 0
+        update_start = self.clock()
+        while self.accumulator >= self.step_time:
+            if substeps == self.max_substeps:
+                # Too far behind to catch up: drop the backlog instead of spiralling
+                self.dropped_time += self.accumulator - self.accumulator % self.step_time
+                self.accumulator %= self.step_time
+                break
+            self.accumulator -= self.step_time
+            substeps += 1
+            self.steps += 1
+            if not self.update():
+                running = False
+                break
+        render_start = self.clock()
+        if running:
+            self.render()
+        render_end = self.clock()
+        self.history.append((frame_time, render_start - update_start, render_end - render_start))
+        return running
+
+    def idle_time(self):
+        # Seconds until the next fixed step is due, for the caller to sleep or yield
+        if self.last_time is None:
+            return 0.0
+        return max(0.0, self.step_time - self.accumulator - (self.clock() - self.last_time))
+
+    def report(self):
+        # Mean frame, update and render times in milliseconds plus the measured frame rate
+        if not self.history:
+            return {"fps": 0.0, "frame_ms": 0.0, "update_ms": 0.0, "render_ms": 0.0}
+        count = len(self.history)
+        frame, update, render = (sum(column) / count for column in zip(*self.history))
+        return {
+            "fps": 1.0 / frame if frame else 0.0,
+            "frame_ms": frame * 1000.0,
+            "update_ms": update * 1000.0,
+            "render_ms": render * 1000.0,
+        }
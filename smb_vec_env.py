@@ -0,0 +1,231 @@
+import multiprocessing
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from smb_fixed import SUBPIXEL_BITS
+from smb_sim import HEIGHT, INPUT_JUMP, INPUT_RIGHT, TILE_SIZE, WIDTH, Game
+from smb_snapshot import Snapshots
+
+# Batched stepping of many independent Game instances for play-testing and
+# agent training. Instances are sharded across worker processes; actions,
+# observations, rewards and done flags live in shared memory, so a step sends
+# one short message per worker and never pickles array data.
+
+# Observation: the tile window on screen, one byte per tile, with entities stamped in
+OBS_ROWS = HEIGHT // TILE_SIZE
+OBS_COLUMNS = WIDTH // TILE_SIZE + 1  # the scrolled-in partial column included
+OBS_ENEMY = 6
+OBS_MARIO = 7
+
+
+def observe(game, out):
+    # Write game's visible tile window into out (OBS_ROWS x OBS_COLUMNS uint8)
+    grid = game.grid
+    first = game.camera_x // TILE_SIZE
+    visible = grid.tiles[:, first:first + OBS_COLUMNS]
+    out[:, :visible.shape[1]] = visible
+    out[:, visible.shape[1]:] = 0
+    # Entities are stamped at the tile under their centre
+    centre = (TILE_SIZE // 2) << SUBPIXEL_BITS
+    enemies = game.enemies
+    n = enemies.count
+    if n:
+        columns = ((enemies.x[:n] + centre) >> grid.tile_shift) - first
+        rows = (enemies.y[:n] + centre) >> grid.tile_shift
+        shown = (columns >= 0) & (columns < OBS_COLUMNS) & (rows >= 0) & (rows < OBS_ROWS)
+        out[rows[shown], columns[shown]] = OBS_ENEMY
+    column = ((game.mario_x + centre) >> grid.tile_shift) - first
+    row = (game.mario_y + centre) >> grid.tile_shift
+    if 0 <= column < OBS_COLUMNS and 0 <= row < OBS_ROWS:
+        out[row, column] = OBS_MARIO
+
+
+class _Buffers:
+    # Named views onto one shared memory block holding every per-instance array
+    LAYOUT = (
+        ("actions", np.uint8, ()),
+        ("observations", np.uint8, (OBS_ROWS, OBS_COLUMNS)),
+        ("rewards", np.int32, ()),
+        ("dones", np.bool_, ()),
+    )
+
+    def __init__(self, num_envs, name=None):
+        sizes = [num_envs * int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+                 for _, dtype, shape in self.LAYOUT]
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=sum(sizes))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        offset = 0
+        for (field, dtype, shape), size in zip(self.LAYOUT, sizes):
+            array = np.ndarray((num_envs,) + shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            setattr(self, field, array)
+            offset += size
+
+    def close(self):
+        for field, _, _ in self.LAYOUT:
+            setattr(self, field, None)
+        self.shm.close()
+
+
+class _Shard:
+    # The instances one worker owns, stepping straight into the shared arrays.
+    # Each game is built once; a reset restores the snapshot taken as it was
+    # built (smb_snapshot), which shares the level copy-on-write
+    def __init__(self, buffers, start, stop, level, spawns):
+        self.buffers = buffers
+        self.start = start
+        self.stop = stop
+        self.games = [Game(level, spawns) for _ in range(start, stop)]
+        self.snapshots = [Snapshots(game) for game in self.games]
+        self.initial = [snapshots.take() for snapshots in self.snapshots]
+
+    def reset(self):
+        for i in range(self.start, self.stop):
+            self._reset_one(i)
+            self.buffers.rewards[i] = 0
+            self.buffers.dones[i] = False
+
+    def _reset_one(self, i):
+        game = self.games[i - self.start]
+        snapshots = self.snapshots[i - self.start]
+        snapshots.restore(self.initial[i - self.start])
+        # Nothing renders these games, so the tile change log restore()
+        # extends is dropped rather than kept growing for every episode
+        game.tile_changes.clear()
+        snapshots.seen = 0
+        observe(game, self.buffers.observations[i])
+
+    def step(self):
+        buffers = self.buffers
+        actions = buffers.actions
+        for i in range(self.start, self.stop):
+            game = self.games[i - self.start]
+            score, deaths = game.score, game.deaths
+            running = game.step(int(actions[i]))
+            buffers.rewards[i] = game.score - score
+            # An episode ends on level completion or Mario's death; the
+            # instance restarts immediately and reports the fresh observation
+            done = not running or game.deaths != deaths
+            buffers.dones[i] = done
+            if done:
+                self._reset_one(i)
+            else:
+                observe(game, buffers.observations[i])
+
+
+def _worker(connection, shm_name, num_envs, start, stop, level, spawns):
+    buffers = _Buffers(num_envs, shm_name)
+    shard = _Shard(buffers, start, stop, level, spawns)
+    try:
+        while True:
+            command = connection.recv()
+            if command == "step":
+                shard.step()
+            elif command == "reset":
+                shard.reset()
+            else:
+                break
+            connection.send(None)
+    finally:
+        buffers.close()
+        connection.close()
+
+
+class VecEnv:
+    """Steps num_envs game instances per call, sharded over num_workers processes.
+
+    step(actions) takes one input bitmask per instance and returns
+    (observations, rewards, dones). The returned arrays are views onto shared
+    memory and are overwritten by the next step. With num_workers=0 every
+    instance runs in the calling process.
+    """
+
+    def __init__(self, num_envs, num_workers=None, level=None, spawns=None):
+        if num_workers is None:
+            num_workers = min(num_envs, multiprocessing.cpu_count())
+        self.num_envs = num_envs
+        self.buffers = _Buffers(num_envs)
+        self.connections = []
+        self.processes = []
+        self.local = None
+        if num_workers == 0:
+            self.local = _Shard(self.buffers, 0, num_envs, level, spawns)
+        else:
+            bounds = np.linspace(0, num_envs, num_workers + 1).astype(int)
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                parent, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=_worker,
+                    args=(child, self.buffers.shm.name, num_envs, int(start), int(stop), level, spawns),
+                    daemon=True)
+                process.start()
+                child.close()
+                self.connections.append(parent)
+                self.processes.append(process)
+
+    def _broadcast(self, command):
+        if self.local is not None:
+            getattr(self.local, command)()
+            return
+        for connection in self.connections:
+            connection.send(command)
+        for connection in self.connections:
+            connection.recv()
+
+    def reset(self):
+        self._broadcast("reset")
+        return self.buffers.observations
+
+    def step(self, actions):
+        self.buffers.actions[:] = actions
+        self._broadcast("step")
+        return self.buffers.observations, self.buffers.rewards, self.buffers.dones
+
+    def close(self):
+        if self.buffers is None:
+            return
+        for connection in self.connections:
+            connection.send("close")
+        for process in self.processes:
+            process.join()
+        shm = self.buffers.shm
+        self.buffers.close()
+        shm.unlink()
+        self.buffers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _throughput(num_envs, num_workers, steps):
+    # Instance-steps per second for steps random steps
+    rng = np.random.default_rng(0)
+    actions = rng.choice([INPUT_RIGHT, INPUT_RIGHT | INPUT_JUMP], size=(steps, num_envs))
+    with VecEnv(num_envs, num_workers) as env:
+        env.reset()
+        start = time.perf_counter()
+        for step_actions in actions:
+            env.step(step_actions)
+        elapsed = time.perf_counter() - start
+    return num_envs * steps / elapsed
+
+
+if __name__ == "__main__":
+    # Throughput with one worker, then with num_workers (default: one per
+    # core): python smb_vec_env.py [num_envs] [num_workers] [steps]
+    num_envs = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else min(num_envs, multiprocessing.cpu_count())
+    steps = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    single = _throughput(num_envs, 1, steps)
+    print(f"{num_envs} instances, 1 worker: {single:.0f} steps/s")
+    if num_workers > 1:
+        rate = _throughput(num_envs, num_workers, steps)
+        print(f"{num_envs} instances, {num_workers} workers: {rate:.0f} steps/s "
+              f"({rate / single:.2f}x, {multiprocessing.cpu_count()} cores)")
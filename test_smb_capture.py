@@ -0,0 +1,41 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from smb_capture import Capture, read_capture
+
+WIDTH, HEIGHT = 256, 240
+COLORS = [(i, i, i) for i in range(256)]
+
+
+def noise_frames(count):
+    # Frames zlib cannot shrink, so every one of them reaches the file
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, WIDTH * HEIGHT, dtype=np.uint8).tobytes() for _ in range(count)]
+
+
+def test_capture_round_trip(tmp_path):
+    path = str(tmp_path / "capture.smbc")
+    frames = noise_frames(4)
+    capture = Capture(path, WIDTH, HEIGHT)
+    for pixels in frames:
+        while not capture.grab(pixels, COLORS):
+            time.sleep(0.001)
+    capture.close()
+    decoded = [(frame, colors, pixels.tobytes()) for frame, colors, pixels in read_capture(path)]
+    assert decoded == [(frame, COLORS, pixels) for frame, pixels in enumerate(frames)]
+
+
+@pytest.mark.skipif(not os.path.exists("/dev/full"), reason="needs /dev/full")
+def test_write_failure_is_raised():
+    # Every write to /dev/full fails with ENOSPC
+    capture = Capture("/dev/full", WIDTH, HEIGHT)
+    frames = noise_frames(2)
+    with pytest.raises(OSError):
+        for frame in range(1000):
+            capture.grab(frames[frame % 2], COLORS)
+            time.sleep(0.001)
+    with pytest.raises(OSError):
+        capture.close()
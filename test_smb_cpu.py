@@ -0,0 +1,457 @@
+import random
+
+import pytest
+
+from smb_cpu import OPCODES, Cpu
+
+# The block compiler against a plain 6502 that decodes and executes one
+# instruction at a time, written from the datasheet independently of
+# smb_cpu's tables. Programs run on both from the same state, and registers,
+# flags, RAM, cartridge RAM and the cycle count must agree when they reach
+# HALT. No ROM dump is needed: every program is built here.
+
+HALT = 0xF000
+IRQ_HANDLER = 0xF100
+RTI = 0x40
+NOP = 0xEA
+JMP = 0x4C
+
+# opcode mnemonic mode cycles, official opcodes
+REFERENCE_TABLE = """
+00 BRK imp 7  01 ORA izx 6  05 ORA zp 3  06 ASL zp 5  08 PHP imp 3  09 ORA imm 2  0A ASL acc 2  0D ORA abs 4
+0E ASL abs 6  10 BPL rel 2  11 ORA izy 5  15 ORA zpx 4  16 ASL zpx 6  18 CLC imp 2  19 ORA aby 4  1D ORA abx 4
+1E ASL abx 7  20 JSR abs 6  21 AND izx 6  24 BIT zp 3  25 AND zp 3  26 ROL zp 5  28 PLP imp 4  29 AND imm 2
+2A ROL acc 2  2C BIT abs 4  2D AND abs 4  2E ROL abs 6  30 BMI rel 2  31 AND izy 5  35 AND zpx 4  36 ROL zpx 6
+38 SEC imp 2  39 AND aby 4  3D AND abx 4  3E ROL abx 7  40 RTI imp 6  41 EOR izx 6  45 EOR zp 3  46 LSR zp 5
+48 PHA imp 3  49 EOR imm 2  4A LSR acc 2  4C JMP abs 3  4D EOR abs 4  4E LSR abs 6  50 BVC rel 2  51 EOR izy 5
+55 EOR zpx 4  56 LSR zpx 6  58 CLI imp 2  59 EOR aby 4  5D EOR abx 4  5E LSR abx 7  60 RTS imp 6  61 ADC izx 6
+65 ADC zp 3  66 ROR zp 5  68 PLA imp 4  69 ADC imm 2  6A ROR acc 2  6C JMP ind 5  6D ADC abs 4  6E ROR abs 6
+70 BVS rel 2  71 ADC izy 5  75 ADC zpx 4  76 ROR zpx 6  78 SEI imp 2  79 ADC aby 4  7D ADC abx 4  7E ROR abx 7
+81 STA izx 6  84 STY zp 3  85 STA zp 3  86 STX zp 3  88 DEY imp 2  8A TXA imp 2  8C STY abs 4  8D STA abs 4
+8E STX abs 4  90 BCC rel 2  91 STA izy 6  94 STY zpx 4  95 STA zpx 4  96 STX zpy 4  98 TYA imp 2  99 STA aby 5
+9A TXS imp 2  9D STA abx 5  A0 LDY imm 2  A1 LDA izx 6  A2 LDX imm 2  A4 LDY zp 3  A5 LDA zp 3  A6 LDX zp 3
+A8 TAY imp 2  A9 LDA imm 2  AA TAX imp 2  AC LDY abs 4  AD LDA abs 4  AE LDX abs 4  B0 BCS rel 2  B1 LDA izy 5
+B4 LDY zpx 4  B5 LDA zpx 4  B6 LDX zpy 4  B8 CLV imp 2  B9 LDA aby 4  BA TSX imp 2  BC LDY abx 4  BD LDA abx 4
+BE LDX aby 4  C0 CPY imm 2  C1 CMP izx 6  C4 CPY zp 3  C5 CMP zp 3  C6 DEC zp 5  C8 INY imp 2  C9 CMP imm 2
+CA DEX imp 2  CC CPY abs 4  CD CMP abs 4  CE DEC abs 6  D0 BNE rel 2  D1 CMP izy 5  D5 CMP zpx 4  D6 DEC zpx 6
+D8 CLD imp 2  D9 CMP aby 4  DD CMP abx 4  DE DEC abx 7  E0 CPX imm 2  E1 SBC izx 6  E4 CPX zp 3  E5 SBC zp 3
+E6 INC zp 5  E8 INX imp 2  E9 SBC imm 2  EA NOP imp 2  EC CPX abs 4  ED SBC abs 4  EE INC abs 6  F0 BEQ rel 2
+F1 SBC izy 5  F5 SBC zpx 4  F6 INC zpx 6  F8 SED imp 2  F9 SBC aby 4  FD SBC abx 4  FE INC abx 7
+"""
+REFERENCE = {}
+for _entry in zip(*[iter(REFERENCE_TABLE.split())] * 4):
+    REFERENCE[int(_entry[0], 16)] = (_entry[1], _entry[2], int(_entry[3]))
+
+SIZES = {"imp": 0, "acc": 0, "imm": 1, "zp": 1, "zpx": 1, "zpy": 1, "rel": 1, "izx": 1, "izy": 1,
+         "abs": 2, "abx": 2, "aby": 2, "ind": 2}
+BRANCH_FLAGS = {"BPL": (0x80, 0), "BMI": (0x80, 1), "BVC": (0x40, 0), "BVS": (0x40, 1),
+                "BCC": (0x01, 0), "BCS": (0x01, 1), "BNE": (0x02, 0), "BEQ": (0x02, 1)}
+FLAG_OPS = {"CLC": (0x01, 0), "SEC": (0x01, 1), "CLI": (0x04, 0), "SEI": (0x04, 1),
+            "CLV": (0x40, 0), "CLD": (0x08, 0), "SED": (0x08, 1)}
+
+
+class Reference:
+    """One instruction at a time, on a copy of a Cpu's state and memory map."""
+
+    def __init__(self, cpu):
+        self.a, self.x, self.y, self.s = cpu.a, cpu.x, cpu.y, cpu.s
+        self.p = cpu.status
+        self.pc = cpu.pc
+        self.cycles = cpu.cycles
+        self.ram = bytearray(cpu.ram)
+        self.sram = bytearray(cpu.sram)
+        self.prg = cpu.prg
+
+    def read(self, address):
+        if address < 0x2000:
+            return self.ram[address & 0x7FF]
+        if address >= 0x8000:
+            return self.prg[address - 0x8000]
+        if address >= 0x6000:
+            return self.sram[address - 0x6000]
+        return 0
+
+    def write(self, address, value):
+        if address < 0x2000:
+            self.ram[address & 0x7FF] = value
+        elif 0x6000 <= address < 0x8000:
+            self.sram[address - 0x6000] = value
+
+    def flag(self, mask):
+        return 1 if self.p & mask else 0
+
+    def set_flag(self, mask, on):
+        self.p = self.p | mask if on else self.p & ~mask
+
+    def set_nz(self, value):
+        self.set_flag(0x80, value & 0x80)
+        self.set_flag(0x02, value == 0)
+        return value
+
+    def push(self, value):
+        self.write(0x100 + self.s, value)
+        self.s = (self.s - 1) & 0xFF
+
+    def pull(self):
+        self.s = (self.s + 1) & 0xFF
+        return self.read(0x100 + self.s)
+
+    def run(self, stop=HALT, limit=100000):
+        for _ in range(limit):
+            if self.pc == stop:
+                return
+            self.step()
+        raise AssertionError("reference did not reach HALT")
+
+    def step(self):
+        name, mode, cycles = REFERENCE[self.read(self.pc)]
+        size = SIZES[mode]
+        operand = self.read((self.pc + 1) & 0xFFFF)
+        if size == 2:
+            operand |= self.read((self.pc + 2) & 0xFFFF) << 8
+        address = None
+        crossed = False
+        if mode == "imm":
+            address = (self.pc + 1) & 0xFFFF
+        elif mode == "zp":
+            address = operand
+        elif mode == "zpx":
+            address = (operand + self.x) & 0xFF
+        elif mode == "zpy":
+            address = (operand + self.y) & 0xFF
+        elif mode == "abs":
+            address = operand
+        elif mode in ("abx", "aby"):
+            address = (operand + (self.x if mode == "abx" else self.y)) & 0xFFFF
+            crossed = address >> 8 != operand >> 8
+        elif mode == "izx":
+            pointer = (operand + self.x) & 0xFF
+            address = self.read(pointer) | self.read((pointer + 1) & 0xFF) << 8
+        elif mode == "izy":
+            base = self.read(operand) | self.read((operand + 1) & 0xFF) << 8
+            address = (base + self.y) & 0xFFFF
+            crossed = address >> 8 != base >> 8
+        elif mode == "ind":
+            address = self.read(operand) | self.read((operand & 0xFF00) | ((operand + 1) & 0xFF)) << 8
+        self.pc = (self.pc + 1 + size) & 0xFFFF
+        self.cycles += cycles
+        if crossed and name in ("ORA", "AND", "EOR", "ADC", "SBC", "CMP", "LDA", "LDX", "LDY"):
+            self.cycles += 1
+
+        if name in ("LDA", "LDX", "LDY"):
+            setattr(self, name[2].lower(), self.set_nz(self.read(address)))
+        elif name in ("STA", "STX", "STY"):
+            self.write(address, getattr(self, name[2].lower()))
+        elif name == "ORA":
+            self.a = self.set_nz(self.a | self.read(address))
+        elif name == "AND":
+            self.a = self.set_nz(self.a & self.read(address))
+        elif name == "EOR":
+            self.a = self.set_nz(self.a ^ self.read(address))
+        elif name in ("ADC", "SBC"):
+            m = self.read(address)
+            if name == "SBC":
+                m ^= 0xFF
+            total = self.a + m + self.flag(0x01)
+            signed = (self.a - 256 * (self.a >> 7)) + (m - 256 * (m >> 7)) + self.flag(0x01)
+            self.set_flag(0x40, not -128 <= signed <= 127)
+            self.set_flag(0x01, total > 0xFF)
+            self.a = self.set_nz(total & 0xFF)
+        elif name in ("CMP", "CPX", "CPY"):
+            register = {"CMP": self.a, "CPX": self.x, "CPY": self.y}[name]
+            m = self.read(address)
+            self.set_flag(0x01, register >= m)
+            self.set_nz((register - m) & 0xFF)
+        elif name == "BIT":
+            m = self.read(address)
+            self.set_flag(0x02, self.a & m == 0)
+            self.set_flag(0x80, m & 0x80)
+            self.set_flag(0x40, m & 0x40)
+        elif name in ("ASL", "LSR", "ROL", "ROR"):
+            m = self.a if mode == "acc" else self.read(address)
+            carry = self.flag(0x01)
+            if name == "ASL":
+                self.set_flag(0x01, m & 0x80)
+                m = (m << 1) & 0xFF
+            elif name == "LSR":
+                self.set_flag(0x01, m & 1)
+                m >>= 1
+            elif name == "ROL":
+                self.set_flag(0x01, m & 0x80)
+                m = (m << 1) & 0xFF | carry
+            else:
+                self.set_flag(0x01, m & 1)
+                m = m >> 1 | carry << 7
+            self.set_nz(m)
+            if mode == "acc":
+                self.a = m
+            else:
+                self.write(address, m)
+        elif name in ("INC", "DEC"):
+            self.write(address, self.set_nz((self.read(address) + (1 if name == "INC" else -1)) & 0xFF))
+        elif name in ("INX", "INY", "DEX", "DEY"):
+            register = name[2].lower()
+            setattr(self, register, self.set_nz((getattr(self, register) + (1 if name[0] == "I" else -1)) & 0xFF))
+        elif name in ("TAX", "TAY", "TXA", "TYA", "TSX"):
+            setattr(self, name[2].lower(), self.set_nz(getattr(self, name[1].lower())))
+        elif name == "TXS":
+            self.s = self.x
+        elif name in FLAG_OPS:
+            self.set_flag(*FLAG_OPS[name])
+        elif name == "PHA":
+            self.push(self.a)
+        elif name == "PHP":
+            self.push(self.p | 0x30)
+        elif name == "PLA":
+            self.a = self.set_nz(self.pull())
+        elif name == "PLP":
+            self.p = self.pull() & ~0x10 | 0x20
+        elif name == "JMP":
+            self.pc = address
+        elif name == "JSR":
+            ret = (self.pc - 1) & 0xFFFF
+            self.push(ret >> 8)
+            self.push(ret & 0xFF)
+            self.pc = address
+        elif name == "RTS":
+            low = self.pull()
+            self.pc = ((self.pull() << 8 | low) + 1) & 0xFFFF
+        elif name == "RTI":
+            self.p = self.pull() & ~0x10 | 0x20
+            low = self.pull()
+            self.pc = self.pull() << 8 | low
+        elif name == "BRK":
+            ret = (self.pc + 1) & 0xFFFF
+            self.push(ret >> 8)
+            self.push(ret & 0xFF)
+            self.push(self.p | 0x30)
+            self.set_flag(0x04, 1)
+            self.pc = self.read(0xFFFE) | self.read(0xFFFF) << 8
+        elif name in BRANCH_FLAGS:
+            mask, state = BRANCH_FLAGS[name]
+            if self.flag(mask) == state:
+                target = (self.pc + operand - (0x100 if operand & 0x80 else 0)) & 0xFFFF
+                self.cycles += 1 + (target >> 8 != self.pc >> 8)
+                self.pc = target
+        elif name != "NOP":
+            raise AssertionError(f"reference has no {name}")
+
+
+class Halted(Exception):
+    pass
+
+
+def _halt():
+    raise Halted
+
+
+def make_cpu(code, origin=0x8000):
+    # A Cpu with code at origin in ROM, HALT looping on itself and BRK going to an RTI
+    prg = bytearray([NOP]) * 0x8000
+    prg[origin - 0x8000:origin - 0x8000 + len(code)] = bytes(code)
+    prg[HALT - 0x8000:HALT - 0x8000 + 3] = bytes((JMP, HALT & 0xFF, HALT >> 8))
+    prg[IRQ_HANDLER - 0x8000] = RTI
+    prg[0x7FFC:0x7FFE] = origin.to_bytes(2, "little")
+    prg[0x7FFE:0x8000] = IRQ_HANDLER.to_bytes(2, "little")
+    cpu = Cpu(prg)
+    # HALT's block stops run(), so the cycle count is exactly the program's
+    cpu.blocks[HALT] = _halt
+    return cpu
+
+
+def run_both(cpu, pc=None):
+    # Run cpu and a reference from cpu's current state to HALT; returns the reference
+    if pc is not None:
+        cpu.pc = pc
+    reference = Reference(cpu)
+    reference.run()
+    with pytest.raises(Halted):
+        cpu.run(cpu.cycles + 10 ** 6)
+    assert (cpu.a, cpu.x, cpu.y, cpu.s) == (reference.a, reference.x, reference.y, reference.s)
+    assert cpu.status == reference.p
+    assert cpu.cycles == reference.cycles
+    assert cpu.ram == reference.ram
+    assert cpu.sram == reference.sram
+    return reference
+
+
+def jmp(address):
+    return [JMP, address & 0xFF, address >> 8]
+
+
+def random_state(cpu, rng):
+    cpu.a, cpu.x, cpu.y, cpu.s = (rng.randrange(256) for _ in range(4))
+    cpu.status = rng.randrange(256)
+    cpu.ram[:] = bytes(rng.randrange(256) for _ in range(len(cpu.ram)))
+    cpu.sram[:256] = bytes(rng.randrange(256) for _ in range(256))
+
+
+def random_program(rng, count):
+    # count random instructions, no jumps or interrupts, with forward branches
+    # to instruction boundaries, then JMP HALT
+    opcodes = [opcode for opcode, (name, _, _) in REFERENCE.items()
+               if name not in ("JMP", "JSR", "RTS", "RTI", "BRK")]
+    instructions = []
+    for _ in range(count):
+        opcode = rng.choice(opcodes)
+        mode = REFERENCE[opcode][1]
+        if mode in ("abs", "abx", "aby"):
+            # Mostly inside one memory region, sometimes across into the next
+            region = rng.choice((0x0000, 0x1F00, 0x6000, 0x7F00, 0x8000, 0xFF00))
+            operand = list((region + rng.randrange(0x100 if region & 0xFF00 in (0x1F00, 0x7F00, 0xFF00)
+                                                   else 0x1E00)).to_bytes(2, "little"))
+        else:
+            operand = [rng.randrange(256) for _ in range(SIZES[mode])]
+        instructions.append([opcode] + operand)
+    starts = []
+    address = 0
+    for instruction in instructions:
+        starts.append(address)
+        address += len(instruction)
+    starts.append(address)
+    for k, instruction in enumerate(instructions):
+        if REFERENCE[instruction[0]][1] == "rel":
+            target = starts[min(len(instructions), k + rng.randint(1, 4))]
+            instruction[1] = min(127, target - starts[k + 1])
+            if starts[k + 1] + instruction[1] not in starts:
+                instruction[1] = 0
+    return bytes(byte for instruction in instructions for byte in instruction) + bytes(jmp(HALT))
+
+
+def test_opcode_table():
+    assert OPCODES == REFERENCE
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_random_programs(seed):
+    rng = random.Random(seed)
+    for _ in range(10):
+        cpu = make_cpu(random_program(rng, rng.randint(5, 120)))
+        random_state(cpu, rng)
+        run_both(cpu, 0x8000)
+
+
+def test_adc_sbc_flags():
+    # Every accumulator, operand and carry, against signed and unsigned arithmetic
+    for opcode, sign in ((0x65, 1), (0xE5, -1)):
+        cpu = make_cpu([opcode, 0x10] + jmp(HALT))
+        for a in range(256):
+            for m in range(256):
+                for carry in (0, 1):
+                    cpu.a, cpu.c, cpu.ram[0x10] = a, carry, m
+                    cpu.pc = 0x8000
+                    with pytest.raises(Halted):
+                        cpu.run(cpu.cycles + 100)
+                    signed_a, signed_m = a - 256 * (a >> 7), m - 256 * (m >> 7)
+                    if sign > 0:
+                        unsigned = a + m + carry
+                        signed = signed_a + signed_m + carry
+                        expected_carry = unsigned > 0xFF
+                    else:
+                        unsigned = a - m - (1 - carry)
+                        signed = signed_a - signed_m - (1 - carry)
+                        expected_carry = unsigned >= 0
+                    result = unsigned & 0xFF
+                    status = cpu.status
+                    assert cpu.a == result
+                    assert (status & 0x01, status & 0x40 != 0) == (expected_carry, not -128 <= signed <= 127)
+                    assert (status & 0x02 != 0, status & 0x80) == (result == 0, result & 0x80)
+
+
+def test_compare_flags():
+    for opcode, register in ((0xC5, "a"), (0xE4, "x"), (0xC4, "y")):
+        cpu = make_cpu([opcode, 0x10] + jmp(HALT))
+        for value in range(256):
+            for m in range(256):
+                setattr(cpu, register, value)
+                cpu.ram[0x10] = m
+                cpu.pc = 0x8000
+                with pytest.raises(Halted):
+                    cpu.run(cpu.cycles + 100)
+                status = cpu.status
+                assert status & 0x01 == (value >= m)
+                assert (status & 0x02 != 0, status & 0x80) == (value == m, (value - m) & 0x80)
+
+
+@pytest.mark.parametrize("name", ["ASL", "LSR", "ROL", "ROR"])
+def test_shifts_and_rotates(name):
+    opcodes = {opcode: mode for opcode, (op, mode, _) in REFERENCE.items() if op == name}
+    for opcode, mode in opcodes.items():
+        operand = {"acc": [], "zp": [0x10], "zpx": [0x0E], "abs": [0x10, 0x06], "abx": [0xFE, 0x05]}[mode]
+        cpu = make_cpu([opcode] + operand + jmp(HALT))
+        cpu.x = 2
+        address = {"acc": None, "zp": 0x10, "zpx": 0x10, "abs": 0x610, "abx": 0x600}[mode]
+        for value in range(256):
+            for carry in (0, 1):
+                if address is None:
+                    cpu.a = value
+                else:
+                    cpu.ram[address] = value
+                cpu.c = carry
+                run_both(cpu, 0x8000)
+                result = cpu.a if address is None else cpu.ram[address]
+                if name == "ROR":
+                    assert (result, cpu.c) == (value >> 1 | carry << 7, value & 1)
+                elif name == "ROL":
+                    assert (result, cpu.c) == ((value << 1 | carry) & 0xFF, value >> 7)
+
+
+@pytest.mark.parametrize("next_pc, offset, crosses", [
+    (0x8010, 2, False), (0x80FE, 2, True), (0x80F0, 15, False), (0x80FA, 6, True), (0x80FE, 0, False),
+])
+@pytest.mark.parametrize("taken", [False, True])
+def test_forward_branch_cycles(next_pc, offset, crosses, taken):
+    # SEC or CLC, BCS offset over offset NOPs, JMP HALT
+    origin = next_pc - 3
+    cpu = make_cpu([0x38 if taken else 0x18, 0xB0, offset] + [NOP] * offset + jmp(HALT), origin)
+    start = cpu.cycles
+    run_both(cpu, origin)
+    expected = 2 + (3 + crosses if taken else 2 + 2 * offset) + 3
+    assert cpu.cycles - start == expected
+
+
+@pytest.mark.parametrize("branch", [0x8040, 0x8105, 0x8180])
+@pytest.mark.parametrize("taken", [False, True])
+def test_backward_branch_cycles(branch, taken):
+    # SEC or CLC, JMP to a BCS back to a JMP HALT placed before it
+    origin = branch - 0x40
+    target = origin + 4
+    code = [0x38 if taken else 0x18] + jmp(branch) + jmp(HALT)
+    code += [NOP] * (branch - origin - len(code))
+    code += [0xB0, (target - (branch + 2)) & 0xFF] + jmp(HALT)
+    cpu = make_cpu(code, origin)
+    start = cpu.cycles
+    run_both(cpu, origin)
+    crosses = target >> 8 != (branch + 2) >> 8
+    assert cpu.cycles - start == 2 + 3 + (3 + crosses if taken else 2) + 3
+
+
+def test_brk_and_rti():
+    cpu = make_cpu([0xA9, 0x80, 0x00, NOP, 0x08, 0x68, 0xAA] + jmp(HALT))
+    reference = run_both(cpu, 0x8000)
+    # BRK returns past its padding byte, and the B flag only shows in pushed copies
+    assert cpu.x & 0x10 and not cpu.status & 0x10
+    assert reference.x == cpu.x
+
+
+def test_self_modifying_code():
+    # A RAM routine whose first instruction changes the operand of the one
+    # right after it; later the main program changes one of its opcodes
+    routine = [
+        0xEE, 0x04, 0x02,  # $0200 INC $0204
+        0x69, 0x05,        # $0203 ADC #$05
+        0x85, 0x20,        # $0205 STA $20
+        0xE8,              # $0207 INX, later INY
+        0x60,              # $0208 RTS
+    ]
+    code = [0xA9, 0x00, 0x18, 0xA2, 0x00, 0xA0, 0x00]  # LDA #0, CLC, LDX #0, LDY #0
+    code += [0x20, 0x00, 0x02] * 3                       # JSR $0200 three times
+    code += [0xA9, 0xC8, 0x8D, 0x07, 0x02, 0xA5, 0x20]   # LDA #$C8 (INY), STA $0207, LDA $20
+    code += [0x20, 0x00, 0x02] + jmp(HALT)               # JSR $0200
+    cpu = make_cpu(code)
+    cpu.ram[0x200:0x200 + len(routine)] = bytes(routine)
+    cpu.s = 0xFD
+    run_both(cpu, 0x8000)
+    # Each pass adds the operand as changed just before: 6, 7, 8 and 9
+    assert cpu.ram[0x20] == 6 + 7 + 8 + 9
+    assert (cpu.x, cpu.y) == (3, 1)
@@ -0,0 +1,108 @@
+import numpy as np
+
+import smb_enemies
+
+from smb_enemies import DESPAWN_MARGIN, FIELDS, SPAWN_MARGIN
+from smb_fixed import SUBPIXEL_BITS
+from smb_level import LevelFile, StreamingGrid, generate_level, save_level
+from smb_sim import INPUT_JUMP, INPUT_RIGHT, TILE_SIZE, WIDTH, Game
+
+# A flat 400-column level with a pit at column 48, and Goombas far out along it
+
+
+def pit_level():
+    tiles = np.zeros((15, 400), dtype=np.uint8)
+    tiles[14] = 1
+    tiles[14, 48] = 0
+    return tiles
+
+
+SPAWNS = [(1000, 208), (1100, 208), (1180, 208)]
+
+
+def enemy_state(game):
+    n = game.enemies.count
+    return [getattr(game.enemies, name)[:n].tolist() for name, _ in FIELDS]
+
+
+def play_and_die(game):
+    # Put Mario out by the Goombas, let them spawn, then die: the camera goes
+    # back to the start of the level while they are still alive
+    game.mario_x = 1050 << SUBPIXEL_BITS
+    game.update_camera()
+    game.grid.stream(game.camera_x)
+    for _ in range(10):
+        game.step(0)
+    game.mario_die()
+    for _ in range(120):
+        game.step(0)
+
+
+def test_streamed_enemies_match_in_memory(tmp_path):
+    tiles = pit_level()
+    path = str(tmp_path / "pit.smbl")
+    save_level(path, tiles)
+    streamed, in_memory = Game(path, SPAWNS), Game(tiles, SPAWNS)
+    play_and_die(streamed)
+    play_and_die(in_memory)
+    assert streamed.camera_x == 0
+    assert streamed.enemies.count == len(SPAWNS)
+    assert enemy_state(streamed) == enemy_state(in_memory)
+
+
+def test_enemies_ahead_are_held():
+    game = Game(pit_level(), SPAWNS)
+    play_and_die(game)
+    # Past the spawn edge nothing moves until the camera comes back
+    state = enemy_state(game)
+    game.step(0)
+    assert game.enemies.count == len(SPAWNS)
+    assert enemy_state(game) == state
+
+
+def test_live_enemies_stay_in_collision_window(tmp_path):
+    # Running and dying along a generated level with Goombas all the way: every
+    # tile a moving enemy reads is inside the streamed collision window
+    path = str(tmp_path / "generated.smbl")
+    generate_level(path, 600, seed=2)
+    game = Game(path, [(x, 192) for x in range(120, 600 * 16, 200)])
+    grid = game.grid
+    for frame in range(3000):
+        game.step(INPUT_RIGHT | INPUT_JUMP if frame % 200 > 2 else 0)
+        n = game.enemies.count
+        moving = game.enemies.x[:n] < (game.camera_x + WIDTH + SPAWN_MARGIN) << SUBPIXEL_BITS
+        x = game.enemies.x[:n][moving]
+        assert ((x - (1 << SUBPIXEL_BITS)) >> grid.tile_shift >= grid.first_column).all()
+        assert ((x + (TILE_SIZE << SUBPIXEL_BITS)) >> grid.tile_shift <= grid.last_column).all()
+
+
+def test_collision_window_covers_activation_margins(tmp_path):
+    # With the tightest window that fits, every column from the despawn edge
+    # to a tile past the spawn edge stays loaded at every camera position
+    path = str(tmp_path / "generated.smbl")
+    generate_level(path, 300)
+    level_file = LevelFile(path)
+    grid = StreamingGrid(level_file, WIDTH, stream_chunk=1, window_chunks=28)
+    for camera_x in range(0, (level_file.width - WIDTH // TILE_SIZE) * TILE_SIZE):
+        grid.stream(camera_x)
+        assert grid.first_column <= (camera_x - DESPAWN_MARGIN - 1) // TILE_SIZE
+        assert grid.last_column >= (camera_x + WIDTH + SPAWN_MARGIN + TILE_SIZE) // TILE_SIZE
+
+
+def test_scalar_update_matches_vectorized(tmp_path, monkeypatch):
+    # Goombas close enough to bump into each other, over pits and pipes, with
+    # Mario running through them: both update paths agree frame for frame
+    path = str(tmp_path / "generated.smbl")
+    generate_level(path, 300, seed=4)
+    spawns = [(x + offset, 48 + x % 112) for x in range(100, 300 * 16, 70) for offset in (0, 10)]
+    runs = []
+    for limit in (smb_enemies.SCALAR_LIMIT, 0):
+        monkeypatch.setattr(smb_enemies, "SCALAR_LIMIT", limit)
+        game = Game(path, spawns)
+        states = []
+        for frame in range(2000):
+            game.step(INPUT_RIGHT | INPUT_JUMP if frame % 150 > 2 else 0)
+            states.append(enemy_state(game))
+        runs.append(states)
+    assert max(len(state[0]) for state in runs[0]) > 5
+    assert runs[0] == runs[1]
@@ -0,0 +1,24 @@
+import numpy as np
+
+from smb_reach import LevelAnalyzer, level_variant
+
+
+def test_analyze_many_matches_one_at_a_time():
+    # Levels of two heights and widths, some repeated, checked side by side
+    # give what each gives checked alone
+    rng = np.random.default_rng(3)
+    levels = [level_variant(rng) for _ in range(40)]
+    for _ in range(20):
+        tiles = np.zeros((20, int(rng.integers(20, 120))), dtype=np.uint8)
+        tiles[rng.random(tiles.shape) < 0.08] = 1
+        tiles[-1] = rng.random(tiles.shape[1]) < 0.85
+        levels.append(tiles)
+    levels += levels[:5]
+    batched = LevelAnalyzer(cache_size=0).analyze_many(levels)
+    analyzer = LevelAnalyzer(cache_size=0)
+    alone = [analyzer.analyze(level) for level in levels]
+    assert 0 < sum(analysis.completable for analysis in alone) < len(levels)
+    for one, other in zip(batched, alone):
+        assert one.completable == other.completable
+        assert (one.standing == other.standing).all()
+        assert (one.reached == other.reached).all()
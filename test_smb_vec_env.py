@@ -0,0 +1,26 @@
+import numpy as np
+
+from smb_replay import state_hash
+from smb_sim import INPUT_RIGHT, Game
+from smb_vec_env import OBS_COLUMNS, OBS_ROWS, VecEnv, observe
+
+
+def test_reset_matches_new_game():
+    # An instance that changed a tile and then died restarts as a new Game would
+    fresh = Game()
+    expected = np.zeros((OBS_ROWS, OBS_COLUMNS), dtype=np.uint8)
+    observe(fresh, expected)
+    with VecEnv(1, num_workers=0) as env:
+        env.reset()
+        game = env.local.games[0]
+        game.set_tile(25, 8, 2)
+        for _ in range(2000):
+            observations, _, dones = env.step([INPUT_RIGHT])
+            if dones[0]:
+                break
+        assert dones[0]
+        assert state_hash(game) == state_hash(fresh)
+        assert (game.grid.tiles == fresh.grid.tiles).all()
+        assert (game.grid.solid == fresh.grid.solid).all()
+        assert (observations[0] == expected).all()
+        assert not game.tile_changes